@@ -1,14 +1,33 @@
+import asyncio
+import logging
+import re
 import secrets
+import time
 from dataclasses import dataclass
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional
 from urllib.parse import urlencode
 
-import httpx
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token as google_id_token
+from ..metrics import oauth_duration
+
+# httpx and google.auth are imported on first use: they add a noticeable share
+# of process start-up and are not needed until someone signs in with Google.
+if TYPE_CHECKING:
+    import httpx
 
 GOOGLE_AUTHORIZE_ENDPOINT = "https://accounts.google.com/o/oauth2/v2/auth"
 GOOGLE_TOKEN_ENDPOINT = "https://oauth2.googleapis.com/token"
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = {"accounts.google.com", "https://accounts.google.com"}
+
+CERTS_DEFAULT_TTL = 3600
+CERTS_MIN_TTL = 60
+# Refresh in the background once this share of the max-age has elapsed.
+CERTS_REFRESH_FRACTION = 0.8
+CLOCK_SKEW_SECONDS = 10
+
+logger = logging.getLogger("coffeelog.auth")
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
 
 
 @dataclass(frozen=True)
@@ -53,15 +72,140 @@ async def exchange_code_for_tokens(config: GoogleOAuthConfig, code: str) -> dict
         "grant_type": "authorization_code",
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(GOOGLE_TOKEN_ENDPOINT, data=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    with oauth_duration.time(step="token_exchange"):
+        response = await get_http_client().post(GOOGLE_TOKEN_ENDPOINT, data=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+
+_http_client: Optional["httpx.AsyncClient"] = None
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the app-lifetime client so logins reuse pooled TLS connections to Google."""
+    global _http_client
+    import httpx
+
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _cache_ttl(response: "httpx.Response") -> int:
+    match = _MAX_AGE_PATTERN.search(response.headers.get("cache-control", ""))
+    if not match:
+        return CERTS_DEFAULT_TTL
+    age = int(response.headers.get("age", "0") or 0)
+    return max(CERTS_MIN_TTL, int(match.group(1)) - age)
+
+
+class GoogleCertCache:
+    """Google's ID token signing certificates, cached for their Cache-Control max-age.
+
+    Concurrent callers share one fetch. Once most of the max-age has passed
+    the next caller gets the cached certificates immediately and a refresh
+    runs in the background, so logins never wait on Google while the cache
+    is warm.
+    """
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL):
+        self.url = url
+        self._certs: dict[str, str] = {}
+        self._fetched_at = 0.0
+        self._ttl = 0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _age(self) -> float:
+        return time.monotonic() - self._fetched_at
+
+    async def get(self, force_refresh: bool = False) -> dict[str, str]:
+        if self._certs and not force_refresh:
+            age = self._age()
+            if age < self._ttl * CERTS_REFRESH_FRACTION:
+                return self._certs
+            if age < self._ttl:
+                self._schedule_refresh()
+                return self._certs
+        return await self._refresh(forced=force_refresh)
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self._refresh(forced=False)
+        except Exception:
+            logger.warning("Background refresh of Google certificates failed", exc_info=True)
+
+    async def _refresh(self, forced: bool) -> dict[str, str]:
+        seen_fetch = self._fetched_at
+        async with self._lock:
+            if self._certs and self._fetched_at != seen_fetch:
+                # Another caller refreshed while this one waited for the lock.
+                return self._certs
+            if forced and self._certs and self._age() < CERTS_MIN_TTL:
+                # Tokens with an unknown key id must not turn into a refetch each.
+                return self._certs
+            with oauth_duration.time(step="certs_fetch"):
+                response = await get_http_client().get(self.url)
+                response.raise_for_status()
+            self._certs = response.json()
+            self._ttl = _cache_ttl(response)
+            self._fetched_at = time.monotonic()
+            return self._certs
+
+
+google_certs = GoogleCertCache()
+
+
+def _decode_id_token(id_token: str, certs: dict[str, str], expected_audience: str) -> dict[str, Any]:
+    from google.auth import jwt as google_jwt
+
+    claims = google_jwt.decode(
+        id_token,
+        certs=certs,
+        audience=expected_audience,
+        clock_skew_in_seconds=CLOCK_SKEW_SECONDS,
+    )
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError("Wrong issuer")
+    return claims
+
+
+def _token_key_id(id_token: str) -> Optional[str]:
+    from google.auth import jwt as google_jwt
+
+    try:
+        return google_jwt.decode_header(id_token).get("kid")
+    except ValueError:
+        return None
+
+
+async def verify_id_token(id_token: str, expected_nonce: str, expected_audience: str) -> dict[str, Any]:
+    with oauth_duration.time(step="verify_id_token"):
+        return await _verify_id_token(id_token, expected_nonce, expected_audience)
+
 
+async def _verify_id_token(id_token: str, expected_nonce: str, expected_audience: str) -> dict[str, Any]:
+    certs = await google_certs.get()
+    if _token_key_id(id_token) not in certs:
+        # Google rotated its keys before our cached copy expired.
+        certs = await google_certs.get(force_refresh=True)
 
-def verify_id_token(id_token: str, expected_nonce: str, expected_audience: str) -> dict[str, Any]:
-    request = google_requests.Request()
-    claims = google_id_token.verify_oauth2_token(id_token, request, audience=expected_audience)
+    # RSA verification is CPU-bound; keep it off the event loop.
+    claims = await asyncio.to_thread(_decode_id_token, id_token, certs, expected_audience)
     token_nonce = claims.get("nonce")
     if not token_nonce or token_nonce != expected_nonce:
         raise ValueError("Invalid nonce")
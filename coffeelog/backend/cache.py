@@ -0,0 +1,283 @@
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterable, Optional
+
+import orjson
+
+logger = logging.getLogger("coffeelog.cache")
+
+# Serialized entry responses kept per worker; 0 disables the cache.
+RESPONSE_CACHE_BYTES = int(os.getenv("COFFEELOG_RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Workers append the users and entries they changed here, so the others drop
+# what they cached; unset, invalidation stays within the process.
+INVALIDATION_LOG_PATH = os.getenv("COFFEELOG_CACHE_INVALIDATION_PATH", "")
+# The log is started afresh once it grows past this.
+INVALIDATION_LOG_BYTES = 1024 * 1024
+# Generations are kept for this many users before they are all forgotten at once.
+MAX_TRACKED_USERS = 100_000
+
+# Bookkeeping per cached item on top of its body: key, LRU links, index entries.
+ITEM_OVERHEAD_BYTES = 256
+
+REVISION_KEY = ("revision",)
+
+CacheKey = tuple[str, ...]
+
+
+def list_key(etag: str) -> CacheKey:
+    return ("list", etag)
+
+
+def entry_key(entry_id: str, fmt: str) -> CacheKey:
+    return ("entry", entry_id, fmt)
+
+
+@dataclass
+class CachedBody:
+    etag: str
+    body: bytes
+
+
+@dataclass
+class CacheItem:
+    value: Any
+    size: int
+
+
+class InvalidationLog:
+    """Invalidations shared between workers through an append-only file.
+
+    Each line is ``[pid, user_key, entry ids]`` as JSON and is written with a
+    single ``O_APPEND`` write, so lines from several workers never interleave.
+    A worker reads the lines added since it last looked, skipping its own.
+    When the file grows past ``max_bytes`` the writer that noticed replaces
+    it with an empty one; readers see the new inode and drop everything,
+    since they may have missed lines.
+    """
+
+    def __init__(self, path: str, max_bytes: int = INVALIDATION_LOG_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._pid = os.getpid()
+        self._polled = False
+        self._inode: Optional[int] = None
+        self._offset = 0
+
+    def publish(self, user_key: str, ids: Iterable[str]) -> None:
+        line = orjson.dumps([self._pid, user_key, list(ids)]) + b"\n"
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                written = os.fstat(fd)
+            finally:
+                os.close(fd)
+            current = os.stat(self.path)
+            if current.st_ino != written.st_ino:
+                # Replaced while we wrote: readers that moved on would miss the line.
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+            elif current.st_size > self.max_bytes:
+                self._rotate()
+        except OSError:
+            logger.exception("Could not publish a cache invalidation to %s", self.path)
+
+    def _rotate(self) -> None:
+        fresh = f"{self.path}.{self._pid}"
+        with open(fresh, "wb"):
+            pass
+        os.replace(fresh, self.path)
+
+    def poll(self) -> Optional[list[tuple[str, list[str]]]]:
+        """The (user, entry ids) published by other workers since the last poll.
+
+        ``None`` means lines may have been missed and everything is suspect.
+        """
+        try:
+            if not self._polled:
+                # Created up front, so the file we follow is never one that appeared later.
+                os.close(os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644))
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        except OSError:
+            logger.exception("Could not read cache invalidations from %s", self.path)
+            return None
+        inode, size = (stat.st_ino, stat.st_size) if stat is not None else (None, 0)
+        if not self._polled:
+            # Nothing is cached yet, so earlier lines do not matter.
+            self._polled = True
+            self._inode, self._offset = inode, size
+            return []
+        if inode != self._inode or size < self._offset:
+            # Replaced or cut short: lines may have gone by unread.
+            self._inode, self._offset = inode, size
+            return None
+        if size == self._offset:
+            return []
+        try:
+            with open(self.path, "rb") as log:
+                log.seek(self._offset)
+                data = log.read(size - self._offset)
+        except OSError:
+            logger.exception("Could not read cache invalidations from %s", self.path)
+            return None
+        # A line still being written is read on the next poll.
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+        changes = []
+        for line in data[:complete].splitlines():
+            try:
+                pid, user_key, ids = orjson.loads(line)
+            except (orjson.JSONDecodeError, ValueError, TypeError):
+                return None
+            if pid != self._pid:
+                changes.append((user_key, ids))
+        return changes
+
+
+class ResponseCache:
+    """Serialized entry responses per user, in an LRU bounded by bytes.
+
+    Holds each user's collection revision, entry list bodies keyed by their
+    ETag, and single entry bodies keyed by id and format. A write drops the
+    user's revision and lists, which any change makes stale, and only the
+    entries it touched. A reader takes a ``token`` before it queries and
+    hands it to ``put``, which refuses the value if the user was
+    invalidated meanwhile, so a slow read never stores what a write has
+    just replaced. Must be used from the event loop thread.
+
+    Without an invalidation log, writes made through other workers never
+    reach this one, so callers check a cached body's ETag against the
+    database before serving it and rely on the cached revision only when
+    ``sees_all_writes``.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_BYTES, log: Optional[InvalidationLog] = None):
+        self.max_bytes = max_bytes
+        # One body may take a quarter of the cache, so a large pull does not flush it.
+        self.max_item_bytes = max_bytes // 4
+        self.log = log
+        self._items: OrderedDict[tuple[str, CacheKey], CacheItem] = OrderedDict()
+        self._keys: dict[str, set[CacheKey]] = {}
+        self._generations: dict[str, int] = {}
+        self._epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def sees_all_writes(self) -> bool:
+        return self.log is not None
+
+    def token(self, user_key: str) -> tuple[int, int]:
+        if self.enabled:
+            self._sync()
+        return self._epoch, self._generations.get(user_key, 0)
+
+    def get(self, user_key: str, key: CacheKey) -> Any:
+        if not self.enabled:
+            return None
+        self._sync()
+        item = self._items.get((user_key, key))
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end((user_key, key))
+        self.hits += 1
+        return item.value
+
+    def put(self, user_key: str, key: CacheKey, value: Any, token: tuple[int, int], size: int = 0) -> bool:
+        size += ITEM_OVERHEAD_BYTES
+        if not self.enabled or size > self.max_item_bytes or self.token(user_key) != token:
+            return False
+        self._remove(user_key, key)
+        self._items[(user_key, key)] = CacheItem(value, size)
+        self._keys.setdefault(user_key, set()).add(key)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            (old_user, old_key), _item = next(iter(self._items.items()))
+            self._remove(old_user, old_key)
+            self.evictions += 1
+        return True
+
+    async def fill(
+        self, user_key: str, key: CacheKey, etag: str, token: tuple[int, int], chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """Pass a response body through, keeping it once it has been sent in full."""
+        kept: Optional[list[bytes]] = [] if self.enabled else None
+        size = 0
+        async for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size > self.max_item_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            self.put(user_key, key, CachedBody(etag, b"".join(kept)), token, size)
+
+    def invalidate(self, user_key: str, ids: Iterable[str]) -> None:
+        """Drop what a write to ``ids`` made stale, here and in the other workers."""
+        ids = list(ids)
+        if self.enabled:
+            self._invalidate(user_key, ids)
+        if self.log is not None:
+            self.log.publish(user_key, ids)
+
+    def _invalidate(self, user_key: str, ids: list[str]) -> None:
+        self.invalidations += 1
+        self._generations[user_key] = self._generations.get(user_key, 0) + 1
+        if len(self._generations) > MAX_TRACKED_USERS:
+            # Tokens taken before this no longer match any user.
+            self._generations.clear()
+            self._epoch += 1
+        changed = set(ids)
+        for key in list(self._keys.get(user_key, ())):
+            if key[0] != "entry" or key[1] in changed:
+                self._remove(user_key, key)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._keys.clear()
+        self._generations.clear()
+        self._epoch += 1
+        self.bytes = 0
+
+    def _sync(self) -> None:
+        if self.log is None:
+            return
+        changes = self.log.poll()
+        if changes is None:
+            self.clear()
+            return
+        for user_key, ids in changes:
+            self._invalidate(user_key, ids)
+
+    def _remove(self, user_key: str, key: CacheKey) -> None:
+        item = self._items.pop((user_key, key), None)
+        if item is None:
+            return
+        self.bytes -= item.size
+        keys = self._keys[user_key]
+        keys.discard(key)
+        if not keys:
+            del self._keys[user_key]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+response_cache = ResponseCache(log=InvalidationLog(INVALIDATION_LOG_PATH) if INVALIDATION_LOG_PATH else None)
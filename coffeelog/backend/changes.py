@@ -0,0 +1,107 @@
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .serialization import dumps
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+# A comment line keeps proxies from timing out idle streams and reveals dead ones.
+HEARTBEAT_SECONDS = 15.0
+# Milliseconds an EventSource waits before reconnecting.
+RETRY_MS = 5000
+SUBSCRIBER_QUEUE_SIZE = 256
+# Resuming further back than this many changed entries asks the client to resync instead.
+MAX_BACKFILL_CHANGES = 1000
+
+
+@dataclass(frozen=True)
+class ChangeNotice:
+    revision: int
+    op: str
+    ids: tuple[str, ...]
+
+
+def group_changes(rows: Iterable[tuple[int, str, str]]) -> list[ChangeNotice]:
+    """Fold (revision, op, entry id) rows ordered by revision into one notice per commit."""
+    notices: list[ChangeNotice] = []
+    for revision, op, entry_id in rows:
+        if notices and notices[-1].revision == revision and notices[-1].op == op:
+            last = notices[-1]
+            notices[-1] = ChangeNotice(revision, op, last.ids + (entry_id,))
+        else:
+            notices.append(ChangeNotice(revision, op, (entry_id,)))
+    return notices
+
+
+def format_event(notice: ChangeNotice) -> bytes:
+    data = dumps({"revision": notice.revision, "op": notice.op, "ids": notice.ids})
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (notice.revision, notice.op.encode(), data)
+
+
+def format_resync(revision: int) -> bytes:
+    """Tell the client to run a normal delta pull; the changes are too many (or unknown) to list."""
+    return b"id: %d\nevent: resync\ndata: %s\n\n" % (revision, dumps({"revision": revision}))
+
+
+class Subscription:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue[ChangeNotice] = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    async def next(self, timeout: float) -> Optional[ChangeNotice]:
+        """The next notice, or ``None`` when none arrived within ``timeout``."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeFeed:
+    """In-process fan-out of change notices to each user's open streams.
+
+    An idle stream is a coroutine waiting on its own small queue, so thousands
+    of them cost little. ``publish`` never blocks: a subscriber that falls
+    ``queue_size`` notices behind is marked overflowed and its stream ends;
+    the client reconnects with Last-Event-ID and catches up from the database.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._subscribers: dict[str, set[Subscription]] = defaultdict(set)
+        self.published = 0
+
+    def subscribe(self, user_key: str) -> Subscription:
+        subscription = Subscription(self._queue_size)
+        self._subscribers[user_key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_key: str, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(user_key)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[user_key]
+
+    def publish(self, user_key: str, revision: int, op: str, ids: Iterable[str]) -> None:
+        """Notify the user's streams of a committed change; call after the write returned."""
+        subscribers = self._subscribers.get(user_key)
+        ids = tuple(dict.fromkeys(ids))
+        if not subscribers or not ids:
+            return
+        notice = ChangeNotice(revision, op, ids)
+        self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(notice)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+
+    def connections(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+change_feed = ChangeFeed()
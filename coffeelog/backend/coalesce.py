@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import os
+from typing import AsyncIterator, Callable, Optional
+
+# A response is shared with identical requests that arrive while it is produced,
+# until this much of it has been buffered; larger bodies then stream on alone.
+MAX_SHARED_BYTES = int(os.getenv("COFFEELOG_MAX_SHARED_RESPONSE_BYTES", str(8 * 1024 * 1024)))
+
+
+class SharedStream:
+    """One run of a response body, read by every request that joined it.
+
+    Readers pull the source in turn: whoever is ahead fetches the next chunk,
+    so the source advances at the pace of the fastest reader, and a reader
+    that disconnects mid-fetch does not cancel it for the others. Chunks are
+    kept for late joiners while the stream is joinable, and afterwards only
+    until every reader has passed them.
+    """
+
+    def __init__(self, source: AsyncIterator[bytes], max_shared_bytes: int, on_closed: Callable[[], None]):
+        self._source = source
+        self._max_shared_bytes = max_shared_bytes
+        self._on_closed = on_closed
+        self._chunks: list[bytes] = []
+        # Position of _chunks[0] in the whole stream.
+        self._base = 0
+        self._buffered = 0
+        self._next: Optional[asyncio.Task] = None
+        self._positions: dict[int, int] = {}
+        self._readers = itertools.count()
+        self.joinable = True
+        self.done = False
+
+    def read(self) -> AsyncIterator[bytes]:
+        # The position is taken now, not on the first read, so nothing is trimmed before it.
+        reader = next(self._readers)
+        self._positions[reader] = self._base
+        return self._read(reader)
+
+    async def _read(self, reader: int) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                position = self._positions[reader]
+                if position < self._base + len(self._chunks):
+                    chunk = self._chunks[position - self._base]
+                    self._positions[reader] = position + 1
+                    self._trim()
+                    yield chunk
+                elif self.done:
+                    return
+                else:
+                    await self._fetch()
+        finally:
+            del self._positions[reader]
+            if not self._positions and not self.done:
+                # Nobody is left to read the rest.
+                self._close()
+                asyncio.get_running_loop().create_task(self._discard())
+            self._trim()
+
+    async def _fetch(self) -> None:
+        if self._next is None:
+            self._next = asyncio.get_running_loop().create_task(self._pull())
+        pending = self._next
+        try:
+            # Shielded: the task belongs to the stream, not to the reader awaiting it.
+            chunk = await asyncio.shield(pending)
+        except Exception:
+            # Every reader of this run gets the error; a new request starts afresh.
+            self._close()
+            raise
+        if self._next is not pending:
+            # Another reader woken by the same fetch has stored it already.
+            return
+        self._next = None
+        if chunk is None:
+            self.done = True
+            self._close()
+            return
+        self._chunks.append(chunk)
+        self._buffered += len(chunk)
+        if self.joinable and self._buffered > self._max_shared_bytes:
+            self._close()
+
+    async def _pull(self) -> Optional[bytes]:
+        try:
+            return await self._source.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _discard(self) -> None:
+        if self._next is not None:
+            self._next.cancel()
+            await asyncio.gather(self._next, return_exceptions=True)
+        await self._source.aclose()
+
+    def _close(self) -> None:
+        """Stop taking new readers; those already reading carry on."""
+        if self.joinable:
+            self.joinable = False
+            self._on_closed()
+
+    def _trim(self) -> None:
+        if self.joinable:
+            return
+        keep_from = min(self._positions.values(), default=self._base + len(self._chunks))
+        drop = keep_from - self._base
+        if drop > 0:
+            self._buffered -= sum(len(chunk) for chunk in self._chunks[:drop])
+            del self._chunks[:drop]
+            self._base = keep_from
+
+
+class SingleFlight:
+    """Coalesces identical concurrent requests onto one run of their response.
+
+    ``stream(key, produce)`` starts ``produce()`` for the first request with
+    ``key`` and lets the others that arrive while it runs read the same
+    chunks, so they share its queries and serialization. Finished responses
+    are not kept: a request after the run completes starts a new one.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, max_shared_bytes: int = MAX_SHARED_BYTES):
+        self.max_shared_bytes = max_shared_bytes
+        self._flights: dict[str, SharedStream] = {}
+        self.started = 0
+        self.joined = 0
+
+    def stream(self, key: str, produce: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        flight = self._flights.get(key)
+        if flight is not None and flight.joinable:
+            self.joined += 1
+            return flight.read()
+
+        def forget() -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight = SharedStream(produce(), self.max_shared_bytes, forget)
+        self._flights[key] = flight
+        self.started += 1
+        return flight.read()
+
+    async def read(self, key: str, produce: Callable[[], AsyncIterator[bytes]]) -> bytes:
+        """The whole body, for responses that are not streamed."""
+        return b"".join([chunk async for chunk in self.stream(key, produce)])
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+entry_reads = SingleFlight()
@@ -0,0 +1,306 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import PlainTextResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip alone is still served
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; gzip request bodies are still accepted
+    zstandard = None
+
+logger = logging.getLogger("coffeelog.compression")
+
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".json", ".svg", ".html", ".txt"}
+# Preferred first when the client accepts several.
+ENCODINGS = ("br", "gzip")
+
+# A compressed request body that decodes to more than this is refused with 413.
+MAX_DECODED_REQUEST_BYTES = int(os.getenv("COFFEELOG_MAX_DECODED_REQUEST_BYTES", str(64 * 1024 * 1024)))
+# Decoded request bodies reach the app in pieces of at most this size.
+DECODE_CHUNK_BYTES = 64 * 1024
+# zstd has no output bound per call, so it is fed in slices this small: a 4-byte
+# RLE block can expand to 128 KiB, so one slice decodes to at most 8 MiB.
+ZSTD_FEED_BYTES = 256
+
+# Asset URLs carrying ?v=<APP_VERSION> change whenever their content does.
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+@dataclass(frozen=True)
+class CompressedAsset:
+    media_type: str
+    digest: str
+    mtime_ns: int
+    size: int
+    bodies: dict[str, bytes]
+
+
+def compress_file(path: Path) -> CompressedAsset:
+    stat = path.stat()
+    data = path.read_bytes()
+    bodies = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(data, quality=11)
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return CompressedAsset(
+        media_type=media_type,
+        digest=hashlib.sha256(data).hexdigest()[:20],
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        # Skip encodings that do not pay off, e.g. for tiny files.
+        bodies={encoding: body for encoding, body in bodies.items() if len(body) < len(data)},
+    )
+
+
+def negotiate_encoding(accept_encoding: str, available: dict[str, bytes]) -> Optional[str]:
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves gzip/brotli variants compressed once, at startup.
+
+    Versioned URLs (``?v=``) are marked immutable; everything else must be
+    revalidated. A file changed on disk after startup is recompressed on its
+    next request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.assets: dict[str, CompressedAsset] = {}
+
+    def precompress(self) -> int:
+        root = Path(self.directory)
+        for path in root.rglob("*"):
+            if path.is_file() and path.suffix in COMPRESSIBLE_SUFFIXES:
+                self.assets[path.relative_to(root).as_posix()] = compress_file(path)
+        logger.info("Precompressed %s static assets (brotli: %s)", len(self.assets), brotli is not None)
+        return len(self.assets)
+
+    def _current_asset(self, key: str) -> Optional[CompressedAsset]:
+        asset = self.assets.get(key)
+        if asset is None:
+            return None
+        path = Path(self.directory) / key
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if stat.st_mtime_ns != asset.mtime_ns or stat.st_size != asset.size:
+            asset = self.assets[key] = compress_file(path)
+        return asset
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        headers = Headers(scope=scope)
+        versioned = "v" in QueryParams(scope["query_string"])
+        cache_control = IMMUTABLE if versioned else REVALIDATE
+
+        key = path.replace(os.sep, "/")
+        asset = self._current_asset(key) if scope["method"] in ("GET", "HEAD") else None
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""), asset.bodies) if asset else None
+        if asset is None or encoding is None:
+            response = await super().get_response(path, scope)
+            if response.status_code in (200, 304):
+                response.headers["Cache-Control"] = cache_control
+                if asset is not None:
+                    response.headers.add_vary_header("Accept-Encoding")
+            return response
+
+        body = asset.bodies[encoding]
+        response_headers = {
+            "ETag": f'"{asset.digest}-{encoding}"',
+            "Cache-Control": cache_control,
+            "Content-Encoding": encoding,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = headers.get("if-none-match", "")
+        if response_headers["ETag"] in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+            return Response(status_code=304, headers=response_headers)
+        if scope["method"] == "HEAD":
+            response_headers["Content-Length"] = str(len(body))
+            return Response(media_type=asset.media_type, headers=response_headers)
+        return Response(body, media_type=asset.media_type, headers=response_headers)
+
+
+class CompressionMiddleware:
+    """Gzip dynamic responses (pages and API JSON) on the fly.
+
+    Static assets are served precompressed and photos are already
+    compressed images, so both bypass it. So do the import progress and
+    change streams: gzip holds small writes back until its buffer fills,
+    which would delay every progress line and change notice.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        skip_prefixes: tuple[str, ...] = ("/static/", "/api/photos/", "/api/import", "/api/changes/"),
+    ):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=6)
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not scope["path"].startswith(self.skip_prefixes):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+class RequestBodyDecoder(ABC):
+    """Incremental decoder of a compressed request body that stops at ``limit`` decoded bytes.
+
+    Concatenated gzip members or zstd frames are decoded one after another.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self._decoder = self._new_decoder()
+
+    @abstractmethod
+    def _new_decoder(self):
+        """A decoder for one gzip member or zstd frame."""
+
+    @abstractmethod
+    def _decode(self, data: bytes) -> tuple[bytes, bytes]:
+        """Decode some of ``data``; returns the output and the input still to be decoded."""
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        while True:
+            if self._decoder.eof:
+                data = self._decoder.unused_data + data
+                if not data:
+                    return
+                self._decoder = self._new_decoder()
+            chunk, data = self._decode(data)
+            if chunk:
+                self.size += len(chunk)
+                if self.size > self.limit:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {self.limit} bytes once decoded")
+                yield chunk
+            elif not data:
+                return
+
+    def finish(self) -> None:
+        if not self._decoder.eof:
+            raise ValueError("Truncated request body")
+
+
+class GzipBodyDecoder(RequestBodyDecoder):
+    def _new_decoder(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _decode(self, data: bytes) -> tuple[bytes, bytes]:
+        chunk = self._decoder.decompress(data, DECODE_CHUNK_BYTES)
+        return chunk, self._decoder.unconsumed_tail
+
+
+class ZstdBodyDecoder(RequestBodyDecoder):
+    def _new_decoder(self):
+        return zstandard.ZstdDecompressor().decompressobj(write_size=DECODE_CHUNK_BYTES)
+
+    def _decode(self, data: bytes) -> tuple[bytes, bytes]:
+        return self._decoder.decompress(data[:ZSTD_FEED_BYTES]), data[ZSTD_FEED_BYTES:]
+
+
+REQUEST_DECODERS: dict[str, Callable[[int], RequestBodyDecoder]] = {"gzip": GzipBodyDecoder}
+DECODE_ERRORS: tuple[type[Exception], ...] = (zlib.error, ValueError)
+if zstandard is not None:
+    REQUEST_DECODERS["zstd"] = ZstdBodyDecoder
+    DECODE_ERRORS += (zstandard.ZstdError,)
+
+
+class RequestDecompressionMiddleware:
+    """Decode gzip (and zstd, with the optional ``zstandard`` package) request bodies as they stream in.
+
+    The app sees the plain body without ``Content-Encoding``. A body that
+    decodes past its limit (``limits`` by path, else ``max_size``) is refused
+    with 413, a corrupt one with 400 and any other encoding with 415.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int = MAX_DECODED_REQUEST_BYTES, limits: Optional[dict[str, int]] = None):
+        self.app = app
+        self.max_size = max_size
+        self.limits = limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = Headers(scope=scope).get("content-encoding", "").strip().lower() if scope["type"] == "http" else ""
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+        factory = REQUEST_DECODERS.get(encoding)
+        if factory is None:
+            response = PlainTextResponse(
+                f"Unsupported Content-Encoding: {encoding}",
+                status_code=415,
+                headers={"Accept-Encoding": ", ".join(REQUEST_DECODERS)},
+            )
+            await response(scope, receive, send)
+            return
+
+        decoder = factory(self.limits.get(scope["path"], self.max_size))
+        pending: deque[bytes] = deque()
+        more_body = True
+        body_done = False
+
+        async def receive_decoded() -> Message:
+            nonlocal more_body, body_done
+            if body_done:
+                return await receive()
+            while not pending and more_body:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                more_body = message.get("more_body", False)
+                try:
+                    pending.extend(decoder.feed(message.get("body", b"")))
+                    if not more_body:
+                        decoder.finish()
+                except DECODE_ERRORS as exc:
+                    raise HTTPException(status_code=400, detail=f"Malformed {encoding} request body") from exc
+            body = pending.popleft() if pending else b""
+            body_done = not pending and not more_body
+            return {"type": "http.request", "body": body, "more_body": not body_done}
+
+        # Changed in place, not copied: the router records the matched route on
+        # this scope, and MetricsMiddleware reads it from there for its label.
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"] if name not in (b"content-encoding", b"content-length")
+        ]
+        await self.app(scope, receive_decoded, send)
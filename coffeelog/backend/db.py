@@ -1,20 +1,224 @@
+import asyncio
+import logging
+import os
+import time
 from pathlib import Path
+from typing import Callable, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, Table, create_engine, event, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
-from .models import Base
+from .metrics import record_query
+from .models import Base, SchemaVersion
+from .search import create_search_index, reindex
+from .stats import rebuild_stats
+from .tags import rebuild_tags
+from .writer import WriteQueue
+
+logger = logging.getLogger("coffeelog.db")
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-DB_PATH = BASE_DIR / "coffeelog.db"
+DB_PATH = Path(os.getenv("COFFEELOG_DB_PATH") or BASE_DIR / "coffeelog.db")
 DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+READER_POOL_SIZE = 8
+# A streamed body holds a reader for as long as the client takes to download it;
+# only this many run at once, so the rest of the pool stays free for other reads.
+MAX_STREAMING_READERS = READER_POOL_SIZE - 2
+BUSY_TIMEOUT_MS = 5000
+
+# WAL lets readers run while the writer commits; synchronous=NORMAL is
+# durable across application crashes in WAL mode and skips an fsync per commit.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+def _apply_pragmas(dbapi_connection, pragmas: tuple[str, ...]) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def configure_sqlite_engine(target: Engine, *, writer: bool = False, read_only: bool = False) -> Engine:
+    """Apply the connection pragmas, and for the writer take over transaction control.
+
+    pysqlite defers BEGIN until the first DML statement, which breaks
+    SAVEPOINTs; the writer disables that and starts each group commit with
+    BEGIN IMMEDIATE so the write lock is held from the start.
+    """
+
+    @event.listens_for(target, "connect")
+    def _on_connect(dbapi_connection, _connection_record):
+        if writer:
+            dbapi_connection.isolation_level = None
+        _apply_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+        if read_only:
+            _apply_pragmas(dbapi_connection, ("PRAGMA query_only=ON",))
 
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
+    if writer:
+
+        @event.listens_for(target, "begin")
+        def _on_begin(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return target
+
+
+def instrument_engine(target: Engine, name: str) -> Engine:
+    """Time every statement for the metrics endpoint and the slow-query log."""
+
+    @event.listens_for(target, "before_cursor_execute")
+    def _before_execute(connection, _cursor, _statement, _parameters, _context, _executemany):
+        connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(target, "after_cursor_execute")
+    def _after_execute(connection, _cursor, statement, _parameters, _context, _executemany):
+        started = connection.info["query_started"].pop()
+        record_query(name, statement, time.perf_counter() - started)
+
+    return target
+
+
+# Schema bootstrap, command line tools and benchmarks.
+engine = instrument_engine(
+    configure_sqlite_engine(create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})),
+    "bootstrap",
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, class_=Session)
 
+# Every write made by the app goes through this single connection and thread.
+writer_engine = instrument_engine(
+    configure_sqlite_engine(
+        create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0),
+        writer=True,
+    ),
+    "writer",
+)
+WriterSessionLocal = sessionmaker(bind=writer_engine, autoflush=False, expire_on_commit=False, class_=Session)
+writer = WriteQueue(WriterSessionLocal)
+
+# Request handlers read through a pool of async connections so that waiting on
+# SQLite does not hold a threadpool worker. The connections are query-only.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    pool_size=READER_POOL_SIZE,
+    max_overflow=0,
+)
+instrument_engine(configure_sqlite_engine(async_engine.sync_engine, read_only=True), "reader")
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+    class_=AsyncSession,
+)
+streaming_readers = asyncio.Semaphore(MAX_STREAMING_READERS)
+
+
+def _add_column(table: str, name: str, ddl: str) -> Callable[[Session, set[str]], None]:
+    def migrate(session: Session, _existing_tables: set[str]) -> None:
+        existing = {column["name"] for column in inspect(session.connection()).get_columns(table)}
+        if name not in existing:
+            session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+    return migrate
+
+
+def _create_search_index(session: Session, _existing_tables: set[str]) -> None:
+    if create_search_index(session.connection()):
+        reindex(session)
+
+
+def _backfill(table: str, rebuild: Callable[[Session], int]) -> Callable[[Session, set[str]], None]:
+    # Derived tables added to an existing database start out empty.
+    def migrate(session: Session, existing_tables: set[str]) -> None:
+        if existing_tables and table not in existing_tables:
+            rebuild(session)
+
+    return migrate
+
+
+def _rebuild(table: str, rebuild: Callable[[Session], int]) -> Callable[[Session, set[str]], None]:
+    # Recomputes a derived table whose contents changed meaning.
+    def migrate(session: Session, existing_tables: set[str]) -> None:
+        if table in existing_tables:
+            rebuild(session)
+
+    return migrate
+
+
+# Ordered schema changes; a database at version N has had the first N applied.
+# create_all only creates missing tables, so every later change to an existing
+# table, index or derived table needs an entry here. Each step must also be a
+# no-op on a schema that already has it, since databases that predate the
+# version table start at 0.
+MIGRATIONS: list[tuple[str, Callable[[Session, set[str]], None]]] = [
+    ("entries.revision", _add_column("entries", "revision", "INTEGER NOT NULL DEFAULT 0")),
+    ("entries.photo_hashes", _add_column("entries", "photo_hashes", "JSON NOT NULL DEFAULT '[]'")),
+    ("full-text search index", _create_search_index),
+    ("entry_stats backfill", _backfill("entry_stats", rebuild_stats)),
+    ("entry_tags backfill", _backfill("entry_tags", rebuild_tags)),
+    ("entry_stats tag normalization", _rebuild("entry_stats", rebuild_stats)),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(target: Engine) -> Optional[int]:
+    """The stored schema version, or ``None`` for a database without the version table."""
+    with target.connect() as connection:
+        try:
+            return connection.execute(select(SchemaVersion.version)).scalar_one_or_none()
+        except OperationalError:
+            return None
+
+
+def ensure_schema(target: Engine, tables: Optional[list[Table]] = None) -> None:
+    """Bring a database file up to ``SCHEMA_VERSION``.
+
+    A current database costs one query: tables are only reflected and
+    created, and migrations only run, when the stored version is behind.
+    """
+    version = schema_version(target)
+    if version == SCHEMA_VERSION:
+        return
+    if version is not None and version > SCHEMA_VERSION:
+        # Written by a newer release, e.g. during a rolling deploy; leave it alone.
+        logger.warning("Database schema version %s is newer than %s", version, SCHEMA_VERSION)
+        return
+
+    existing_tables = set(inspect(target).get_table_names())
+    Base.metadata.create_all(target, tables=tables)
+    with Session(target) as session:
+        for name, migrate in MIGRATIONS[version or 0 :]:
+            logger.info("Applying schema migration: %s", name)
+            migrate(session, existing_tables)
+        # create_all skips indexes of tables that already existed.
+        for table in tables or Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(session.connection(), checkfirst=True)
+        session.execute(
+            insert(SchemaVersion)
+            .values(id=1, version=SCHEMA_VERSION)
+            .on_conflict_do_update(index_elements=[SchemaVersion.id], set_={"version": SCHEMA_VERSION})
+        )
+        session.commit()
+
 
 def create_db_and_tables() -> None:
-    Base.metadata.create_all(engine)
+    ensure_schema(engine)
 
 
 def get_session():
@@ -23,3 +227,8 @@ def get_session():
         yield session
     finally:
         session.close()
+
+
+async def get_async_session():
+    async with AsyncSessionLocal() as session:
+        yield session
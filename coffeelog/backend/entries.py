@@ -0,0 +1,352 @@
+import base64
+import itertools
+import json
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import Select, delete, func, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .models import EntryRecord, EntryTag
+from .schemas import BatchOperation, EntryIn, EntryOut
+from .search import INDEXED_COLUMNS, index_entries, unindex_entries
+from .serialization import entry_columns, entry_dict
+from .stats import STAT_SOURCE_COLUMNS, apply_entry_changes
+from .sync import clear_tombstones, collection_etag, current_revision, entry_etag, next_revision, write_tombstones
+from .tags import TAG_CATEGORIES, remove_entry_tags, replace_entry_tags, tag_id
+
+# Stay well below SQLite's bound-parameter limit for IN (...) lookups.
+IN_CHUNK_SIZE = 500
+
+ENTRY_COLUMNS = [column.name for column in EntryRecord.__table__.columns]
+# What a field-level update reads back to keep statistics and tags in step.
+PATCH_SOURCE_COLUMNS = tuple(dict.fromkeys((*STAT_SOURCE_COLUMNS, *TAG_CATEGORIES, "revision")))
+
+
+@dataclass(frozen=True)
+class EntryFilters:
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    brew_method: Optional[str] = None
+    origin: Optional[str] = None
+    roastery: Optional[str] = None
+    min_overall: Optional[int] = None
+    tags: tuple[str, ...] = ()
+    tag_match: str = "any"
+    tag_category: Optional[str] = None
+
+
+class EntryOwnershipError(Exception):
+    def __init__(self, entry_id: str):
+        super().__init__(f"Entry {entry_id} belongs to another user")
+        self.entry_id = entry_id
+
+
+class PreconditionFailedError(Exception):
+    pass
+
+
+def check_if_match(current_etag: Optional[str], if_match: Optional[frozenset[str]]) -> None:
+    """Enforce an If-Match precondition inside the write transaction.
+
+    ``*`` only requires the resource to exist; a missing resource never matches.
+    """
+    if if_match is None:
+        return
+    if current_etag is None or ("*" not in if_match and current_etag not in if_match):
+        raise PreconditionFailedError("The resource has changed since it was read")
+
+
+def current_entry_etag(session: Session, user_key: str, entry_id: str) -> Optional[str]:
+    revision = session.execute(
+        select(EntryRecord.revision).where(EntryRecord.id == entry_id, EntryRecord.user_key == user_key)
+    ).scalar_one_or_none()
+    return None if revision is None else entry_etag(revision)
+
+
+def chunked(items: list[Any], size: int = IN_CHUNK_SIZE) -> Iterable[list[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def entry_to_row(entry: EntryIn, user_key: str, revision: int) -> dict[str, Any]:
+    data = entry.model_dump()
+    data["user_key"] = user_key
+    data["revision"] = revision
+    return data
+
+
+def load_existing(session: Session, entry_ids: list[str]) -> dict[str, dict[str, Any]]:
+    """Load the stored version of entries, limited to what ownership, statistics and If-Match need."""
+    columns = [getattr(EntryRecord, name) for name in (*STAT_SOURCE_COLUMNS, "revision")]
+    existing: dict[str, dict[str, Any]] = {}
+    for chunk in chunked(entry_ids):
+        statement = select(*columns).where(EntryRecord.id.in_(chunk))
+        for row in session.execute(statement).mappings():
+            existing[row["id"]] = dict(row)
+    return existing
+
+
+def bulk_upsert(session: Session, user_key: str, entries: list[EntryIn]) -> list[EntryOut]:
+    """Insert or update a batch of entries with set-based statements.
+
+    Existing ids are looked up in one IN query per chunk, every row is written
+    by a single INSERT ... ON CONFLICT DO UPDATE executemany, and the response
+    is built from the validated payload instead of re-reading the rows. The
+    caller owns the transaction.
+    """
+    if not entries:
+        return []
+
+    entry_ids = list(dict.fromkeys(entry.id for entry in entries))
+    existing = load_existing(session, entry_ids)
+    for entry_id, row in existing.items():
+        if row["user_key"] != user_key:
+            raise EntryOwnershipError(entry_id)
+
+    revision = next_revision(session, user_key)
+    rows = [entry_to_row(entry, user_key, revision) for entry in entries]
+
+    statement = insert(EntryRecord)
+    statement = statement.on_conflict_do_update(
+        index_elements=[EntryRecord.id],
+        set_={name: statement.excluded[name] for name in ENTRY_COLUMNS if name != "id"},
+        # Guards against another user claiming the id between the lookup and the write.
+        where=EntryRecord.user_key == statement.excluded.user_key,
+    )
+    session.execute(statement, rows)
+    for chunk in chunked(entry_ids):
+        clear_tombstones(session, user_key, chunk)
+        index_entries(session, chunk)
+    # The last occurrence of a repeated id is the one that was stored.
+    final_rows = {row["id"]: row for row in rows}
+    for chunk in chunked(entry_ids):
+        replace_entry_tags(session, chunk, [final_rows[entry_id] for entry_id in chunk])
+    apply_entry_changes(session, user_key, existing.values(), final_rows.values())
+
+    return [EntryOut.model_validate(row) for row in rows]
+
+
+def upsert_if_match(
+    session: Session,
+    user_key: str,
+    entries: list[EntryIn],
+    if_match: Optional[frozenset[str]],
+    entry_id: Optional[str] = None,
+) -> list[EntryOut]:
+    """Upsert only if the entry ``entry_id`` (or, without it, the user's
+    collection) still has one of the ``if_match`` ETags."""
+    if entry_id is not None:
+        current = current_entry_etag(session, user_key, entry_id)
+    else:
+        current = collection_etag(user_key, current_revision(session, user_key))
+    check_if_match(current, if_match)
+    return bulk_upsert(session, user_key, entries)
+
+
+def patch_entry(
+    session: Session,
+    user_key: str,
+    entry_id: str,
+    changes: dict[str, Any],
+    if_match: Optional[frozenset[str]] = None,
+) -> Optional[int]:
+    """Write only the given columns of one of the user's entries.
+
+    Statistics, tags and the search index are refreshed only when a column
+    they are derived from changed. Returns the entry's new revision (its
+    current one for an empty patch), or ``None`` when there is no such entry.
+    """
+    columns = [getattr(EntryRecord, name) for name in PATCH_SOURCE_COLUMNS]
+    old = session.execute(
+        select(*columns).where(EntryRecord.id == entry_id, EntryRecord.user_key == user_key)
+    ).mappings().first()
+    check_if_match(None if old is None else entry_etag(old["revision"]), if_match)
+    if old is None:
+        return None
+    if not changes:
+        return old["revision"]
+
+    revision = next_revision(session, user_key)
+    session.execute(update(EntryRecord).where(EntryRecord.id == entry_id).values(**changes, revision=revision))
+    new = {**old, **changes}
+    if not changes.keys().isdisjoint(STAT_SOURCE_COLUMNS):
+        apply_entry_changes(session, user_key, [old], [new])
+    if not changes.keys().isdisjoint(TAG_CATEGORIES):
+        replace_entry_tags(session, [entry_id], [new])
+    if not changes.keys().isdisjoint(INDEXED_COLUMNS):
+        index_entries(session, [entry_id])
+    return revision
+
+
+def encode_page_cursor(row: Row) -> str:
+    raw = json.dumps([row.brew_date, row.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_page_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        brew_date, entry_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid page cursor") from exc
+    if not isinstance(brew_date, str) or not isinstance(entry_id, str):
+        raise ValueError("Invalid page cursor")
+    return brew_date, entry_id
+
+
+def apply_filters(statement: Select, user_key: str, filters: EntryFilters) -> Select:
+    if filters.date_from:
+        statement = statement.where(EntryRecord.brew_date >= filters.date_from)
+    if filters.date_to:
+        statement = statement.where(EntryRecord.brew_date <= filters.date_to)
+    if filters.brew_method:
+        statement = statement.where(EntryRecord.brew_method == filters.brew_method)
+    if filters.origin:
+        statement = statement.where(EntryRecord.origin == filters.origin)
+    if filters.roastery:
+        statement = statement.where(EntryRecord.roastery == filters.roastery)
+    if filters.min_overall is not None:
+        statement = statement.where(EntryRecord.overall >= filters.min_overall)
+    if filters.tags:
+        statement = statement.where(EntryRecord.id.in_(tagged_entry_ids(user_key, filters)))
+    return statement
+
+
+def tagged_entry_ids(user_key: str, filters: EntryFilters) -> Select:
+    """Ids of entries carrying any (or all) of the requested tags, answered from entry_tags."""
+    tags = sorted({tag_id(tag) for tag in filters.tags})
+    statement = select(EntryTag.entry_id).where(EntryTag.user_key == user_key, EntryTag.tag.in_(tags))
+    if filters.tag_category:
+        statement = statement.where(EntryTag.category == filters.tag_category)
+    if filters.tag_match == "all":
+        statement = statement.group_by(EntryTag.entry_id).having(func.count(func.distinct(EntryTag.tag)) == len(tags))
+    return statement
+
+
+def list_statement(user_key: str, filters: EntryFilters, page_cursor: Optional[str] = None) -> Select:
+    """Select a user's entries newest first as plain column tuples (see ``entry_columns``)."""
+    statement = apply_filters(select(*entry_columns()).where(EntryRecord.user_key == user_key), user_key, filters)
+    if page_cursor:
+        statement = statement.where(tuple_(EntryRecord.brew_date, EntryRecord.id) < decode_page_cursor(page_cursor))
+    return statement.order_by(EntryRecord.brew_date.desc(), EntryRecord.id.desc())
+
+
+def list_entries(
+    session: Session,
+    user_key: str,
+    filters: EntryFilters,
+    limit: int,
+    page_cursor: Optional[str] = None,
+) -> tuple[list[Row], Optional[str]]:
+    """Return one page with keyset pagination on (brew_date, id).
+
+    Returns the page and the cursor of the next one, or ``None`` on the last
+    page. Unpaged lists are streamed from ``list_statement`` instead.
+    """
+    statement = list_statement(user_key, filters, page_cursor)
+    rows = list(session.execute(statement.limit(limit + 1)).all())
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_page_cursor(rows[-1])
+
+
+def delete_owned_entry(
+    session: Session,
+    user_key: str,
+    entry_id: str,
+    if_match: Optional[frozenset[str]] = None,
+) -> Optional[int]:
+    """Delete one of the user's entries and leave a tombstone for delta sync.
+
+    Returns the revision of the deletion, or ``None`` when there was no such entry.
+    """
+    row = load_existing(session, [entry_id]).get(entry_id)
+    if row is None or row["user_key"] != user_key:
+        check_if_match(None, if_match)
+        return None
+    # Checked against the row the deletion works from, so it costs no extra query.
+    check_if_match(entry_etag(row["revision"]), if_match)
+    return delete_rows(session, user_key, [row])
+
+
+def bulk_delete(session: Session, user_key: str, entry_ids: list[str]) -> tuple[int, set[str]]:
+    """Delete those of ``entry_ids`` the user owns with set-based statements.
+
+    All deletions share one revision and their tombstones are written in a
+    single executemany. Returns that revision and the ids that were deleted
+    (0 and none when nothing was); the caller owns the transaction.
+    """
+    existing = load_existing(session, list(dict.fromkeys(entry_ids)))
+    owned = [row for row in existing.values() if row["user_key"] == user_key]
+    if not owned:
+        return 0, set()
+    return delete_rows(session, user_key, owned), {row["id"] for row in owned}
+
+
+def delete_rows(session: Session, user_key: str, owned: list[dict[str, Any]]) -> int:
+    """Delete rows loaded by ``load_existing`` and owned by the user; returns the deletion's revision."""
+    apply_entry_changes(session, user_key, owned, [])
+    revision = next_revision(session, user_key)
+    deleted = [row["id"] for row in owned]
+    for chunk in chunked(deleted):
+        unindex_entries(session, chunk)
+        remove_entry_tags(session, chunk)
+        session.execute(delete(EntryRecord).where(EntryRecord.id.in_(chunk)))
+        write_tombstones(session, user_key, chunk, revision)
+    return revision
+
+
+def fetch_entries(session: Session, user_key: str, entry_ids: list[str]) -> dict[str, Row]:
+    """Load the user's entries among ``entry_ids`` as column tuples (see ``entry_columns``)."""
+    rows: dict[str, Row] = {}
+    for chunk in chunked(list(dict.fromkeys(entry_ids))):
+        statement = select(*entry_columns()).where(EntryRecord.user_key == user_key, EntryRecord.id.in_(chunk))
+        for row in session.execute(statement):
+            rows[row.id] = row
+    return rows
+
+
+def run_batch(session: Session, user_key: str, operations: list[BatchOperation]) -> tuple[list[dict[str, Any]], int]:
+    """Apply a batch of operations in order inside the caller's transaction.
+
+    Consecutive operations of the same kind run as one set-based step, so a
+    batch of deletes costs a handful of statements however long it is;
+    patches are applied one by one, each with its own revision. Gets
+    see the effect of the operations before them. Returns one result per
+    operation and the user's revision after the batch.
+    """
+    results: list[dict[str, Any]] = []
+    for op, group in itertools.groupby(operations, key=lambda operation: operation.op):
+        group = list(group)
+        if op == "upsert":
+            saved = bulk_upsert(session, user_key, [operation.entry for operation in group])
+            results.extend({"op": op, "id": entry.id, "status": 200, "revision": entry.revision} for entry in saved)
+        elif op == "patch":
+            for operation in group:
+                revision = patch_entry(session, user_key, operation.id, operation.patch.changes())
+                if revision is None:
+                    results.append({"op": op, "id": operation.id, "status": 404})
+                else:
+                    results.append({"op": op, "id": operation.id, "status": 200, "revision": revision})
+        elif op == "delete":
+            revision, deleted = bulk_delete(session, user_key, [operation.id for operation in group])
+            for operation in group:
+                if operation.id in deleted:
+                    # A repeated id is only deleted once.
+                    deleted.discard(operation.id)
+                    results.append({"op": op, "id": operation.id, "status": 200, "revision": revision})
+                else:
+                    results.append({"op": op, "id": operation.id, "status": 404})
+        else:
+            rows = fetch_entries(session, user_key, [operation.id for operation in group])
+            for operation in group:
+                row = rows.get(operation.id)
+                if row is None:
+                    results.append({"op": op, "id": operation.id, "status": 404})
+                else:
+                    results.append({"op": op, "id": operation.id, "status": 200, "entry": entry_dict(row)})
+    return results, current_revision(session, user_key)
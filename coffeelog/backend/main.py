@@ -2,32 +2,43 @@ import logging
 from pathlib import Path
 
 from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.sessions import SessionMiddleware
 
 from .auth.google import (
     GoogleOAuthConfig,
     build_authorize_url,
+    close_http_client,
     exchange_code_for_tokens,
     generate_nonce,
     generate_state,
     verify_id_token,
 )
+from .cache import response_cache
+from .changes import change_feed
+from .coalesce import entry_reads
+from .compression import CompressionMiddleware, PrecompressedStaticFiles, RequestDecompressionMiddleware
 from .config import get_settings
-from .db import create_db_and_tables, get_session
+from .db import async_engine, create_db_and_tables, get_async_session, writer
+from .metrics import MetricsMiddleware, register_collector, render_metrics
 from .models import UserRecord
+from .pages import PageCache, negotiate_locale, page_response
+from .ratelimit import write_limiter
 from .routes import router as api_router
+from .storage import storage
+from .transfer import MAX_IMPORT_BYTES
+from .users import upsert_user
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_DIR = BASE_DIR / "frontend"
 TEMPLATES_DIR = FRONTEND_DIR / "templates"
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-APP_VERSION = "1.1.30"
+APP_VERSION = "1.1.39"
 templates.env.globals["app_version"] = APP_VERSION
+page_cache = PageCache(templates.env, APP_VERSION)
 logger = logging.getLogger("coffeelog.auth")
 logger.setLevel(logging.INFO)
 settings = get_settings()
@@ -52,6 +63,12 @@ def is_authenticated(request: Request) -> bool:
     return bool(request.session.get("user_id") and request.session.get("google_sub"))
 
 
+def render_page(request: Request, template: str, context: dict) -> Response:
+    """Serve a page from the rendered-page cache; only the locale varies per request."""
+    locale = negotiate_locale(request.headers.get("accept-language", ""))
+    return page_response(request, page_cache.get(template, locale, context))
+
+
 app = FastAPI(title="Sipp")
 app.add_middleware(
     SessionMiddleware,
@@ -60,13 +77,28 @@ app.add_middleware(
     https_only=settings.cookie_secure,
     session_cookie="coffeelog_session",
 )
+app.add_middleware(RequestDecompressionMiddleware, limits={"/api/import": MAX_IMPORT_BYTES})
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(api_router)
-app.mount("/static", StaticFiles(directory=FRONTEND_DIR / "static"), name="static")
+static_files = PrecompressedStaticFiles(directory=FRONTEND_DIR / "static")
+app.mount("/static", static_files, name="static")
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     create_db_and_tables()
+    static_files.precompress()
+    writer.start()
+    storage.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await storage.close()
+    writer.stop()
+    await close_http_client()
+    await async_engine.dispose()
 
 
 @app.get("/login", include_in_schema=False)
@@ -118,7 +150,7 @@ def auth_google_start(request: Request):
 
 
 @app.get("/auth/dev-login", include_in_schema=False)
-def auth_dev_login(request: Request, session: Session = Depends(get_session)):
+async def auth_dev_login(request: Request):
     if not settings.dev_login_enabled:
         raise HTTPException(status_code=404, detail="Dev login is disabled")
 
@@ -126,22 +158,8 @@ def auth_dev_login(request: Request, session: Session = Depends(get_session)):
     email = "dev@local.coffeelog"
     name = "Debug User"
 
-    user = session.execute(select(UserRecord).where(UserRecord.google_sub == google_sub)).scalar_one_or_none()
-    if user:
-        user.email = email
-        user.name = name
-        user.avatar_url = None
-    else:
-        user = UserRecord(
-            google_sub=google_sub,
-            email=email,
-            name=name,
-            avatar_url=None,
-        )
-        session.add(user)
-
-    session.commit()
-    session.refresh(user)
+    user = await writer.run(upsert_user, google_sub, email, name, None)
+    page_cache.invalidate_user(user.id)
 
     request.session["user_id"] = user.id
     request.session["google_sub"] = user.google_sub
@@ -149,7 +167,7 @@ def auth_dev_login(request: Request, session: Session = Depends(get_session)):
 
 
 @app.get("/auth/google/callback", include_in_schema=False)
-async def auth_google_callback(request: Request, session: Session = Depends(get_session)):
+async def auth_google_callback(request: Request):
     expected_state = request.session.pop("oauth_state", None)
     expected_nonce = request.session.pop("oauth_nonce", None)
 
@@ -176,7 +194,7 @@ async def auth_google_callback(request: Request, session: Session = Depends(get_
         id_token = token_payload.get("id_token")
         if not id_token:
             raise ValueError("Missing id_token")
-        claims = verify_id_token(
+        claims = await verify_id_token(
             id_token=id_token,
             expected_nonce=expected_nonce,
             expected_audience=config.client_id,
@@ -192,22 +210,8 @@ async def auth_google_callback(request: Request, session: Session = Depends(get_
     if not google_sub or not email:
         raise HTTPException(status_code=400, detail="Google claims are incomplete")
 
-    user = session.execute(select(UserRecord).where(UserRecord.google_sub == google_sub)).scalar_one_or_none()
-    if user:
-        user.email = email
-        user.name = name
-        user.avatar_url = picture
-    else:
-        user = UserRecord(
-            google_sub=google_sub,
-            email=email,
-            name=name,
-            avatar_url=picture,
-        )
-        session.add(user)
-
-    session.commit()
-    session.refresh(user)
+    user = await writer.run(upsert_user, google_sub, email, name, picture)
+    page_cache.invalidate_user(user.id)
 
     request.session["user_id"] = user.id
     request.session["google_sub"] = user.google_sub
@@ -229,10 +233,10 @@ def protected_app():
 def index(request: Request):
     if not is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
-    return templates.TemplateResponse(
+    return render_page(
+        request,
         "pages/index.html",
         {
-            "request": request,
             "page_title": "Sipp",
             "header_title": "Sipp",
             "header_subtitle": "Private coffee journal",
@@ -245,10 +249,10 @@ def index(request: Request):
 def create_page(request: Request):
     if not is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
-    return templates.TemplateResponse(
+    return render_page(
+        request,
         "pages/create.html",
         {
-            "request": request,
             "page_title": "New log - Sipp",
             "header_title": "Coffee",
             "header_subtitle": "Capture brew and tasting details",
@@ -261,10 +265,10 @@ def create_page(request: Request):
 def view_page(request: Request):
     if not is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
-    return templates.TemplateResponse(
+    return render_page(
+        request,
         "pages/view.html",
         {
-            "request": request,
             "page_title": "View Entry - Sipp",
             "header_title": "Entry Details",
             "header_subtitle": "Read-only coffee log entry",
@@ -274,27 +278,155 @@ def view_page(request: Request):
 
 
 @app.get("/settings", include_in_schema=False)
-def settings_page(request: Request, session: Session = Depends(get_session)):
+async def settings_page(request: Request, session: AsyncSession = Depends(get_async_session)):
     if not is_authenticated(request):
         return RedirectResponse("/login", status_code=302)
 
-    user_id = request.session.get("user_id")
-    user = session.get(UserRecord, int(user_id)) if user_id else None
-    if not user:
+    user_id = int(request.session.get("user_id"))
+    locale = negotiate_locale(request.headers.get("accept-language", ""))
+    # Logins handled by other workers change updated_at, so their page is not reused.
+    updated_at = await session.scalar(select(UserRecord.updated_at).where(UserRecord.id == user_id))
+    if updated_at is None:
         request.session.clear()
         return RedirectResponse("/login", status_code=302)
-
-    return templates.TemplateResponse(
-        "pages/settings.html",
-        {
-            "request": request,
-            "page_title": "Settings - Sipp",
-            "header_title": "Settings",
-            "header_subtitle": "Offline and sync controls",
-            "header_show_status": False,
-            "user": user,
+    page = page_cache.cached_for_user("pages/settings.html", locale, user_id, updated_at)
+    if page is None:
+        user = await session.get(UserRecord, user_id)
+        if not user:
+            request.session.clear()
+            return RedirectResponse("/login", status_code=302)
+        page = page_cache.get(
+            "pages/settings.html",
+            locale,
+            {
+                "page_title": "Settings - Sipp",
+                "header_title": "Settings",
+                "header_subtitle": "Offline and sync controls",
+                "header_show_status": False,
+                "user": user,
+            },
+            user_id=user.id,
+            user_version=user.updated_at,
+        )
+    return page_response(request, page)
+
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    stats = writer.stats()
+    storage_stats = storage.stats()
+    return {
+        "ok": True,
+        "writer": {
+            "queue_depth": stats.queue_depth,
+            "batches": stats.batches,
+            "writes": stats.writes,
+            "failed_writes": stats.failed_writes,
+            "last_batch_size": stats.last_batch_size,
+            "max_batch_size": stats.max_batch_size,
+            "mean_batch_size": round(stats.mean_batch_size, 2),
         },
-    )
+        "storage": {
+            "mode": storage_stats.mode,
+            "open_shards": storage_stats.open_shards,
+        },
+    }
+
+
+def writer_metrics() -> list[str]:
+    stats = writer.stats()
+    return [
+        "# HELP coffeelog_writer_queue_depth Write jobs waiting for the writer thread.",
+        "# TYPE coffeelog_writer_queue_depth gauge",
+        f"coffeelog_writer_queue_depth {stats.queue_depth}",
+        "# HELP coffeelog_writer_writes_total Write jobs run by the writer thread.",
+        "# TYPE coffeelog_writer_writes_total counter",
+        f"coffeelog_writer_writes_total {stats.writes}",
+        "# HELP coffeelog_writer_failed_writes_total Write jobs that raised.",
+        "# TYPE coffeelog_writer_failed_writes_total counter",
+        f"coffeelog_writer_failed_writes_total {stats.failed_writes}",
+        "# HELP coffeelog_writer_batches_total Group commits.",
+        "# TYPE coffeelog_writer_batches_total counter",
+        f"coffeelog_writer_batches_total {stats.batches}",
+    ]
+
+
+def storage_metrics() -> list[str]:
+    stats = storage.stats()
+    return [
+        "# HELP coffeelog_open_shards Per-user database shards currently open.",
+        "# TYPE coffeelog_open_shards gauge",
+        f"coffeelog_open_shards {stats.open_shards}",
+        "# HELP coffeelog_shards_opened_total Per-user database shards opened.",
+        "# TYPE coffeelog_shards_opened_total counter",
+        f"coffeelog_shards_opened_total {stats.opened}",
+        "# HELP coffeelog_shards_evicted_total Per-user database shards closed by the LRU or idle eviction.",
+        "# TYPE coffeelog_shards_evicted_total counter",
+        f"coffeelog_shards_evicted_total {stats.evicted}",
+    ]
+
+
+def change_feed_metrics() -> list[str]:
+    return [
+        "# HELP coffeelog_change_streams Open /api/changes/stream connections.",
+        "# TYPE coffeelog_change_streams gauge",
+        f"coffeelog_change_streams {change_feed.connections()}",
+        "# HELP coffeelog_change_notices_total Change notices published to at least one open stream.",
+        "# TYPE coffeelog_change_notices_total counter",
+        f"coffeelog_change_notices_total {change_feed.published}",
+    ]
+
+
+def admission_metrics() -> list[str]:
+    return [
+        "# HELP coffeelog_entry_reads_started_total Entry list responses produced.",
+        "# TYPE coffeelog_entry_reads_started_total counter",
+        f"coffeelog_entry_reads_started_total {entry_reads.started}",
+        "# HELP coffeelog_entry_reads_coalesced_total Entry list requests served by joining an identical one in flight.",
+        "# TYPE coffeelog_entry_reads_coalesced_total counter",
+        f"coffeelog_entry_reads_coalesced_total {entry_reads.joined}",
+        "# HELP coffeelog_writes_admitted_total Writes admitted by the per-user rate limit.",
+        "# TYPE coffeelog_writes_admitted_total counter",
+        f"coffeelog_writes_admitted_total {write_limiter.admitted}",
+        "# HELP coffeelog_writes_rejected_total Writes refused with 429 by the per-user rate limit.",
+        "# TYPE coffeelog_writes_rejected_total counter",
+        f"coffeelog_writes_rejected_total {write_limiter.rejected}",
+    ]
+
+
+def response_cache_metrics() -> list[str]:
+    return [
+        "# HELP coffeelog_response_cache_bytes Bytes held by the entry response cache.",
+        "# TYPE coffeelog_response_cache_bytes gauge",
+        f"coffeelog_response_cache_bytes {response_cache.bytes}",
+        "# HELP coffeelog_response_cache_items Revisions and bodies held by the entry response cache.",
+        "# TYPE coffeelog_response_cache_items gauge",
+        f"coffeelog_response_cache_items {len(response_cache)}",
+        "# HELP coffeelog_response_cache_hits_total Entry response cache lookups answered from memory.",
+        "# TYPE coffeelog_response_cache_hits_total counter",
+        f"coffeelog_response_cache_hits_total {response_cache.hits}",
+        "# HELP coffeelog_response_cache_misses_total Entry response cache lookups that went to the database.",
+        "# TYPE coffeelog_response_cache_misses_total counter",
+        f"coffeelog_response_cache_misses_total {response_cache.misses}",
+        "# HELP coffeelog_response_cache_evictions_total Items evicted by the entry response cache's size limit.",
+        "# TYPE coffeelog_response_cache_evictions_total counter",
+        f"coffeelog_response_cache_evictions_total {response_cache.evictions}",
+        "# HELP coffeelog_response_cache_invalidations_total Writes, local or from other workers, that dropped cached responses.",
+        "# TYPE coffeelog_response_cache_invalidations_total counter",
+        f"coffeelog_response_cache_invalidations_total {response_cache.invalidations}",
+    ]
+
+
+register_collector(writer_metrics)
+register_collector(storage_metrics)
+register_collector(change_feed_metrics)
+register_collector(admission_metrics)
+register_collector(response_cache_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/sw.js", include_in_schema=False)
@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+slow_query_logger = logging.getLogger("coffeelog.slow_query")
+
+# Queries slower than this are logged with their statement; 0 disables the log.
+SLOW_QUERY_MS = float(os.getenv("COFFEELOG_SLOW_QUERY_MS", "200"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # Per label set: one count per bucket plus +Inf, then the sum.
+        self._series: dict[Labels, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+http_requests = Counter("coffeelog_http_requests_total", "HTTP responses by route, method and status.")
+http_latency = Histogram(
+    "coffeelog_http_request_duration_seconds",
+    "Time from request to the last body byte, by route and method.",
+    LATENCY_BUCKETS,
+)
+request_queries = Histogram(
+    "coffeelog_db_queries_per_request",
+    "Database statements executed on behalf of one request, by route.",
+    QUERY_COUNT_BUCKETS,
+)
+request_query_time = Histogram(
+    "coffeelog_db_time_per_request_seconds",
+    "Time spent executing database statements for one request, by route.",
+    LATENCY_BUCKETS,
+)
+query_duration = Histogram(
+    "coffeelog_db_query_duration_seconds",
+    "Duration of individual database statements, by engine.",
+    QUERY_TIME_BUCKETS,
+)
+slow_queries = Counter("coffeelog_db_slow_queries_total", "Statements slower than COFFEELOG_SLOW_QUERY_MS, by engine.")
+oauth_duration = Histogram(
+    "coffeelog_oauth_duration_seconds",
+    "Google OAuth steps (token exchange, certificate fetch, ID token verification) by outcome.",
+    LATENCY_BUCKETS,
+)
+
+REGISTRY: list = [
+    http_requests,
+    http_latency,
+    request_queries,
+    request_query_time,
+    query_duration,
+    slow_queries,
+    oauth_duration,
+]
+
+# Extra gauge lines computed when /metrics is scraped, e.g. the write queue.
+_collectors: list[Callable[[], list[str]]] = []
+
+
+def register_collector(collector: Callable[[], list[str]]) -> None:
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+@dataclass
+class RequestDbStats:
+    queries: int = 0
+    seconds: float = 0.0
+
+
+# Set per request; the writer runs jobs in the submitting request's context,
+# so its statements are attributed to that request as well.
+current_request_stats: contextvars.ContextVar[Optional[RequestDbStats]] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+
+def record_query(engine_name: str, statement: str, seconds: float) -> None:
+    query_duration.observe(seconds, engine=engine_name)
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(engine=engine_name)
+        slow_query_logger.warning("Slow query on %s engine (%.1f ms): %s", engine_name, seconds * 1000, statement)
+
+
+def _route_label(scope: Scope, root_path: str) -> str:
+    """The route template, never the raw path, so label values stay bounded.
+
+    The router sets ``route`` on the scope it is given, so middleware between
+    this one and the router must pass the same scope on rather than a copy.
+    """
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    if scope.get("root_path", root_path) != root_path:
+        # Mounted apps such as /static extend the root path.
+        return scope["root_path"][len(root_path) :] or "/"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Record latency, status and database work for every HTTP request."""
+
+    def __init__(self, app: ASGIApp, skip_paths: tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        root_path = scope.get("root_path", "")
+        stats = RequestDbStats()
+        token = current_request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_request_stats.reset(token)
+            route = _route_label(scope, root_path)
+            method = scope["method"]
+            http_latency.observe(time.perf_counter() - started, route=route, method=method)
+            http_requests.inc(route=route, method=method, status=str(status))
+            request_queries.observe(stats.queries, route=route)
+            request_query_time.observe(stats.seconds, route=route)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Float, Integer, JSON, String, Text
+from sqlalchemy import Float, Index, Integer, JSON, String, Text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -33,6 +33,7 @@ class EntryRecord(Base):
     flavor: Mapped[list[str]] = mapped_column(JSON, default=list, nullable=False)
     aftertaste: Mapped[list[str]] = mapped_column(JSON, default=list, nullable=False)
     defects: Mapped[list[str]] = mapped_column(JSON, default=list, nullable=False)
+    photo_hashes: Mapped[list[str]] = mapped_column(JSON, default=list, nullable=False)
 
     acidity: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     sweetness: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -43,6 +44,88 @@ class EntryRecord(Base):
 
     notes: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
+    revision: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        Index("ix_entries_user_key_revision", "user_key", "revision"),
+        # Listing is ordered newest first by (brew_date, id); each equality filter
+        # gets its own index with that ordering suffix so pages are index scans.
+        Index("ix_entries_user_key_brew_date_id", "user_key", "brew_date", "id"),
+        Index("ix_entries_user_key_brew_method_brew_date_id", "user_key", "brew_method", "brew_date", "id"),
+        Index("ix_entries_user_key_origin_brew_date_id", "user_key", "origin", "brew_date", "id"),
+        Index("ix_entries_user_key_roastery_brew_date_id", "user_key", "roastery", "brew_date", "id"),
+    )
+
+
+class EntryTag(Base):
+    """One tasting tag of an entry, normalized to the flavor wheel / taste tag id."""
+
+    __tablename__ = "entry_tags"
+
+    entry_id: Mapped[str] = mapped_column(String, primary_key=True)
+    category: Mapped[str] = mapped_column(String, primary_key=True)
+    tag: Mapped[str] = mapped_column(String, primary_key=True)
+    user_key: Mapped[str] = mapped_column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_entry_tags_user_key_tag_entry_id", "user_key", "tag", "entry_id"),
+        Index("ix_entry_tags_user_key_category_tag", "user_key", "category", "tag"),
+    )
+
+
+class EntryTombstone(Base):
+    __tablename__ = "entry_tombstones"
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    user_key: Mapped[str] = mapped_column(String, nullable=False)
+    revision: Mapped[int] = mapped_column(Integer, nullable=False)
+    deleted_at: Mapped[str] = mapped_column(String, default=lambda: datetime.utcnow().isoformat(), nullable=False)
+
+    __table_args__ = (Index("ix_entry_tombstones_user_key_revision", "user_key", "revision"),)
+
+
+class PhotoRecord(Base):
+    __tablename__ = "photos"
+
+    user_key: Mapped[str] = mapped_column(String, primary_key=True)
+    sha256: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+    content_type: Mapped[str] = mapped_column(String, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[str] = mapped_column(String, default=lambda: datetime.utcnow().isoformat(), nullable=False)
+
+
+class EntryStat(Base):
+    """Running aggregates per user over one dimension value (e.g. origin "Kenya").
+
+    ``dimension`` is ``total`` (with an empty key), a grouping column, a brew
+    ratio bucket or a tasting tag category. Averages are ``*_sum / *_count``.
+    """
+
+    __tablename__ = "entry_stats"
+
+    user_key: Mapped[str] = mapped_column(String, primary_key=True)
+    dimension: Mapped[str] = mapped_column(String, primary_key=True)
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    entries: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    acidity_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    acidity_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sweetness_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sweetness_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    body_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    body_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    balance_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    balance_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    overall_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    overall_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    user_key: Mapped[str] = mapped_column(String, primary_key=True)
+    revision: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
 
 class UserRecord(Base):
     __tablename__ = "users"
@@ -59,3 +142,12 @@ class UserRecord(Base):
         onupdate=lambda: datetime.utcnow().isoformat(),
         nullable=False,
     )
+
+
+class SchemaVersion(Base):
+    """The number of migrations applied to this database file (one row)."""
+
+    __tablename__ = "schema_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
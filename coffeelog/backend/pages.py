@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from jinja2 import Environment
+
+from .compression import negotiate_encoding
+
+SUPPORTED_LOCALES = ("en", "ru")
+DEFAULT_LOCALE = "en"
+
+# Pages are behind a login redirect, so browsers must revalidate before reuse.
+PAGE_CACHE_CONTROL = "private, no-cache"
+
+PageKey = tuple[str, str, str, Optional[int], str]
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    digest: str
+    bodies: dict[str, bytes]
+
+
+def negotiate_locale(accept_language: str) -> str:
+    ranked = []
+    for position, part in enumerate(accept_language.split(",")):
+        tag, _, params = part.partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        language = tag.strip().lower()[:2]
+        if language in SUPPORTED_LOCALES and quality > 0:
+            ranked.append((-quality, position, language))
+    return min(ranked)[2] if ranked else DEFAULT_LOCALE
+
+
+class PageCache:
+    """Rendered pages kept as bytes, keyed by app version, template, locale and user.
+
+    Shared pages are rendered once per process. Per-user pages (settings)
+    are kept in a bounded LRU and also keyed by ``user_version``, the user
+    record's ``updated_at``, so a change made through any worker misses the
+    cache. ``invalidate_user`` frees them early in the worker that made it.
+    """
+
+    def __init__(self, env: Environment, app_version: str, max_user_pages: int = 1024):
+        self._env = env
+        self._app_version = app_version
+        self._max_user_pages = max_user_pages
+        self._shared: dict[PageKey, RenderedPage] = {}
+        self._per_user: OrderedDict[PageKey, RenderedPage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _render(self, template: str, context: dict[str, Any]) -> RenderedPage:
+        body = self._env.get_template(template).render(context).encode()
+        return RenderedPage(
+            digest=hashlib.sha256(body).hexdigest()[:20],
+            bodies={"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)},
+        )
+
+    def get(
+        self,
+        template: str,
+        locale: str,
+        context: dict[str, Any],
+        user_id: Optional[int] = None,
+        user_version: str = "",
+    ) -> RenderedPage:
+        key = (self._app_version, template, locale, user_id, user_version)
+        pages = self._shared if user_id is None else self._per_user
+        with self._lock:
+            page = pages.get(key)
+            if page is not None and user_id is not None:
+                self._per_user.move_to_end(key)
+        if page is not None:
+            return page
+
+        page = self._render(template, {**context, "locale": locale})
+        with self._lock:
+            if user_id is not None:
+                # Older versions of this user's page are never asked for again.
+                for stale in [other for other in self._per_user if other[:4] == key[:4] and other != key]:
+                    del self._per_user[stale]
+            pages[key] = page
+            while len(self._per_user) > self._max_user_pages:
+                self._per_user.popitem(last=False)
+        return page
+
+    def cached_for_user(self, template: str, locale: str, user_id: int, user_version: str) -> Optional[RenderedPage]:
+        with self._lock:
+            return self._per_user.get((self._app_version, template, locale, user_id, user_version))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in [key for key in self._per_user if key[3] == user_id]:
+                del self._per_user[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._shared.clear()
+            self._per_user.clear()
+
+
+def page_response(request: Request, page: RenderedPage) -> Response:
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), {"gzip": page.bodies["gzip"]})
+    headers = {
+        "ETag": f'"{page.digest}-{encoding or "identity"}"',
+        "Cache-Control": PAGE_CACHE_CONTROL,
+        "Vary": "Accept-Encoding, Accept-Language",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(page.bodies[encoding or "identity"], media_type="text/html", headers=headers)
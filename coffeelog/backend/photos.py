@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .models import PhotoRecord
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PHOTOS_DIR = BASE_DIR / "photos"
+
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+# A small file can still decode to a huge image; refuse those before they are stored.
+MAX_PHOTO_PIXELS = Image.MAX_IMAGE_PIXELS
+CHUNK_SIZE = 64 * 1024
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Longest edge in pixels for each generated rendition.
+RENDITIONS = {
+    "thumb": 320,
+    "display": 1280,
+}
+RENDITION_QUALITY = 82
+
+logger = logging.getLogger("coffeelog.photos")
+
+
+class PhotoTooLargeError(Exception):
+    pass
+
+
+class UnsupportedPhotoError(Exception):
+    pass
+
+
+def is_valid_hash(value: str) -> bool:
+    return bool(HASH_PATTERN.match(value))
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in {b"heic", b"heix", b"hevc", b"heim", b"heis"}:
+            return "image/heic"
+        if brand in {b"mif1", b"msf1", b"heif"}:
+            return "image/heif"
+    return None
+
+
+def original_path(sha256: str) -> Path:
+    return PHOTOS_DIR / "original" / sha256[:2] / sha256
+
+
+def rendition_path(sha256: str, size: str) -> Path:
+    return PHOTOS_DIR / size / sha256[:2] / f"{sha256}.jpg"
+
+
+def store_stream(source: BinaryIO) -> tuple[str, int, str]:
+    """Copy an upload to the content-addressed store in fixed-size chunks.
+
+    The bytes are hashed while they are written to a temporary file next to
+    the store, which is then renamed onto its SHA-256 path. A photo that is
+    already stored is not written twice. Returns ``(sha256, size, content_type)``.
+    """
+    staging_dir = PHOTOS_DIR / "tmp"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    content_type: Optional[str] = None
+
+    handle, staging_name = tempfile.mkstemp(dir=staging_dir)
+    staging_path = Path(staging_name)
+    try:
+        with os.fdopen(handle, "wb") as staging:
+            while chunk := source.read(CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_content_type(chunk)
+                    if content_type is None:
+                        raise UnsupportedPhotoError("Only JPEG, PNG, and HEIF photos are allowed")
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise PhotoTooLargeError(f"Photo exceeds {MAX_PHOTO_BYTES} bytes")
+                digest.update(chunk)
+                staging.write(chunk)
+
+        if content_type is None:
+            raise UnsupportedPhotoError("Empty upload")
+        check_dimensions(staging_path)
+
+        sha256 = digest.hexdigest()
+        target = original_path(sha256)
+        if target.exists():
+            staging_path.unlink()
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staging_path, target)
+        return sha256, size, content_type
+    except BaseException:
+        staging_path.unlink(missing_ok=True)
+        raise
+
+
+def check_dimensions(path: Path) -> None:
+    """Refuse images whose pixel count would make decoding them a memory bomb.
+
+    Only the header is read. Formats Pillow cannot open (HEIF without a
+    plugin) are let through; no rendition is made from them.
+    """
+    try:
+        with Image.open(path) as image:
+            pixels = image.width * image.height
+    except Image.DecompressionBombError as exc:
+        raise PhotoTooLargeError(str(exc)) from exc
+    except (UnidentifiedImageError, OSError):
+        return
+    if pixels > MAX_PHOTO_PIXELS:
+        raise PhotoTooLargeError(f"Photo exceeds {MAX_PHOTO_PIXELS} pixels")
+
+
+def record_photo(session: Session, user_key: str, sha256: str, content_type: str, size: int) -> None:
+    session.execute(
+        insert(PhotoRecord)
+        .values(user_key=user_key, sha256=sha256, content_type=content_type, size=size)
+        .on_conflict_do_nothing()
+    )
+
+
+def generate_renditions(sha256: str) -> None:
+    """Write the thumbnail and display JPEGs for a stored original.
+
+    Runs as a background task after the upload response has been sent.
+    Formats Pillow cannot decode (HEIF without a plugin) keep only the
+    original, which is then served for every size.
+    """
+    source = original_path(sha256)
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            for size, edge in RENDITIONS.items():
+                target = rendition_path(sha256, size)
+                if target.exists():
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                rendition = image.copy()
+                rendition.thumbnail((edge, edge))
+                # A staging file of its own, so concurrent uploads of the same photo never share one.
+                with tempfile.NamedTemporaryFile(dir=target.parent, suffix=".tmp", delete=False) as staging:
+                    try:
+                        rendition.save(staging, format="JPEG", quality=RENDITION_QUALITY, optimize=True)
+                    except BaseException:
+                        staging.close()
+                        os.unlink(staging.name)
+                        raise
+                os.replace(staging.name, target)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        logger.info("Skipping renditions for photo %s: %s", sha256, exc)
+
+
+def resolve_photo(sha256: str, size: str, content_type: str) -> tuple[Path, str, str]:
+    """Return the file, media type and actual size to serve, falling back to the original."""
+    if size in RENDITIONS:
+        path = rendition_path(sha256, size)
+        if path.exists():
+            return path, "image/jpeg", size
+    return original_path(sha256), content_type, "original"
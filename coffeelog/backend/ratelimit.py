@@ -0,0 +1,81 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+# Sustained writes per second per user, and how many may come at once; a rate of 0 disables the limit.
+WRITE_RATE = float(os.getenv("COFFEELOG_WRITE_RATE", "5"))
+WRITE_BURST = float(os.getenv("COFFEELOG_WRITE_BURST", "20"))
+
+
+@dataclass
+class Bucket:
+    tokens: float
+    updated: float
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets holding up to ``burst`` tokens, refilled at ``rate`` per second.
+
+    Buckets live in this process only, so with several workers each one
+    admits its own share. Buckets that have refilled are dropped, which
+    keeps memory proportional to the keys active in the last ``burst / rate``
+    seconds. Safe to call from several threads.
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._buckets: dict[str, Bucket] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; returns 0 when admitted, else the seconds until they are available."""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = Bucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                self.admitted += 1
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket.tokens) / self.rate
+
+    def _sweep(self, now: float) -> None:
+        # Called with the lock held.
+        if now < self._next_sweep:
+            return
+        refill_seconds = self.burst / self.rate
+        self._next_sweep = now + refill_seconds
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket.tokens + (now - bucket.updated) * self.rate < self.burst
+        }
+
+    def active_keys(self) -> int:
+        return len(self._buckets)
+
+
+def retry_after(seconds: float) -> str:
+    """A Retry-After value in whole seconds, never 0."""
+    return str(max(1, math.ceil(seconds)))
+
+
+write_limiter = TokenBucketLimiter(WRITE_RATE, WRITE_BURST)
@@ -1,16 +1,109 @@
-from typing import Union
+from typing import Any, AsyncIterator, BinaryIO, Literal, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-from .db import get_session
-from .models import EntryRecord
-from .schemas import EntryIn, EntryOut
+from .cache import REVISION_KEY, CachedBody, entry_key, list_key, response_cache
+from .changes import (
+    EVENT_STREAM_MEDIA_TYPE,
+    HEARTBEAT_SECONDS,
+    MAX_BACKFILL_CHANGES,
+    RETRY_MS,
+    change_feed,
+    format_event,
+    format_resync,
+    group_changes,
+)
+from .coalesce import entry_reads
+from .db import streaming_readers
+from .entries import (
+    EntryFilters,
+    EntryOwnershipError,
+    PreconditionFailedError,
+    bulk_upsert,
+    current_entry_etag,
+    delete_owned_entry,
+    list_entries,
+    list_statement,
+    patch_entry,
+    run_batch,
+    upsert_if_match,
+)
+from .models import EntryRecord, PhotoRecord
+from .photos import (
+    PhotoTooLargeError,
+    UnsupportedPhotoError,
+    generate_renditions,
+    is_valid_hash,
+    record_photo,
+    resolve_photo,
+    store_stream,
+)
+from .ratelimit import retry_after, write_limiter
+from .schemas import (
+    BatchRequest,
+    BatchResponse,
+    EntryChanges,
+    EntryIn,
+    EntryOut,
+    EntryPage,
+    EntryPatch,
+    EntryRevision,
+    PhotoOut,
+    SearchResults,
+    StatsOut,
+    TagCount,
+)
+from .search import search_entries
+from .serialization import (
+    CSV_MEDIA_TYPE,
+    JSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    STREAM_PARTITION_SIZE,
+    accepts_msgpack,
+    dumps,
+    encode_entries,
+    entry_columns,
+    entry_dict,
+    is_msgpack,
+    msgpack,
+    msgpack_map_head,
+    packb,
+    stream_json_array,
+    stream_csv,
+    stream_msgpack_array,
+    stream_ndjson,
+    unpackb,
+)
+from .stats import load_stats
+from .storage import storage
+from .sync import (
+    changes_after,
+    changes_statement,
+    collection_etag,
+    current_revision,
+    deleted_since,
+    entry_etag,
+    parse_etags,
+)
+from .tags import tag_counts
+from .transfer import ImportProgress, ImportTooLargeError, iter_import_batches, spool_upload
 
 router = APIRouter(prefix="/api", tags=["entries"])
 
+MAX_PAGE_SIZE = 500
+
+# Entry responses may be stored but must be revalidated before reuse.
+REVALIDATE = "private, no-cache"
+
+entries_payload_adapter = TypeAdapter(Union[EntryIn, list[EntryIn]])
+
 
 def get_authenticated_google_sub(request: Request) -> str:
     google_sub = str(request.session.get("google_sub") or "").strip()
@@ -20,77 +113,528 @@ def get_authenticated_google_sub(request: Request) -> str:
     return google_sub
 
 
-@router.get("/entries", response_model=list[EntryOut])
-def get_entries(
+async def get_user_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """A read session on the database that holds the signed-in user's entries."""
+    async with storage.session(get_authenticated_google_sub(request)) as session:
+        yield session
+
+
+async def admit_write(request: Request) -> str:
+    """Authenticate a write and charge it to the user's write rate limit.
+
+    Async so the limiter is charged on the event loop rather than in the threadpool.
+    """
+    google_sub = get_authenticated_google_sub(request)
+    wait = write_limiter.acquire(google_sub)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many writes", headers={"Retry-After": retry_after(wait)})
+    return google_sub
+
+
+def entries_changed(user_key: str, revision: int, op: str, ids: list[str]) -> None:
+    """Announce a committed write to open change streams and drop the responses it made stale."""
+    response_cache.invalidate(user_key, ids)
+    change_feed.publish(user_key, revision, op, ids)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    candidates = parse_etags(request.headers.get("if-none-match"), weak=True)
+    return bool(candidates) and ("*" in candidates or etag in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+
+
+def query_variant(request: Request) -> str:
+    return "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+
+
+def msgpack_response(value: Any, headers: Optional[dict[str, str]] = None) -> Response:
+    return Response(packb(value), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+
+
+async def read_entries_payload(request: Request) -> Union[EntryIn, list[EntryIn]]:
+    """The body of an entry upload: one entry or an array, as JSON or MessagePack."""
+    body = await request.body()
+    try:
+        if not is_msgpack(request.headers.get("content-type", "")):
+            return entries_payload_adapter.validate_json(body)
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="MessagePack is not available on this server")
+        return entries_payload_adapter.validate_python(unpackb(body))
+    except ValidationError as exc:
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in exc.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Malformed MessagePack body") from exc
+
+
+@router.get("/entries", response_model=Union[list[EntryOut], EntryPage, EntryChanges])
+async def get_entries(
     request: Request,
-    session: Session = Depends(get_session),
+    since: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    page_cursor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    brew_method: Optional[str] = None,
+    origin: Optional[str] = None,
+    roastery: Optional[str] = None,
+    min_overall: Optional[int] = None,
+    tag: list[str] = Query(default=[]),
+    tag_match: Literal["any", "all"] = "any",
+    tag_category: Optional[Literal["aroma", "flavor", "aftertaste", "defects"]] = None,
+    session: AsyncSession = Depends(get_user_session),
 ):
     google_sub = get_authenticated_google_sub(request)
-    statement = select(EntryRecord).where(EntryRecord.user_key == google_sub)
-    rows = session.execute(statement).scalars().all()
-    return [EntryOut.model_validate(row, from_attributes=True) for row in rows]
+    accept = request.headers.get("accept", "")
+    if accepts_msgpack(accept):
+        fmt, media_type = "msgpack", MSGPACK_MEDIA_TYPE
+    elif NDJSON_MEDIA_TYPE in accept and since is None and limit is None:
+        fmt, media_type = "ndjson", NDJSON_MEDIA_TYPE
+    else:
+        fmt, media_type = "json", JSON_MEDIA_TYPE
+
+    # Any change to the user's entries bumps the revision, so it validates every view of them.
+    # Writes drop the cached revision, so it is current as long as every worker's
+    # writes reach this one; otherwise it is read each time (one indexed query).
+    token = response_cache.token(google_sub)
+    revision = response_cache.get(google_sub, REVISION_KEY) if response_cache.sees_all_writes else None
+    if revision is None:
+        revision = await session.run_sync(current_revision, google_sub)
+        if response_cache.sees_all_writes:
+            response_cache.put(google_sub, REVISION_KEY, revision, token)
+    # The body is read on a session of its own, possibly another request's; hand
+    # this connection back so waiting on it cannot starve the reader pool.
+    await session.close()
+    variant = query_variant(request)
+    etag = collection_etag(google_sub, revision, f"{media_type};{variant}" if fmt != "json" else variant)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE, "Vary": "Accept"}
+    cache_key = list_key(etag)
+    cached = response_cache.get(google_sub, cache_key)
+    if cached is not None:
+        return Response(cached.body, media_type=media_type, headers=headers)
+    # The ETag names the user, revision, query and format, so requests with the
+    # same one (e.g. overlapping syncs from several tabs) share one run of the body.
+    flight_key = f"{google_sub}\n{etag}"
+
+    def produce(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        return response_cache.fill(google_sub, cache_key, etag, token, chunks)
+
+    if since is not None:
+        # The cursor is the revision read above, before any rows, so it never runs
+        # ahead of them; a change committed meanwhile is returned now or on the next
+        # pull. A cursor newer than the server state (e.g. after a database reset)
+        # falls back to a full pull.
+        if since > revision:
+            since = 0
+        body = entry_reads.stream(flight_key, lambda: produce(changes_body(google_sub, since, revision, fmt)))
+        return StreamingResponse(body, media_type=media_type, headers=headers)
+
+    filters = EntryFilters(
+        date_from=date_from,
+        date_to=date_to,
+        brew_method=brew_method,
+        origin=origin,
+        roastery=roastery,
+        min_overall=min_overall,
+        tags=tuple(tag),
+        tag_match=tag_match,
+        tag_category=tag_category,
+    )
+    try:
+        if limit is None:
+            statement = list_statement(google_sub, filters, page_cursor)
+            body = entry_reads.stream(flight_key, lambda: produce(stream_entries(google_sub, statement, fmt)))
+            return StreamingResponse(body, media_type=media_type, headers=headers)
+        body = await entry_reads.read(
+            flight_key, lambda: produce(page_body(google_sub, filters, limit, page_cursor, fmt))
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return Response(body, media_type=media_type, headers=headers)
+
+
+async def changes_body(user_key: str, since: int, revision: int, fmt: str) -> AsyncIterator[bytes]:
+    """The delta pull: ids deleted after ``since``, the new cursor and the changed entries."""
+    async with storage.session(user_key) as session:
+        deleted = await session.run_sync(deleted_since, user_key, since)
+    statement = changes_statement(user_key, since, entry_columns())
+    if fmt == "msgpack":
+        head, tail = msgpack_map_head({"deleted": deleted, "cursor": revision}, "entries"), b""
+    else:
+        fmt, head, tail = "json", dumps({"deleted": deleted, "cursor": revision})[:-1] + b',"entries":', b"}"
+    async for chunk in stream_entries(user_key, statement, fmt, head=head, tail=tail):
+        yield chunk
+
+
+async def page_body(
+    user_key: str,
+    filters: EntryFilters,
+    limit: int,
+    page_cursor: Optional[str],
+    fmt: str,
+) -> AsyncIterator[bytes]:
+    async with storage.session(user_key) as session:
+        rows, next_cursor = await session.run_sync(list_entries, user_key, filters, limit=limit, page_cursor=page_cursor)
+    if fmt == "msgpack":
+        yield packb({"entries": [entry_dict(row) for row in rows], "next_cursor": next_cursor})
+    else:
+        yield b'{"entries":[' + encode_entries(rows) + b'],"next_cursor":' + dumps(next_cursor) + b"}"
+
+
+async def stream_entries(
+    user_key: str,
+    statement: Select,
+    fmt: Literal["json", "ndjson", "csv", "msgpack"] = "json",
+    head: bytes = b"",
+    tail: bytes = b"",
+) -> AsyncIterator[bytes]:
+    """Stream entry rows straight from a server-side cursor to the client.
+
+    Runs on its own session: the request's session is closed before a
+    streaming body is sent. Waits for one of the ``streaming_readers``
+    slots first, so slow downloads cannot hold the whole reader pool.
+    """
+    if fmt == "msgpack":
+        # Counted in the same statement, so the array length always matches the rows sent.
+        statement = statement.add_columns(func.count().over())
+    async with streaming_readers, storage.session(user_key) as session:
+        result = await session.stream(statement.execution_options(yield_per=STREAM_PARTITION_SIZE))
+        if fmt == "ndjson":
+            chunks = stream_ndjson(result)
+        elif fmt == "csv":
+            chunks = stream_csv(result)
+        elif fmt == "msgpack":
+            chunks = stream_msgpack_array(result, head)
+        else:
+            chunks = stream_json_array(result, head, tail)
+        async for chunk in chunks:
+            yield chunk
 
 
 @router.get("/entry/{entry_id}", response_model=EntryOut)
-def get_entry(
+async def get_entry(
     request: Request,
     entry_id: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_user_session),
 ):
     google_sub = get_authenticated_google_sub(request)
-    row = session.get(EntryRecord, entry_id)
-    if not row or row.user_key != google_sub:
-        raise HTTPException(status_code=404, detail="Entry not found")
-    return EntryOut.model_validate(row, from_attributes=True)
+    if accepts_msgpack(request.headers.get("accept", "")):
+        fmt, media_type = "msgpack", MSGPACK_MEDIA_TYPE
+    else:
+        fmt, media_type = "json", JSON_MEDIA_TYPE
+    cache_key = entry_key(entry_id, fmt)
+    token = response_cache.token(google_sub)
+    cached = response_cache.get(google_sub, cache_key)
+    if cached is not None and not response_cache.sees_all_writes:
+        # Another worker may have changed the entry; its revision says whether the body still holds.
+        etag = await session.run_sync(current_entry_etag, google_sub, entry_id)
+        if etag is None:
+            raise HTTPException(status_code=404, detail="Entry not found")
+        if etag != cached.etag:
+            cached = None
+    if cached is None:
+        row = await session.get(EntryRecord, entry_id)
+        if not row or row.user_key != google_sub:
+            raise HTTPException(status_code=404, detail="Entry not found")
+        entry = EntryOut.model_validate(row, from_attributes=True).model_dump(by_alias=True)
+        cached = CachedBody(entry_etag(row.revision), packb(entry) if fmt == "msgpack" else dumps(entry))
+        response_cache.put(google_sub, cache_key, cached, token, len(cached.body))
+
+    if etag_matches(request, cached.etag):
+        return not_modified(cached.etag)
+    # The ETag names the entry's revision, which JSON and MessagePack share.
+    headers = {"ETag": cached.etag, "Cache-Control": REVALIDATE, "Vary": "Accept"}
+    return Response(cached.body, media_type=media_type, headers=headers)
 
 
 @router.post("/entries", response_model=list[EntryOut])
-def upsert_entries(
+async def upsert_entries(
     request: Request,
-    payload: Union[EntryIn, list[EntryIn]],
-    session: Session = Depends(get_session),
+    response: Response,
+    google_sub: str = Depends(admit_write),
+    payload: Union[EntryIn, list[EntryIn]] = Depends(read_entries_payload),
 ):
-    google_sub = get_authenticated_google_sub(request)
-    entries = payload if isinstance(payload, list) else [payload]
-
-    saved: list[EntryRecord] = []
-    for entry in entries:
-        data = entry.model_dump(by_alias=True)
-        if "yield" in data:
-            data["yield_amount"] = data.pop("yield")
-        data["user_key"] = google_sub
-
-        existing = session.get(EntryRecord, entry.id)
-        if existing and existing.user_key != x_user_key:
-            raise HTTPException(status_code=403, detail="Entry belongs to another user")
-
-        if existing:
-            for key, value in data.items():
-                setattr(existing, key, value)
-            saved.append(existing)
-        else:
-            new_row = EntryRecord(**data)
-            session.add(new_row)
-            saved.append(new_row)
+    single = not isinstance(payload, list)
+    entries = [payload] if single else payload
+    # If-Match is checked against the entry for a single object, else against the whole collection.
+    if_match = parse_etags(request.headers.get("if-match"))
 
-    session.commit()
-    for row in saved:
-        session.refresh(row)
+    try:
+        saved = await storage.write(
+            google_sub, upsert_if_match, entries, if_match, entry_id=payload.id if single else None
+        )
+    except EntryOwnershipError as exc:
+        raise HTTPException(status_code=403, detail="Entry belongs to another user") from exc
+    except PreconditionFailedError as exc:
+        raise HTTPException(status_code=412, detail=str(exc)) from exc
 
-    return [EntryOut.model_validate(row, from_attributes=True) for row in saved]
+    if saved:
+        entries_changed(google_sub, saved[0].revision, "upsert", [entry.id for entry in saved])
+    headers = {"ETag": entry_etag(saved[0].revision)} if single else {}
+    if accepts_msgpack(request.headers.get("accept", "")):
+        return msgpack_response([entry.model_dump(by_alias=True) for entry in saved], headers)
+    response.headers.update(headers)
+    return saved
+
+
+@router.patch("/entry/{entry_id}", response_model=EntryRevision)
+async def patch_entry_fields(
+    request: Request,
+    entry_id: str,
+    payload: EntryPatch,
+    response: Response,
+    google_sub: str = Depends(admit_write),
+):
+    """Change some fields of an entry (JSON Merge Patch) without re-sending the rest."""
+    if_match = parse_etags(request.headers.get("if-match"))
+    changes = payload.changes()
+    try:
+        revision = await storage.write(google_sub, patch_entry, entry_id, changes, if_match)
+    except PreconditionFailedError as exc:
+        raise HTTPException(status_code=412, detail=str(exc)) from exc
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Entry not found")
+
+    if changes:
+        entries_changed(google_sub, revision, "upsert", [entry_id])
+    response.headers["ETag"] = entry_etag(revision)
+    return EntryRevision(id=entry_id, revision=revision)
+
+
+@router.post("/entries/batch", response_model=BatchResponse)
+async def batch_entries(
+    payload: BatchRequest,
+    google_sub: str = Depends(admit_write),
+):
+    """Run upsert, patch, delete and get operations in order as one transaction.
+
+    Missing entries are reported per operation with status 404. An upsert of
+    another user's entry fails the whole batch with 403 and nothing is written.
+    """
+    try:
+        results, revision = await storage.write(google_sub, run_batch, payload.operations)
+    except EntryOwnershipError as exc:
+        raise HTTPException(status_code=403, detail="Entry belongs to another user") from exc
+
+    changed: dict[tuple[int, str], list[str]] = {}
+    for result in results:
+        if result["op"] != "get" and result["status"] == 200:
+            # Change streams only know whole-entry upserts and deletes.
+            op = "delete" if result["op"] == "delete" else "upsert"
+            changed.setdefault((result["revision"], op), []).append(result["id"])
+    for (change_revision, op), ids in changed.items():
+        entries_changed(google_sub, change_revision, op, ids)
+    return Response(dumps({"results": results, "revision": revision}), media_type=JSON_MEDIA_TYPE)
 
 
 @router.delete("/entry/{entry_id}")
-def delete_entry(
+async def delete_entry(
     request: Request,
     entry_id: str,
-    session: Session = Depends(get_session),
+    google_sub: str = Depends(admit_write),
 ):
-    google_sub = get_authenticated_google_sub(request)
-    row = session.get(EntryRecord, entry_id)
-    if not row or row.user_key != google_sub:
+    if_match = parse_etags(request.headers.get("if-match"))
+    try:
+        revision = await storage.write(google_sub, delete_owned_entry, entry_id, if_match)
+    except PreconditionFailedError as exc:
+        raise HTTPException(status_code=412, detail=str(exc)) from exc
+    if revision is None:
         raise HTTPException(status_code=404, detail="Entry not found")
 
-    session.delete(row)
-    session.commit()
+    entries_changed(google_sub, revision, "delete", [entry_id])
+
     return JSONResponse({"ok": True})
+
+
+@router.get("/changes/stream", tags=["sync"])
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(default=None, ge=0),
+):
+    """Server-sent notices of the user's committed changes.
+
+    Each event is one commit: its id is the revision, its type the operation
+    (``upsert`` or ``delete``) and its data lists the entry ids. A reconnect's
+    Last-Event-ID, or ``since`` on the first connect, replays what was missed.
+    """
+    google_sub = get_authenticated_google_sub(request)
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        change_events(google_sub, since),
+        media_type=EVENT_STREAM_MEDIA_TYPE,
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+async def change_events(user_key: str, since: Optional[int]) -> AsyncIterator[bytes]:
+    # Subscribe before reading the revision: a commit after the read is then
+    # always in the queue, one before it in the backlog.
+    subscription = change_feed.subscribe(user_key)
+    try:
+        yield b"retry: %d\n\n" % RETRY_MS
+        # The shard (if any) is held only for the backlog, not for the life of the stream.
+        async with storage.session(user_key) as session:
+            revision = await session.run_sync(current_revision, user_key)
+            rows: Optional[list] = []
+            if since is not None and since < revision:
+                rows = await session.run_sync(changes_after, user_key, since, MAX_BACKFILL_CHANGES)
+        if rows is None or (since is not None and since > revision):
+            # Too much to list, or a cursor from before a database reset.
+            yield format_resync(revision)
+        else:
+            for notice in group_changes(rows):
+                yield format_event(notice)
+
+        while not subscription.overflowed:
+            notice = await subscription.next(HEARTBEAT_SECONDS)
+            if notice is None:
+                yield b": heartbeat\n\n"
+            elif notice.revision > revision:
+                yield format_event(notice)
+    finally:
+        change_feed.unsubscribe(user_key, subscription)
+
+
+@router.get("/export", tags=["transfer"])
+async def export_entries(
+    request: Request,
+    export_format: Literal["jsonl", "csv"] = Query(default="jsonl", alias="format"),
+):
+    google_sub = get_authenticated_google_sub(request)
+    statement = (
+        select(*entry_columns())
+        .where(EntryRecord.user_key == google_sub)
+        .order_by(EntryRecord.brew_date, EntryRecord.id)
+    )
+    fmt, media_type = ("csv", CSV_MEDIA_TYPE) if export_format == "csv" else ("ndjson", NDJSON_MEDIA_TYPE)
+    return StreamingResponse(
+        stream_entries(google_sub, statement, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="coffeelog-export.{export_format}"'},
+    )
+
+
+@router.post("/import", tags=["transfer"])
+async def import_entries(
+    request: Request,
+    import_format: Optional[Literal["jsonl", "csv"]] = Query(default=None, alias="format"),
+    remap_ids: bool = False,
+    google_sub: str = Depends(admit_write),
+):
+    if import_format is None:
+        import_format = "csv" if request.headers.get("content-type", "").startswith(CSV_MEDIA_TYPE) else "jsonl"
+    try:
+        source = await spool_upload(request.stream())
+    except ImportTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+
+    return StreamingResponse(run_import(source, import_format, google_sub, remap_ids), media_type=NDJSON_MEDIA_TYPE)
+
+
+async def run_import(source: BinaryIO, fmt: str, user_key: str, remap_ids: bool) -> AsyncIterator[bytes]:
+    """Import batch by batch, one transaction each, reporting progress as NDJSON lines."""
+    progress = ImportProgress()
+    batches = iter_import_batches(source, fmt, user_key, remap_ids)
+    try:
+        # Parsing and validation run in a worker thread; the writer commits each batch.
+        while (batch := await run_in_threadpool(next, batches, None)) is not None:
+            progress.records += batch.records
+            for line, message in batch.errors:
+                progress.add_error(line, message)
+            entries = batch.entries
+            while entries:
+                try:
+                    saved = await storage.write(user_key, bulk_upsert, entries)
+                except EntryOwnershipError as exc:
+                    progress.add_error(None, "Entry belongs to another user", exc.entry_id)
+                    entries = [entry for entry in entries if entry.id != exc.entry_id]
+                else:
+                    progress.imported += len(entries)
+                    entries_changed(user_key, saved[0].revision, "upsert", [entry.id for entry in saved])
+                    break
+            progress.batches += 1
+            yield progress.event()
+        yield progress.event(done=True)
+    finally:
+        source.close()
+
+
+@router.get("/stats", response_model=StatsOut, tags=["stats"])
+async def get_stats(
+    request: Request,
+    top: int = Query(default=10, ge=1, le=100),
+    session: AsyncSession = Depends(get_user_session),
+):
+    google_sub = get_authenticated_google_sub(request)
+    return await session.run_sync(load_stats, google_sub, top)
+
+
+@router.get("/tags/{category}/counts", response_model=list[TagCount], tags=["stats"])
+async def get_tag_counts(
+    request: Request,
+    category: Literal["aroma", "flavor", "aftertaste", "defects"],
+    session: AsyncSession = Depends(get_user_session),
+):
+    google_sub = get_authenticated_google_sub(request)
+    return await session.run_sync(tag_counts, google_sub, category)
+
+
+@router.get("/search", response_model=SearchResults, tags=["search"])
+async def search(
+    request: Request,
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    session: AsyncSession = Depends(get_user_session),
+):
+    google_sub = get_authenticated_google_sub(request)
+    return await session.run_sync(search_entries, google_sub, q, limit, offset)
+
+
+@router.post("/photos", response_model=PhotoOut, status_code=201, tags=["photos"])
+async def upload_photo(
+    background_tasks: BackgroundTasks,
+    google_sub: str = Depends(admit_write),
+    file: UploadFile = File(...),
+):
+    try:
+        sha256, size, content_type = await run_in_threadpool(store_stream, file.file)
+    except PhotoTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except UnsupportedPhotoError as exc:
+        raise HTTPException(status_code=415, detail=str(exc)) from exc
+
+    await storage.write(google_sub, record_photo, sha256, content_type, size)
+
+    background_tasks.add_task(generate_renditions, sha256)
+    return PhotoOut(sha256=sha256, size=size, content_type=content_type)
+
+
+@router.get("/photos/{sha256}", tags=["photos"])
+async def get_photo(
+    request: Request,
+    sha256: str,
+    size: str = Query(default="original", pattern="^(original|display|thumb)$"),
+    session: AsyncSession = Depends(get_user_session),
+):
+    google_sub = get_authenticated_google_sub(request)
+    record = await session.get(PhotoRecord, (google_sub, sha256)) if is_valid_hash(sha256) else None
+    if not record:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    path, media_type, served_size = resolve_photo(sha256, size, record.content_type)
+    etag = f'"{sha256}-{served_size}"'
+    # A fallback to the original while the rendition is pending must not be cached for good.
+    cache_control = "private, max-age=31536000, immutable" if served_size == size else "private, no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -1,6 +1,9 @@
-from typing import Optional
+from typing import Any, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+MAX_BATCH_OPERATIONS = 1000
+PATCH_LIST_FIELDS = ("aroma", "flavor", "aftertaste", "defects", "photo_hashes")
 
 
 class EntryBase(BaseModel):
@@ -23,6 +26,7 @@ class EntryBase(BaseModel):
     flavor: list[str] = Field(default_factory=list)
     aftertaste: list[str] = Field(default_factory=list)
     defects: list[str] = Field(default_factory=list)
+    photo_hashes: list[str] = Field(default_factory=list)
 
     acidity: Optional[int] = None
     sweetness: Optional[int] = None
@@ -40,3 +44,164 @@ class EntryIn(EntryBase):
 
 class EntryOut(EntryBase):
     model_config = ConfigDict(populate_by_name=True, from_attributes=True)
+
+    revision: int = 0
+
+
+class EntryPatch(BaseModel):
+    """A JSON Merge Patch of an entry: absent fields are kept, ``null`` clears one.
+
+    Fields are typed as in ``EntryIn``; the id cannot be changed.
+    """
+
+    model_config = ConfigDict(populate_by_name=True, extra="forbid")
+
+    created_at: Optional[str] = None
+    brew_date: Optional[str] = None
+    coffee_name: Optional[str] = None
+
+    roastery: Optional[str] = None
+    origin: Optional[str] = None
+    process: Optional[str] = None
+    brew_method: Optional[str] = None
+    grind_size: Optional[str] = None
+    water_temp: Optional[float] = None
+    dose: Optional[float] = None
+    yield_amount: Optional[float] = Field(default=None, alias="yield")
+    brew_time: Optional[str] = None
+
+    aroma: Optional[list[str]] = None
+    flavor: Optional[list[str]] = None
+    aftertaste: Optional[list[str]] = None
+    defects: Optional[list[str]] = None
+    photo_hashes: Optional[list[str]] = None
+
+    acidity: Optional[int] = None
+    sweetness: Optional[int] = None
+    bitterness: Optional[int] = None
+    body: Optional[int] = None
+    balance: Optional[int] = None
+    overall: Optional[int] = None
+
+    notes: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _check_required(self) -> "EntryPatch":
+        for name in ("created_at", "brew_date", "coffee_name"):
+            if name in self.model_fields_set and getattr(self, name) is None:
+                raise ValueError(f"{name} cannot be removed")
+        return self
+
+    def changes(self) -> dict[str, Any]:
+        """The columns to write; removing a list empties it."""
+        changes = self.model_dump(exclude_unset=True)
+        for name, value in changes.items():
+            if value is None and name in PATCH_LIST_FIELDS:
+                changes[name] = []
+        return changes
+
+
+class EntryRevision(BaseModel):
+    id: str
+    revision: int
+
+
+class BatchOperation(BaseModel):
+    op: Literal["upsert", "patch", "delete", "get"]
+    # The entry to write for upserts, the id to patch, delete or fetch otherwise.
+    entry: Optional[EntryIn] = None
+    id: Optional[str] = None
+    # The fields to change for patches, as for PATCH /api/entry/{id}.
+    patch: Optional[EntryPatch] = None
+
+    @model_validator(mode="after")
+    def _check_target(self) -> "BatchOperation":
+        if self.op == "upsert":
+            if self.entry is None:
+                raise ValueError("upsert needs an entry")
+            self.id = self.entry.id
+        elif self.id is None:
+            raise ValueError(f"{self.op} needs an id")
+        elif self.op == "patch" and self.patch is None:
+            raise ValueError("patch needs the fields to change")
+        return self
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
+class BatchResult(BaseModel):
+    op: str
+    id: str
+    status: int
+    revision: Optional[int] = None
+    entry: Optional[EntryOut] = None
+
+
+class BatchResponse(BaseModel):
+    results: list[BatchResult]
+    revision: int
+
+
+class EntryChanges(BaseModel):
+    entries: list[EntryOut]
+    deleted: list[str]
+    cursor: int
+
+
+class EntryPage(BaseModel):
+    entries: list[EntryOut]
+    next_cursor: Optional[str] = None
+
+
+class PhotoOut(BaseModel):
+    sha256: str
+    size: int
+    content_type: str
+
+
+class ScoreAverages(BaseModel):
+    acidity: Optional[float] = None
+    sweetness: Optional[float] = None
+    body: Optional[float] = None
+    balance: Optional[float] = None
+    overall: Optional[float] = None
+
+
+class StatGroup(BaseModel):
+    key: str
+    entries: int
+    averages: ScoreAverages
+
+
+class RatioBucket(BaseModel):
+    ratio: str
+    entries: int
+
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+
+class StatsOut(BaseModel):
+    entries: int
+    averages: ScoreAverages
+    by_origin: list[StatGroup]
+    by_process: list[StatGroup]
+    by_brew_method: list[StatGroup]
+    brew_ratios: list[RatioBucket]
+    top_aroma: list[TagCount]
+    top_flavor: list[TagCount]
+
+
+class SearchHit(BaseModel):
+    entry: EntryOut
+    snippet: str
+    rank: float
+
+
+class SearchResults(BaseModel):
+    results: list[SearchHit]
+    next_offset: Optional[int] = None
@@ -0,0 +1,173 @@
+import argparse
+import html
+from typing import Optional
+
+from sqlalchemy import Connection, select, text
+from sqlalchemy.orm import Session
+
+from .models import EntryRecord
+from .schemas import EntryOut, SearchHit, SearchResults
+
+FTS_TABLE = "entries_fts"
+
+# Snippet markers that cannot occur in user text; replaced by <mark> after escaping.
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+CREATE_FTS_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    user_key UNINDEXED,
+    coffee_name,
+    roastery,
+    origin,
+    notes,
+    tags,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# Column weights for bm25(), in table order; a hit in the coffee name ranks highest.
+RANK_EXPRESSION = f"bm25({FTS_TABLE}, 0.0, 10.0, 5.0, 4.0, 1.0, 3.0)"
+
+# Rows are keyed by the rowid of the entry, which an upsert keeps stable.
+# VACUUM may renumber those rowids, so reindex after running it.
+_INDEX_SOURCE_SQL = """
+SELECT
+    entries.rowid,
+    entries.user_key,
+    entries.coffee_name,
+    coalesce(entries.roastery, ''),
+    coalesce(entries.origin, ''),
+    coalesce(entries.notes, ''),
+    trim(
+        coalesce((SELECT group_concat(value, ' ') FROM json_each(entries.aroma)), '') || ' ' ||
+        coalesce((SELECT group_concat(value, ' ') FROM json_each(entries.flavor)), '') || ' ' ||
+        coalesce((SELECT group_concat(value, ' ') FROM json_each(entries.aftertaste)), '')
+    )
+FROM entries
+"""
+# Entry columns the index rows are built from.
+INDEXED_COLUMNS = ("coffee_name", "roastery", "origin", "notes", "aroma", "flavor", "aftertaste")
+_INSERT_SQL = f"INSERT INTO {FTS_TABLE}(rowid, user_key, coffee_name, roastery, origin, notes, tags) "
+
+
+def create_search_index(connection: Connection) -> bool:
+    """Create the FTS table; returns True when it did not exist before."""
+    existed = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE},
+    ).first()
+    connection.execute(text(CREATE_FTS_SQL))
+    return existed is None
+
+
+def index_entries(session: Session, entry_ids: list[str]) -> None:
+    """Replace the index rows of the given entries with their stored values."""
+    if not entry_ids:
+        return
+    params = {f"id_{index}": entry_id for index, entry_id in enumerate(entry_ids)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT rowid FROM entries WHERE id IN ({placeholders}))"),
+        params,
+    )
+    session.execute(text(f"{_INSERT_SQL}{_INDEX_SOURCE_SQL} WHERE entries.id IN ({placeholders})"), params)
+
+
+def unindex_entries(session: Session, entry_ids: list[str]) -> None:
+    if not entry_ids:
+        return
+    params = {f"id_{index}": entry_id for index, entry_id in enumerate(entry_ids)}
+    placeholders = ", ".join(f":{name}" for name in params)
+    session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT rowid FROM entries WHERE id IN ({placeholders}))"),
+        params,
+    )
+
+
+def reindex(session: Session) -> int:
+    session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    session.execute(text(f"{_INSERT_SQL}{_INDEX_SOURCE_SQL}"))
+    session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar_one()
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Words are quoted so FTS5 operators and punctuation in user input are
+    treated as plain text.
+    """
+    # Words without letters or digits produce no tokens and would never match.
+    terms = [term.replace('"', '""') for term in query.split() if any(char.isalnum() for char in term)]
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' for term in terms)
+
+
+def render_snippet(raw: str) -> str:
+    return html.escape(raw).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def search_entries(session: Session, user_key: str, query: str, limit: int, offset: int) -> SearchResults:
+    match = build_match_query(query)
+    if match is None:
+        return SearchResults(results=[], next_offset=None)
+
+    statement = text(
+        f"""
+        SELECT entries.id AS id,
+               snippet({FTS_TABLE}, -1, :mark_start, :mark_end, '…', 12) AS snippet,
+               {RANK_EXPRESSION} AS rank
+        FROM {FTS_TABLE}
+        JOIN entries ON entries.rowid = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :match AND {FTS_TABLE}.user_key = :user_key
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+        """
+    )
+    hits = session.execute(
+        statement,
+        {
+            "match": match,
+            "user_key": user_key,
+            "mark_start": _MARK_START,
+            "mark_end": _MARK_END,
+            "limit": limit + 1,
+            "offset": offset,
+        },
+    ).all()
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    ids = [hit.id for hit in hits]
+    rows = {row.id: row for row in session.execute(select(EntryRecord).where(EntryRecord.id.in_(ids))).scalars()}
+    results = [
+        SearchHit(
+            entry=EntryOut.model_validate(rows[hit.id], from_attributes=True),
+            snippet=render_snippet(hit.snippet or ""),
+            rank=hit.rank,
+        )
+        for hit in hits
+        if hit.id in rows
+    ]
+    return SearchResults(results=results, next_offset=offset + limit if has_more else None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the entry full-text search index.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("reindex", help="Rebuild the search index from all entries.")
+    parser.parse_args()
+
+    from .db import SessionLocal, create_db_and_tables
+
+    create_db_and_tables()
+    with SessionLocal() as session:
+        indexed = reindex(session)
+        session.commit()
+    print(f"Indexed {indexed} entries.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import csv
+import io
+from typing import Any, AsyncIterator, Iterable, Sequence
+
+import orjson
+from sqlalchemy import JSON, Text, type_coerce
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncResult
+
+from .models import EntryRecord
+from .schemas import EntryOut
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; clients fall back to JSON
+    msgpack = None
+
+# Rows fetched per round trip while streaming; bounds the memory of a response.
+STREAM_PARTITION_SIZE = 500
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+# (response key, entries column) for every EntryOut field, keys by alias as FastAPI would emit them.
+ENTRY_FIELDS = [(field.alias or name, name) for name, field in EntryOut.model_fields.items()]
+ENTRY_KEYS = tuple(key for key, _name in ENTRY_FIELDS)
+LIST_KEYS = tuple(
+    key for key, name in ENTRY_FIELDS if isinstance(EntryRecord.__table__.c[name].type, JSON)
+)
+
+
+def entry_columns() -> list[Any]:
+    """Columns of an entry response as plain values, in ``ENTRY_KEYS`` order.
+
+    JSON list columns are read as their stored text and decoded by orjson,
+    skipping SQLAlchemy's per-value ``json.loads``.
+    """
+    columns = []
+    for key, name in ENTRY_FIELDS:
+        column = getattr(EntryRecord, name)
+        if key in LIST_KEYS:
+            column = type_coerce(column, Text)
+        columns.append(column.label(key))
+    return columns
+
+
+def entry_dict(row: Sequence[Any]) -> dict[str, Any]:
+    data = dict(zip(ENTRY_KEYS, row))
+    for key in LIST_KEYS:
+        value = data[key]
+        data[key] = orjson.loads(value) if value else []
+    return data
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def accepts_msgpack(accept: str) -> bool:
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def is_msgpack(content_type: str) -> bool:
+    return content_type.partition(";")[0].strip().lower() in MSGPACK_MEDIA_TYPES
+
+
+def packb(value: Any) -> bytes:
+    return msgpack.packb(value)
+
+
+def unpackb(body: bytes) -> Any:
+    """Decode a MessagePack document; raises ``ValueError`` when it is malformed."""
+    return msgpack.unpackb(body)
+
+
+def msgpack_map_head(fields: dict[str, Any], last_key: str) -> bytes:
+    """Start a MessagePack map holding ``fields`` and then ``last_key``, whose value the caller appends."""
+    packer = msgpack.Packer()
+    head = packer.pack_map_header(len(fields) + 1)
+    for key, value in fields.items():
+        head += packer.pack(key) + packer.pack(value)
+    return head + packer.pack(last_key)
+
+
+def encode_entries(rows: Iterable[Row]) -> bytes:
+    """Encode entry rows as the members of a JSON array, without the brackets."""
+    return b",".join(orjson.dumps(entry_dict(row)) for row in rows)
+
+
+def encode_ndjson(rows: Iterable[Row]) -> bytes:
+    return b"".join(orjson.dumps(entry_dict(row)) + b"\n" for row in rows)
+
+
+def encode_msgpack(rows: Iterable[Row]) -> bytes:
+    """Encode entry rows as consecutive MessagePack maps, the members of an array."""
+    packer = msgpack.Packer()
+    return b"".join(packer.pack(entry_dict(row)) for row in rows)
+
+
+def encode_csv(rows: Iterable[Row]) -> bytes:
+    """Encode entry rows as CSV lines; list columns hold their JSON text."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow("" if value is None else value for value in row)
+    return buffer.getvalue().encode()
+
+
+def csv_header() -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(ENTRY_KEYS)
+    return buffer.getvalue().encode()
+
+
+async def stream_json_array(result: AsyncResult, prefix: bytes = b"", suffix: bytes = b"") -> AsyncIterator[bytes]:
+    """Yield a JSON array of entries one partition of rows at a time."""
+    yield prefix + b"["
+    separator = b""
+    async for partition in result.partitions(STREAM_PARTITION_SIZE):
+        yield separator + encode_entries(partition)
+        separator = b","
+    yield b"]" + suffix
+
+
+async def stream_ndjson(result: AsyncResult) -> AsyncIterator[bytes]:
+    async for partition in result.partitions(STREAM_PARTITION_SIZE):
+        yield encode_ndjson(partition)
+
+
+async def stream_msgpack_array(result: AsyncResult, prefix: bytes = b"") -> AsyncIterator[bytes]:
+    """Yield a MessagePack array of entries one partition of rows at a time.
+
+    MessagePack puts the length before the members, so each row carries the
+    total row count as an extra last column (``count() OVER ()``).
+    """
+    header = msgpack.Packer().pack_array_header
+    started = False
+    async for partition in result.partitions(STREAM_PARTITION_SIZE):
+        chunk = encode_msgpack(partition)
+        if not started:
+            chunk = prefix + header(partition[0][-1]) + chunk
+            started = True
+        yield chunk
+    if not started:
+        yield prefix + header(0)
+
+
+async def stream_csv(result: AsyncResult) -> AsyncIterator[bytes]:
+    yield csv_header()
+    async for partition in result.partitions(STREAM_PARTITION_SIZE):
+        yield encode_csv(partition)
@@ -0,0 +1,202 @@
+import argparse
+import math
+from collections import defaultdict
+from typing import Any, Iterable, Mapping, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .models import EntryRecord, EntryStat
+from .schemas import RatioBucket, ScoreAverages, StatGroup, StatsOut, TagCount
+from .tags import tag_id
+
+SCORE_FIELDS = ("acidity", "sweetness", "body", "balance", "overall")
+GROUP_DIMENSIONS = ("origin", "process", "brew_method")
+TAG_DIMENSIONS = ("aroma", "flavor")
+MAX_RATIO_BUCKET = 30
+
+# Entry columns the aggregates are derived from.
+STAT_SOURCE_COLUMNS = (
+    "id",
+    "user_key",
+    *GROUP_DIMENSIONS,
+    "dose",
+    "yield_amount",
+    *TAG_DIMENSIONS,
+    *SCORE_FIELDS,
+)
+COUNTER_COLUMNS = ("entries", *(f"{name}_{part}" for name in SCORE_FIELDS for part in ("sum", "count")))
+
+Counters = dict[str, int]
+StatKey = tuple[str, str]
+
+
+def ratio_bucket(dose: Optional[float], yield_amount: Optional[float]) -> Optional[str]:
+    if not dose or not yield_amount or dose <= 0 or yield_amount <= 0:
+        return None
+    ratio = math.floor(yield_amount / dose)
+    if ratio >= MAX_RATIO_BUCKET:
+        return f"1:{MAX_RATIO_BUCKET}+"
+    return f"1:{ratio}"
+
+
+def _score_counters(row: Mapping[str, Any]) -> Counters:
+    counters: Counters = {"entries": 1}
+    for name in SCORE_FIELDS:
+        value = row.get(name)
+        if value is not None:
+            counters[f"{name}_sum"] = value
+            counters[f"{name}_count"] = 1
+    return counters
+
+
+def contributions(row: Mapping[str, Any]) -> Iterable[tuple[StatKey, Counters]]:
+    """Yield the summary rows one entry counts towards and what it adds to each."""
+    scored = _score_counters(row)
+    yield ("total", ""), scored
+    for dimension in GROUP_DIMENSIONS:
+        value = row.get(dimension)
+        if value:
+            yield (dimension, value), scored
+
+    bucket = ratio_bucket(row.get("dose"), row.get("yield_amount"))
+    if bucket:
+        yield ("brew_ratio", bucket), {"entries": 1}
+
+    for dimension in TAG_DIMENSIONS:
+        # Normalized like entry_tags, so stats and tag filters agree on what one tag is.
+        for tag in {tag_id(label) for label in row.get(dimension) or []} - {""}:
+            yield (dimension, tag), {"entries": 1}
+
+
+def accumulate(deltas: dict[StatKey, Counters], row: Mapping[str, Any], sign: int) -> None:
+    for key, counters in contributions(row):
+        target = deltas[key]
+        for name, value in counters.items():
+            target[name] = target.get(name, 0) + sign * value
+
+
+def apply_deltas(session: Session, user_key: str, deltas: dict[StatKey, Counters]) -> None:
+    rows = []
+    for (dimension, key), counters in deltas.items():
+        if not any(counters.values()):
+            continue
+        rows.append({"user_key": user_key, "dimension": dimension, "key": key, **dict.fromkeys(COUNTER_COLUMNS, 0), **counters})
+    if not rows:
+        return
+
+    statement = insert(EntryStat)
+    statement = statement.on_conflict_do_update(
+        index_elements=[EntryStat.user_key, EntryStat.dimension, EntryStat.key],
+        set_={name: getattr(EntryStat, name) + statement.excluded[name] for name in COUNTER_COLUMNS},
+    )
+    session.execute(statement, rows)
+    session.execute(delete(EntryStat).where(EntryStat.user_key == user_key, EntryStat.entries <= 0))
+
+
+def apply_entry_changes(
+    session: Session,
+    user_key: str,
+    old_rows: Iterable[Mapping[str, Any]],
+    new_rows: Iterable[Mapping[str, Any]],
+) -> None:
+    """Move the user's aggregates from the old versions of entries to the new ones.
+
+    Runs inside the write transaction, so the summary never disagrees with
+    the entries it was derived from.
+    """
+    deltas: dict[StatKey, Counters] = defaultdict(dict)
+    for row in old_rows:
+        accumulate(deltas, row, -1)
+    for row in new_rows:
+        accumulate(deltas, row, 1)
+    apply_deltas(session, user_key, deltas)
+
+
+def rebuild_stats(session: Session, user_key: Optional[str] = None) -> int:
+    """Recompute the aggregates from the entries table; returns the number of entries scanned."""
+    columns = [getattr(EntryRecord, name) for name in STAT_SOURCE_COLUMNS]
+    statement = select(*columns).order_by(EntryRecord.user_key)
+    clear = delete(EntryStat)
+    if user_key is not None:
+        statement = statement.where(EntryRecord.user_key == user_key)
+        clear = clear.where(EntryStat.user_key == user_key)
+    session.execute(clear)
+
+    scanned = 0
+    current_user: Optional[str] = None
+    deltas: dict[StatKey, Counters] = defaultdict(dict)
+    for row in session.execute(statement.execution_options(yield_per=1000)).mappings():
+        if row["user_key"] != current_user:
+            if current_user is not None:
+                apply_deltas(session, current_user, deltas)
+            current_user = row["user_key"]
+            deltas = defaultdict(dict)
+        accumulate(deltas, row, 1)
+        scanned += 1
+    if current_user is not None:
+        apply_deltas(session, current_user, deltas)
+    return scanned
+
+
+def _averages(stat: EntryStat) -> ScoreAverages:
+    values = {}
+    for name in SCORE_FIELDS:
+        count = getattr(stat, f"{name}_count")
+        values[name] = round(getattr(stat, f"{name}_sum") / count, 2) if count else None
+    return ScoreAverages(**values)
+
+
+def load_stats(session: Session, user_key: str, top_tags: int = 10) -> StatsOut:
+    stats = session.execute(select(EntryStat).where(EntryStat.user_key == user_key)).scalars().all()
+    by_dimension: dict[str, list[EntryStat]] = defaultdict(list)
+    for stat in stats:
+        by_dimension[stat.dimension].append(stat)
+
+    def groups(dimension: str) -> list[StatGroup]:
+        ordered = sorted(by_dimension[dimension], key=lambda stat: (-stat.entries, stat.key))
+        return [StatGroup(key=stat.key, entries=stat.entries, averages=_averages(stat)) for stat in ordered]
+
+    def tags(dimension: str) -> list[TagCount]:
+        ordered = sorted(by_dimension[dimension], key=lambda stat: (-stat.entries, stat.key))
+        return [TagCount(tag=stat.key, count=stat.entries) for stat in ordered[:top_tags]]
+
+    total = next(iter(by_dimension["total"]), None)
+    return StatsOut(
+        entries=total.entries if total else 0,
+        averages=_averages(total) if total else ScoreAverages(),
+        by_origin=groups("origin"),
+        by_process=groups("process"),
+        by_brew_method=groups("brew_method"),
+        brew_ratios=[
+            RatioBucket(ratio=stat.key, entries=stat.entries)
+            for stat in sorted(by_dimension["brew_ratio"], key=lambda stat: _ratio_sort_key(stat.key))
+        ],
+        top_aroma=tags("aroma"),
+        top_flavor=tags("flavor"),
+    )
+
+
+def _ratio_sort_key(bucket: str) -> int:
+    return int(bucket.removeprefix("1:").rstrip("+"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the per-user tasting statistics.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild = subcommands.add_parser("rebuild", help="Recompute the summary tables from all entries.")
+    rebuild.add_argument("--user", help="Only rebuild this user_key.")
+    args = parser.parse_args()
+
+    from .db import SessionLocal, create_db_and_tables
+
+    create_db_and_tables()
+    with SessionLocal() as session:
+        scanned = rebuild_stats(session, user_key=args.user)
+        session.commit()
+    print(f"Rebuilt statistics from {scanned} entries.")
+
+
+if __name__ == "__main__":
+    main()
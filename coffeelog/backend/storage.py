@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar
+
+from sqlalchemy import Engine, create_engine, insert, select, union
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from .db import AsyncSessionLocal, BASE_DIR, DB_PATH, configure_sqlite_engine, ensure_schema, instrument_engine, writer
+from .models import Base, UserRecord
+from .search import reindex
+from .writer import WriteQueue
+
+T = TypeVar("T")
+
+# "single" keeps every user in one database file; "sharded" gives each user their own.
+STORAGE_MODE = os.getenv("COFFEELOG_STORAGE", "single")
+SHARD_DIR = Path(os.getenv("COFFEELOG_SHARD_DIR") or BASE_DIR / "shards")
+MAX_OPEN_SHARDS = int(os.getenv("COFFEELOG_MAX_OPEN_SHARDS", "64"))
+SHARD_IDLE_SECONDS = float(os.getenv("COFFEELOG_SHARD_IDLE_SECONDS", "300"))
+SHARD_READER_POOL_SIZE = 2
+MIGRATION_BATCH_SIZE = 1000
+
+# Everything but the users table lives in the user's shard; users stay in the central database.
+SHARD_TABLES = [table for table in Base.metadata.sorted_tables if table.name != UserRecord.__tablename__]
+# The shard tables that hold per-user rows, as opposed to bookkeeping like the schema version.
+USER_TABLES = [table for table in SHARD_TABLES if "user_key" in table.c]
+
+
+def shard_path(directory: Path, user_key: str) -> Path:
+    """File of a user's shard; hashed so any user_key is a safe file name."""
+    digest = hashlib.sha256(user_key.encode()).hexdigest()
+    return directory / digest[:2] / f"{digest}.db"
+
+
+def create_shard_schema(target: Engine) -> None:
+    ensure_schema(target, SHARD_TABLES)
+
+
+class Shard:
+    """One user's database file with its own writer thread and reader pool."""
+
+    def __init__(self, user_key: str, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.user_key = user_key
+        self.path = path
+        self.writer_engine = instrument_engine(
+            configure_sqlite_engine(
+                create_engine(
+                    f"sqlite:///{path}",
+                    connect_args={"check_same_thread": False},
+                    pool_size=1,
+                    max_overflow=0,
+                ),
+                writer=True,
+            ),
+            "shard_writer",
+        )
+        create_shard_schema(self.writer_engine)
+        self.writer = WriteQueue(
+            sessionmaker(bind=self.writer_engine, autoflush=False, expire_on_commit=False, class_=Session),
+            name=f"coffeelog-writer-{path.stem[:12]}",
+        )
+        self.reader_engine = create_async_engine(
+            f"sqlite+aiosqlite:///{path}",
+            pool_size=SHARD_READER_POOL_SIZE,
+            max_overflow=SHARD_READER_POOL_SIZE,
+        )
+        instrument_engine(configure_sqlite_engine(self.reader_engine.sync_engine, read_only=True), "shard_reader")
+        self.sessions = async_sessionmaker(
+            bind=self.reader_engine,
+            autoflush=False,
+            expire_on_commit=False,
+            class_=AsyncSession,
+        )
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.writer.stop)
+        self.writer_engine.dispose()
+        await self.reader_engine.dispose()
+
+
+@dataclass
+class StorageStats:
+    mode: str
+    open_shards: int = 0
+    opened: int = 0
+    evicted: int = 0
+
+
+class SingleStorage:
+    """Every user in the central database, written by the shared writer."""
+
+    mode = "single"
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @asynccontextmanager
+    async def session(self, user_key: str) -> AsyncIterator[AsyncSession]:
+        async with AsyncSessionLocal() as session:
+            yield session
+
+    async def write(self, user_key: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(session, user_key, *args)`` on the writer of the user's database."""
+        return await writer.run(fn, user_key, *args, **kwargs)
+
+    def stats(self) -> StorageStats:
+        return StorageStats(mode=self.mode)
+
+
+class ShardPool:
+    """Per-user SQLite files, so users never wait on each other's write lock.
+
+    Open shards are kept in an LRU of at most ``max_open``. A shard is closed
+    when it falls off the LRU or has been idle for ``idle_seconds``, but never
+    while a request still holds it; a busy pool may briefly exceed the limit.
+    """
+
+    mode = "sharded"
+
+    def __init__(
+        self,
+        directory: Path,
+        max_open: int = MAX_OPEN_SHARDS,
+        idle_seconds: float = SHARD_IDLE_SECONDS,
+    ):
+        self.directory = directory
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._shards: OrderedDict[str, Shard] = OrderedDict()
+        self._open_lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+        self._opened = 0
+        self._evicted = 0
+
+    def start(self) -> None:
+        if self._reaper is None:
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_idle())
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        shards = list(self._shards.values())
+        self._shards.clear()
+        for shard in shards:
+            await shard.close()
+
+    @asynccontextmanager
+    async def session(self, user_key: str) -> AsyncIterator[AsyncSession]:
+        shard = await self._acquire(user_key)
+        try:
+            async with shard.sessions() as session:
+                yield session
+        finally:
+            self._release(shard)
+
+    async def write(self, user_key: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(session, user_key, *args)`` on the writer of the user's shard."""
+        shard = await self._acquire(user_key)
+        try:
+            return await shard.writer.run(fn, user_key, *args, **kwargs)
+        finally:
+            self._release(shard)
+
+    def stats(self) -> StorageStats:
+        return StorageStats(mode=self.mode, open_shards=len(self._shards), opened=self._opened, evicted=self._evicted)
+
+    async def _acquire(self, user_key: str) -> Shard:
+        shard = self._shards.get(user_key)
+        if shard is None:
+            async with self._open_lock:
+                shard = self._shards.get(user_key)
+                if shard is None:
+                    # Creating the schema of a new shard touches the disk; keep it off the event loop.
+                    shard = await asyncio.to_thread(Shard, user_key, shard_path(self.directory, user_key))
+                    self._shards[user_key] = shard
+                    self._opened += 1
+        shard.active += 1
+        shard.last_used = time.monotonic()
+        self._shards.move_to_end(user_key)
+        try:
+            await self._evict(lambda _shard: len(self._shards) > self.max_open)
+        except BaseException:
+            # The caller only releases a shard it got back.
+            self._release(shard)
+            raise
+        return shard
+
+    def _release(self, shard: Shard) -> None:
+        shard.active -= 1
+        shard.last_used = time.monotonic()
+
+    async def _evict(self, should_evict: Callable[[Shard], bool]) -> None:
+        # Oldest first; a shard is removed from the pool before it is closed,
+        # so no new request can pick it up meanwhile. Evictions run concurrently
+        # while shards close, so skip one another eviction has already removed,
+        # or reopened under the same key since the list was taken.
+        for user_key, shard in list(self._shards.items()):
+            if self._shards.get(user_key) is not shard or shard.active or not should_evict(shard):
+                continue
+            del self._shards[user_key]
+            self._evicted += 1
+            await shard.close()
+
+    async def _reap_idle(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 4, 1.0))
+            cutoff = time.monotonic() - self.idle_seconds
+            await self._evict(lambda shard: shard.last_used < cutoff)
+
+
+def create_storage() -> "SingleStorage | ShardPool":
+    if STORAGE_MODE == "sharded":
+        return ShardPool(SHARD_DIR)
+    if STORAGE_MODE != "single":
+        raise ValueError(f"Unknown COFFEELOG_STORAGE mode: {STORAGE_MODE}")
+    return SingleStorage()
+
+
+storage = create_storage()
+
+
+def migrate_to_shards(source: Engine, directory: Path) -> dict[str, int]:
+    """Copy every user's rows from the central database into their own shard.
+
+    Each shard is written to a temporary file and renamed into place when
+    complete, so an interrupted run can simply be repeated. Users that
+    already have a shard are skipped. The central database is left as it was.
+    Returns the number of entries copied per user.
+    """
+    with source.connect() as connection:
+        user_keys = connection.execute(union(*(select(table.c.user_key) for table in USER_TABLES))).scalars().all()
+
+    copied: dict[str, int] = {}
+    for user_key in sorted(user_keys):
+        path = shard_path(directory, user_key)
+        if path.exists():
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(".partial")
+        partial.unlink(missing_ok=True)
+
+        target = create_engine(f"sqlite:///{partial}")
+        try:
+            create_shard_schema(target)
+            with source.connect() as reader, Session(target) as session:
+                for table in USER_TABLES:
+                    result = reader.execute(
+                        select(table).where(table.c.user_key == user_key).execution_options(yield_per=MIGRATION_BATCH_SIZE)
+                    )
+                    for rows in result.mappings().partitions():
+                        session.execute(insert(table), [dict(row) for row in rows])
+                # Search rows are keyed by rowids, which differ in the new file.
+                copied[user_key] = reindex(session)
+                session.commit()
+        finally:
+            target.dispose()
+        os.replace(partial, path)
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage per-user database shards.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="Split the central database into one shard per user.")
+    migrate.add_argument("--source", type=Path, default=DB_PATH, help="Central database to split.")
+    migrate.add_argument("--shard-dir", type=Path, default=SHARD_DIR, help="Directory of the shard files.")
+    args = parser.parse_args()
+
+    from .db import create_db_and_tables
+
+    if args.source == DB_PATH:
+        create_db_and_tables()
+    source = create_engine(f"sqlite:///{args.source}")
+    try:
+        copied = migrate_to_shards(source, args.shard_dir)
+    finally:
+        source.dispose()
+    print(f"Created {len(copied)} shards with {sum(copied.values())} entries in {args.shard_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import hashlib
+from typing import Any, Optional
+
+from sqlalchemy import Select, delete, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .models import EntryRecord, EntryTombstone, SyncState
+
+
+def current_revision(session: Session, user_key: str) -> int:
+    revision = session.execute(select(SyncState.revision).where(SyncState.user_key == user_key)).scalar_one_or_none()
+    return revision or 0
+
+
+def collection_etag(user_key: str, revision: int, variant: str = "") -> str:
+    """Strong ETag for a view of the user's entries at ``revision``.
+
+    The revision changes on every upsert and delete. The digest covers the
+    user and the query (``variant``), so the same revision number of another
+    user or of a filtered view never validates a cached response.
+    """
+    digest = hashlib.sha256(f"{user_key}\n{variant}".encode()).hexdigest()[:16]
+    return f'"{revision}-{digest}"'
+
+
+def entry_etag(revision: int) -> str:
+    return f'"entry-{revision}"'
+
+
+def parse_etags(header: Optional[str], weak: bool = False) -> Optional[frozenset[str]]:
+    """Parse an If-Match / If-None-Match header; ``None`` when it is absent.
+
+    If-Match uses the strong comparison, so weak tags are dropped unless
+    ``weak`` is set (If-None-Match compares weakly).
+    """
+    if header is None:
+        return None
+    tags = set()
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate:
+            tags.add(candidate)
+    return frozenset(tags)
+
+
+def next_revision(session: Session, user_key: str) -> int:
+    """Allocate the next revision for a user inside the caller's transaction.
+
+    SQLite serializes writers, so revisions are handed out in commit order and
+    a reader that has seen revision N has seen every change up to N.
+    """
+    statement = (
+        insert(SyncState)
+        .values(user_key=user_key, revision=1)
+        .on_conflict_do_update(
+            index_elements=[SyncState.user_key],
+            set_={"revision": SyncState.revision + 1},
+        )
+        .returning(SyncState.revision)
+    )
+    return session.execute(statement).scalar_one()
+
+
+def write_tombstones(session: Session, user_key: str, entry_ids: list[str], revision: int) -> None:
+    if not entry_ids:
+        return
+    statement = insert(EntryTombstone).on_conflict_do_update(
+        index_elements=[EntryTombstone.id],
+        set_={"user_key": user_key, "revision": revision},
+    )
+    session.execute(statement, [{"id": entry_id, "user_key": user_key, "revision": revision} for entry_id in entry_ids])
+
+
+def clear_tombstones(session: Session, user_key: str, entry_ids: list[str]) -> None:
+    if not entry_ids:
+        return
+    session.execute(
+        delete(EntryTombstone).where(
+            EntryTombstone.user_key == user_key,
+            EntryTombstone.id.in_(entry_ids),
+        )
+    )
+
+
+def changes_statement(user_key: str, since: int, columns: list[Any]) -> Select:
+    """Select entries changed after ``since`` (every entry when ``since`` is 0)."""
+    statement = select(*columns).where(EntryRecord.user_key == user_key)
+    if since > 0:
+        statement = statement.where(EntryRecord.revision > since)
+    return statement
+
+
+def changes_after(session: Session, user_key: str, since: int, limit: int) -> Optional[list[tuple[int, str, str]]]:
+    """(revision, op, entry id) of every change after ``since``, oldest first.
+
+    Only the latest change of an entry is still known, which is all a client
+    resuming from ``since`` needs. Returns ``None`` when there are more than ``limit``.
+    """
+    upserts = select(EntryRecord.revision, literal("upsert").label("op"), EntryRecord.id).where(
+        EntryRecord.user_key == user_key, EntryRecord.revision > since
+    )
+    deletes = select(EntryTombstone.revision, literal("delete").label("op"), EntryTombstone.id).where(
+        EntryTombstone.user_key == user_key, EntryTombstone.revision > since
+    )
+    statement = union_all(upserts, deletes).order_by("revision").limit(limit + 1)
+    rows = [tuple(row) for row in session.execute(statement)]
+    return None if len(rows) > limit else rows
+
+
+def deleted_since(session: Session, user_key: str, since: int) -> list[str]:
+    if since <= 0:
+        return []
+    statement = select(EntryTombstone.id).where(
+        EntryTombstone.user_key == user_key,
+        EntryTombstone.revision > since,
+    )
+    return list(session.execute(statement).scalars().all())
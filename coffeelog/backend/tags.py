@@ -0,0 +1,129 @@
+import argparse
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, Mapping
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .models import EntryRecord, EntryTag
+from .schemas import TagCount
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / "frontend" / "static" / "data"
+
+TAG_CATEGORIES = ("aroma", "flavor", "aftertaste", "defects")
+WHEEL_FILES = ("wheel.realdata.v1.en.json", "wheel.realdata.v1.ru.json", "wheel.realdata.v1.json")
+TASTE_TAG_FILES = ("taste_tags.en.json", "taste_tags.ru.json", "taste_tags.json")
+
+
+def slugify(label: str) -> str:
+    return re.sub(r"[^\w]+", "-", label.strip().lower()).strip("-_")
+
+
+def _walk_wheel(nodes: list[dict[str, Any]], labels: dict[str, str]) -> None:
+    for node in nodes:
+        labels.setdefault(node["label"].strip().lower(), node["id"])
+        _walk_wheel(node.get("children") or [], labels)
+
+
+@lru_cache(maxsize=1)
+def label_index() -> dict[str, str]:
+    """Map every known label, in every shipped language, to its tag id.
+
+    Wheel labels map to the wheel node id; taste tag labels that are not on
+    the wheel map to their slug, which is the same id scheme the wheel uses.
+    """
+    labels: dict[str, str] = {}
+    for name in WHEEL_FILES:
+        path = DATA_DIR / name
+        if path.exists():
+            _walk_wheel(json.loads(path.read_text(encoding="utf-8")).get("tree", []), labels)
+    for name in TASTE_TAG_FILES:
+        path = DATA_DIR / name
+        if not path.exists():
+            continue
+        for values in json.loads(path.read_text(encoding="utf-8")).values():
+            for label in values:
+                labels.setdefault(label.strip().lower(), slugify(label))
+    return labels
+
+
+def tag_id(label: str) -> str:
+    normalized = label.strip().lower()
+    return label_index().get(normalized) or slugify(normalized)
+
+
+def tag_rows(row: Mapping[str, Any]) -> list[dict[str, str]]:
+    rows: dict[tuple[str, str], dict[str, str]] = {}
+    for category in TAG_CATEGORIES:
+        for label in row.get(category) or []:
+            tag = tag_id(label)
+            if tag:
+                rows[(category, tag)] = {
+                    "entry_id": row["id"],
+                    "user_key": row["user_key"],
+                    "category": category,
+                    "tag": tag,
+                }
+    return list(rows.values())
+
+
+def replace_entry_tags(session: Session, entry_ids: list[str], rows: Iterable[Mapping[str, Any]]) -> None:
+    """Make the tag rows of ``entry_ids`` match the given entry rows."""
+    session.execute(delete(EntryTag).where(EntryTag.entry_id.in_(entry_ids)))
+    new_rows = [tag for row in rows for tag in tag_rows(row)]
+    if new_rows:
+        session.execute(EntryTag.__table__.insert(), new_rows)
+
+
+def remove_entry_tags(session: Session, entry_ids: list[str]) -> None:
+    session.execute(delete(EntryTag).where(EntryTag.entry_id.in_(entry_ids)))
+
+
+def rebuild_tags(session: Session) -> int:
+    session.execute(delete(EntryTag))
+    columns = [EntryRecord.id, EntryRecord.user_key, *(getattr(EntryRecord, name) for name in TAG_CATEGORIES)]
+    inserted = 0
+    batch: list[dict[str, str]] = []
+    for row in session.execute(select(*columns).execution_options(yield_per=1000)).mappings():
+        batch.extend(tag_rows(row))
+        if len(batch) >= 5000:
+            session.execute(EntryTag.__table__.insert(), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        session.execute(EntryTag.__table__.insert(), batch)
+        inserted += len(batch)
+    return inserted
+
+
+def tag_counts(session: Session, user_key: str, category: str) -> list[TagCount]:
+    statement = (
+        select(EntryTag.tag, func.count())
+        .where(EntryTag.user_key == user_key, EntryTag.category == category)
+        .group_by(EntryTag.tag)
+        .order_by(func.count().desc(), EntryTag.tag)
+    )
+    return [TagCount(tag=tag, count=count) for tag, count in session.execute(statement).all()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the normalized entry tag table.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="Rebuild entry_tags from the tag lists of all entries.")
+    parser.parse_args()
+
+    from .db import SessionLocal, create_db_and_tables
+
+    create_db_and_tables()
+    with SessionLocal() as session:
+        inserted = rebuild_tags(session)
+        session.commit()
+    print(f"Stored {inserted} entry tags.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import csv
+import io
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, BinaryIO, Iterator, Optional
+
+import orjson
+from pydantic import ValidationError
+
+from .schemas import EntryIn
+from .serialization import LIST_KEYS
+
+MAX_IMPORT_BYTES = 512 * 1024 * 1024
+IMPORT_BATCH_SIZE = 500
+# Spooled uploads stay in memory up to this size, then move to a temporary file.
+SPOOL_MEMORY_BYTES = 4 * 1024 * 1024
+MAX_REPORTED_ERRORS = 100
+
+IMPORT_FORMATS = ("jsonl", "csv")
+
+# Namespace for ids derived when an import is remapped into another account.
+IMPORT_NAMESPACE = uuid.UUID("6f1b7a52-3f0e-4f55-9d55-1f6b3c8e2a41")
+
+
+class ImportTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class ImportBatch:
+    entries: list[EntryIn]
+    # (line or record number, message) for rows that failed validation.
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    records: int = 0
+
+
+async def spool_upload(chunks: AsyncIterator[bytes], limit: int = MAX_IMPORT_BYTES) -> BinaryIO:
+    """Copy a request body to a spooled temporary file, enforcing ``limit``."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > limit:
+                raise ImportTooLargeError(f"Import exceeds {limit} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _jsonl_records(source: BinaryIO) -> Iterator[tuple[int, Any]]:
+    for number, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, orjson.loads(line)
+        except orjson.JSONDecodeError as exc:
+            yield number, exc
+
+
+def _csv_records(source: BinaryIO) -> Iterator[tuple[int, Any]]:
+    text = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    for row in reader:
+        record: dict[str, Any] = {}
+        try:
+            for key, value in row.items():
+                if key is None or value is None or value == "":
+                    continue
+                record[key] = orjson.loads(value) if key in LIST_KEYS else value
+        except orjson.JSONDecodeError as exc:
+            yield reader.line_num, exc
+            continue
+        yield reader.line_num, record
+
+
+def iter_import_batches(
+    source: BinaryIO,
+    fmt: str,
+    user_key: str,
+    remap_ids: bool = False,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> Iterator[ImportBatch]:
+    """Parse an export incrementally and validate it against ``EntryIn`` in batches.
+
+    Only one batch is held in memory. Invalid records are reported in the
+    batch and skipped. With ``remap_ids`` every id is replaced by one derived
+    from the importing user, so a journal can move to another account
+    without colliding with its original owner; importing twice stays idempotent.
+    """
+    records = _csv_records(source) if fmt == "csv" else _jsonl_records(source)
+    batch = ImportBatch(entries=[])
+    for number, record in records:
+        batch.records += 1
+        if isinstance(record, Exception):
+            batch.errors.append((number, f"Malformed record: {record}"))
+        elif not isinstance(record, dict):
+            batch.errors.append((number, "Expected an object"))
+        else:
+            try:
+                entry = EntryIn.model_validate(record)
+            except ValidationError as exc:
+                batch.errors.append((number, _describe(exc)))
+            else:
+                if remap_ids:
+                    entry.id = str(uuid.uuid5(IMPORT_NAMESPACE, f"{user_key}:{entry.id}"))
+                batch.entries.append(entry)
+        if len(batch.entries) >= batch_size:
+            yield batch
+            batch = ImportBatch(entries=[])
+    if batch.records:
+        yield batch
+
+
+def _describe(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'record'}: {error['msg']}" for error in exc.errors()
+    )
+
+
+@dataclass
+class ImportProgress:
+    records: int = 0
+    imported: int = 0
+    failed: int = 0
+    batches: int = 0
+    errors: list[dict[str, Any]] = field(default_factory=list)
+
+    def add_error(self, line: Optional[int], message: str, entry_id: Optional[str] = None) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "id": entry_id, "error": message})
+
+    def event(self, done: bool = False) -> bytes:
+        payload: dict[str, Any] = {
+            "records": self.records,
+            "imported": self.imported,
+            "failed": self.failed,
+            "batches": self.batches,
+            "done": done,
+        }
+        if done:
+            payload["errors"] = self.errors
+        return orjson.dumps(payload) + b"\n"
@@ -0,0 +1,31 @@
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import UserRecord
+
+
+def upsert_user(
+    session: Session,
+    google_sub: str,
+    email: str,
+    name: Optional[str],
+    avatar_url: Optional[str],
+) -> UserRecord:
+    user = session.execute(select(UserRecord).where(UserRecord.google_sub == google_sub)).scalar_one_or_none()
+    if user:
+        user.email = email
+        user.name = name
+        user.avatar_url = avatar_url
+    else:
+        user = UserRecord(
+            google_sub=google_sub,
+            email=email,
+            name=name,
+            avatar_url=avatar_url,
+        )
+        session.add(user)
+
+    session.flush()
+    return user
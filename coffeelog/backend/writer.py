@@ -0,0 +1,150 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, TypeVar
+
+from sqlalchemy.orm import Session, sessionmaker
+
+T = TypeVar("T")
+
+logger = logging.getLogger("coffeelog.writer")
+
+_STOP = object()
+
+
+@dataclass
+class _WriteJob:
+    context: contextvars.Context
+    fn: Callable[..., Any]
+    args: tuple[Any, ...]
+    kwargs: dict[str, Any]
+    future: concurrent.futures.Future
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int
+    batches: int
+    writes: int
+    failed_writes: int
+    last_batch_size: int
+    max_batch_size: int
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.writes / self.batches if self.batches else 0.0
+
+
+class WriteQueue:
+    """Runs all database writes on one thread and commits them in groups.
+
+    Callers submit a sync function that receives a ``Session``. The writer
+    drains whatever is queued (up to ``max_batch``), runs each job inside its
+    own SAVEPOINT so one failing job does not undo the others, and commits
+    the whole group once. Concurrent requests therefore share a single fsync
+    instead of queueing on SQLite's write lock.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_batch: int = 64, name: str = "coffeelog-writer"):
+        self._session_factory = session_factory
+        self._max_batch = max_batch
+        self._name = name
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._failed_writes = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "concurrent.futures.Future[T]":
+        self.start()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put(_WriteJob(contextvars.copy_context(), fn, args, kwargs, future))
+        return future
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> WriterStats:
+        return WriterStats(
+            queue_depth=self._queue.qsize(),
+            batches=self._batches,
+            writes=self._writes,
+            failed_writes=self._failed_writes,
+            last_batch_size=self._last_batch_size,
+            max_batch_size=self._max_batch_size,
+        )
+
+    def _next_batch(self) -> Optional[list[_WriteJob]]:
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        while len(batch) < self._max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                # Finish this batch, then stop on the next iteration.
+                self._queue.put(_STOP)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: list[_WriteJob]) -> None:
+        outcomes: list[tuple[_WriteJob, Any, Optional[BaseException]]] = []
+        session: Session = self._session_factory()
+        try:
+            for job in batch:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        result = job.context.run(job.fn, session, *job.args, **job.kwargs)
+                    outcomes.append((job, result, None))
+                except Exception as exc:
+                    outcomes.append((job, None, exc))
+            session.commit()
+        except Exception as exc:
+            logger.exception("Group commit of %s writes failed", len(batch))
+            session.rollback()
+            outcomes = [(job, None, exc) for job, _result, _error in outcomes]
+        finally:
+            session.close()
+
+        self._batches += 1
+        self._writes += len(outcomes)
+        self._last_batch_size = len(outcomes)
+        self._max_batch_size = max(self._max_batch_size, len(outcomes))
+        for job, result, error in outcomes:
+            if error is not None:
+                self._failed_writes += 1
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
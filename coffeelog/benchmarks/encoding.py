@@ -0,0 +1,131 @@
+"""Compare sync payload encodings by bytes on the wire and CPU time.
+
+Each format encodes and decodes the same list of entries, as a push to
+``POST /api/entries`` or a pull from ``GET /api/entries`` would carry them:
+
+- ``json``: orjson, as the API sends it by default.
+- ``msgpack``: MessagePack (needs the optional ``msgpack`` package).
+
+and each is measured as sent (``identity``) and gzip- or zstd-compressed
+(zstd needs the optional ``zstandard`` package). Encode covers serializing
+and compressing; decode covers decompressing and parsing, but not pydantic
+validation, which costs the same for every format.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.encoding --entries 100 1000 10000 --repeat 5
+"""
+
+import argparse
+import gc
+import gzip
+import random
+import statistics
+import time
+import uuid
+from typing import Any, Callable
+
+import orjson
+
+from backend.serialization import msgpack
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Codec = tuple[Callable[[Any], bytes], Callable[[bytes], Any]]
+
+FORMATS: dict[str, Codec] = {"json": (orjson.dumps, orjson.loads)}
+if msgpack is not None:
+    FORMATS["msgpack"] = (msgpack.packb, msgpack.unpackb)
+
+ENCODINGS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "identity": (lambda data: data, lambda data: data),
+    # Level 6 matches the response compression; browsers' CompressionStream uses the default too.
+    "gzip": (lambda data: gzip.compress(data, compresslevel=6), gzip.decompress),
+}
+if zstandard is not None:
+    ENCODINGS["zstd"] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+
+
+TAGS = ["jasmine", "bergamot", "peach", "black tea", "honey", "cocoa", "hazelnut", "lemon", "blueberry", "caramel"]
+WORDS = "clean sweet juicy bright round long finish cup acidity body syrupy floral muted dense light cooling".split()
+
+
+def make_entries(count: int, seed: int = 1) -> list[dict[str, Any]]:
+    # Varied enough that compression ratios are not flattered by identical rows.
+    rng = random.Random(seed)
+    return [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "created_at": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T08:{rng.randint(0, 59):02d}:00.000Z",
+            "brew_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T08:{rng.randint(0, 59):02d}",
+            "coffee_name": f"{rng.choice(['Guji', 'Huila', 'Nyeri', 'Cerrado'])} lot {rng.randint(1, 999)}",
+            "roastery": rng.choice(["Bench Roasters", "Northside", "Little Owl"]),
+            "origin": rng.choice(["Ethiopia", "Colombia", "Kenya", "Brazil"]),
+            "process": rng.choice(["washed", "natural", "honey", None]),
+            "brew_method": rng.choice(["V60", "Espresso", "AeroPress"]),
+            "grind_size": None,
+            "water_temp": float(rng.randint(88, 96)),
+            "dose": round(rng.uniform(14, 20), 1),
+            "yield": round(rng.uniform(30, 300), 1),
+            "brew_time": f"{rng.randint(0, 4)}:{rng.randint(0, 59):02d}",
+            "aroma": rng.sample(TAGS, rng.randint(0, 3)),
+            "flavor": rng.sample(TAGS, rng.randint(1, 4)),
+            "aftertaste": rng.sample(TAGS, rng.randint(0, 2)),
+            "defects": [],
+            "photo_hashes": [f"{rng.getrandbits(256):064x}"] if rng.random() < 0.3 else [],
+            "acidity": rng.randint(1, 5),
+            "sweetness": rng.randint(1, 5),
+            "bitterness": rng.randint(1, 5),
+            "body": rng.randint(1, 5),
+            "balance": rng.randint(1, 5),
+            "overall": rng.randint(1, 10),
+            "notes": " ".join(rng.choices(WORDS, k=rng.randint(0, 20))).capitalize(),
+            "revision": index + 1,
+        }
+        for index in range(count)
+    ]
+
+
+def cpu_ms(fn: Callable[[], Any], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.process_time()
+        fn()
+        samples.append(time.process_time() - started)
+    return statistics.median(samples) * 1000
+
+
+def run(counts: list[int], repeat: int) -> None:
+    print(f"{'entries':>8} {'format':>8} {'encoding':>9} {'KiB':>9} {'vs json':>8} {'encode ms':>10} {'decode ms':>10}")
+    for count in counts:
+        entries = make_entries(count)
+        json_size = len(orjson.dumps(entries))
+        for name, (dump, load) in FORMATS.items():
+            for encoding, (compress, decompress) in ENCODINGS.items():
+                body = compress(dump(entries))
+                assert load(decompress(body)) == entries
+                encode = cpu_ms(lambda: compress(dump(entries)), repeat)
+                decode = cpu_ms(lambda: load(decompress(body)), repeat)
+                print(
+                    f"{count:>8} {name:>8} {encoding:>9} {len(body) / 1024:>9.1f} "
+                    f"{len(body) / json_size:>7.0%} {encode:>10.2f} {decode:>10.2f}"
+                )
+    missing = [package for package, module in (("msgpack", msgpack), ("zstandard", zstandard)) if module is None]
+    if missing:
+        print(f"Not installed, skipped: {', '.join(missing)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, nargs="+", default=[100, 1000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.entries, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""Load-test the sync API with concurrent clients against a seeded database.
+
+Seeds a throwaway SQLite database with synthetic users whose entries use the
+tag lists of ``frontend/static/data/taste_tags.json``, then drives the app
+in-process through ``/auth/dev-login`` with concurrent clients running a
+push / pull / delete / view mix. Reports p50/p95/p99 latency, throughput and
+database queries per operation for each size.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.loadtest --entries 1000 10000 100000
+    python -m benchmarks.loadtest --check              # exit 1 on regression
+    python -m benchmarks.loadtest --update-baseline    # store current results
+
+Baselines live in ``benchmarks/baselines/loadtest.json`` and are keyed by
+entries per user. Latency and throughput are compared with ``--tolerance``;
+query counts are compared more tightly since they do not depend on the machine.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+TASTE_TAGS_PATH = BASE_DIR / "frontend" / "static" / "data" / "taste_tags.json"
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "loadtest.json"
+
+# The user /auth/dev-login signs in as; every client shares it.
+DEV_USER_KEY = "dev-debug-user"
+
+OPERATIONS = ("pull", "push", "delete", "view")
+DEFAULT_MIX = {"pull": 40, "push": 20, "delete": 10, "view": 30}
+QUERY_TOLERANCE = 0.1
+
+ORIGINS = ["Ethiopia", "Kenya", "Colombia", "Brazil", "Guatemala", "Panama", "Rwanda", "Peru", "Indonesia", "Yemen"]
+PROCESSES = ["Washed", "Natural", "Honey", "Anaerobic"]
+BREW_METHODS = ["espresso", "v60", "aeropress", "chemex", "french-press", "cupping"]
+ROASTERIES = ["Tim Wendelboe", "La Cabra", "Onyx", "Square Mile", "April", "Friedhats", "Coffee Collective"]
+
+# Set per request so engine events can attribute queries to the operation.
+_query_counter: contextvars.ContextVar[Optional[list[int]]] = contextvars.ContextVar("query_counter", default=None)
+
+
+@dataclass
+class OperationResult:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    queries: int = 0
+
+
+def load_taste_tags() -> dict[str, list[str]]:
+    return json.loads(TASTE_TAGS_PATH.read_text(encoding="utf-8"))
+
+
+def make_entry(
+    rng: random.Random,
+    taste_tags: dict[str, list[str]],
+    index: int,
+    entry_id: Optional[str] = None,
+) -> dict[str, Any]:
+    dose = round(rng.uniform(14, 20), 1)
+    return {
+        "id": entry_id or str(uuid.UUID(int=rng.getrandbits(128))),
+        "created_at": f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T08:00:00",
+        "brew_date": f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T{index % 24:02d}:{index % 60:02d}",
+        "coffee_name": f"{rng.choice(ORIGINS)} lot {index}",
+        "roastery": rng.choice(ROASTERIES),
+        "origin": rng.choice(ORIGINS),
+        "process": rng.choice(PROCESSES),
+        "brew_method": rng.choice(BREW_METHODS),
+        "water_temp": float(rng.randint(88, 96)),
+        "dose": dose,
+        "yield": round(dose * rng.uniform(2, 17), 1),
+        "aroma": rng.sample(taste_tags["aroma"], rng.randint(0, 3)),
+        "flavor": rng.sample(taste_tags["flavor"], rng.randint(1, 4)),
+        "aftertaste": rng.sample(taste_tags["aftertaste"], rng.randint(0, 2)),
+        "defects": rng.sample(taste_tags["defects"], rng.choice([0, 0, 0, 1])),
+        "acidity": rng.randint(1, 5),
+        "sweetness": rng.randint(1, 5),
+        "bitterness": rng.randint(1, 5),
+        "body": rng.randint(1, 5),
+        "balance": rng.randint(1, 5),
+        "overall": rng.randint(1, 10),
+        "notes": "Synthetic load-test entry with a clean, sweet finish.",
+    }
+
+
+def seed_database(entries_per_user: int, users: int, seed: int) -> list[str]:
+    """Replace all entries with synthetic ones; returns the ids of the dev user's entries."""
+    from sqlalchemy import delete, insert
+
+    from backend.db import SessionLocal
+    from backend.models import EntryRecord, EntryStat, EntryTag, EntryTombstone, SyncState
+    from backend.search import reindex
+    from backend.stats import rebuild_stats
+    from backend.tags import rebuild_tags
+
+    rng = random.Random(seed)
+    taste_tags = load_taste_tags()
+    user_keys = [DEV_USER_KEY] + [f"synthetic-user-{index}" for index in range(1, users)]
+    dev_ids: list[str] = []
+
+    with SessionLocal() as session:
+        for model in (EntryRecord, EntryTag, EntryStat, EntryTombstone, SyncState):
+            session.execute(delete(model))
+        for user_key in user_keys:
+            batch = []
+            for index in range(entries_per_user):
+                entry = make_entry(rng, taste_tags, index)
+                entry["yield_amount"] = entry.pop("yield")
+                entry.update(user_key=user_key, revision=index + 1, photo_hashes=[])
+                batch.append(entry)
+                if user_key == DEV_USER_KEY:
+                    dev_ids.append(entry["id"])
+                if len(batch) >= 5000:
+                    session.execute(insert(EntryRecord), batch)
+                    batch = []
+            if batch:
+                session.execute(insert(EntryRecord), batch)
+            session.execute(insert(SyncState).values(user_key=user_key, revision=entries_per_user))
+        rebuild_stats(session)
+        rebuild_tags(session)
+        reindex(session)
+        session.commit()
+    return dev_ids
+
+
+def install_query_counter() -> None:
+    from sqlalchemy import event
+
+    from backend.db import async_engine, engine, writer_engine
+
+    def count(*_args) -> None:
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    for target in (engine, writer_engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", count)
+
+
+class Workload:
+    def __init__(self, entry_ids: list[str], revision: int, mix: dict[str, int], push_batch: int, seed: int):
+        self.entry_ids = entry_ids
+        self.revision = revision
+        self.mix = mix
+        self.push_batch = push_batch
+        self.seed = seed
+        self.taste_tags = load_taste_tags()
+        self.results = {name: OperationResult() for name in OPERATIONS}
+        self.remaining = 0
+        self.created = 0
+
+    async def client(self, app: Any, index: int) -> None:
+        import httpx
+
+        rng = random.Random(self.seed * 1000 + index)
+        cursor = self.revision
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            response = await client.get("/auth/dev-login", follow_redirects=False)
+            if response.status_code != 302:
+                raise RuntimeError(f"Dev login failed with {response.status_code}; is DEV_LOGIN_ENABLED set?")
+            while self.remaining > 0:
+                self.remaining -= 1
+                name = rng.choices(names, weights)[0]
+                if name in ("delete", "view") and not self.entry_ids:
+                    name = "push"
+                counter = [0]
+                token = _query_counter.set(counter)
+                started = time.perf_counter()
+                try:
+                    ok, cursor = await self.run_operation(client, rng, name, cursor)
+                except Exception:
+                    ok = False
+                finally:
+                    _query_counter.reset(token)
+                result = self.results[name]
+                result.latencies.append(time.perf_counter() - started)
+                result.queries += counter[0]
+                result.errors += 0 if ok else 1
+
+    async def run_operation(self, client: Any, rng: random.Random, name: str, cursor: int) -> tuple[bool, int]:
+        if name == "pull":
+            response = await client.get("/api/entries", params={"since": cursor})
+            if response.status_code == 200:
+                cursor = response.json()["cursor"]
+            return response.status_code in (200, 304), cursor
+
+        if name == "view":
+            response = await client.get(f"/api/entry/{rng.choice(self.entry_ids)}")
+            return response.status_code == 200, cursor
+
+        if name == "delete":
+            # Take the id first so no other client picks it while the request runs.
+            entry_id = self.entry_ids.pop(rng.randrange(len(self.entry_ids)))
+            response = await client.delete(f"/api/entry/{entry_id}")
+            return response.status_code == 200, cursor
+
+        entries, new_ids = [], []
+        for _ in range(rng.randint(1, self.push_batch)):
+            self.created += 1
+            if self.entry_ids and rng.random() < 0.3:
+                entries.append(make_entry(rng, self.taste_tags, self.created, rng.choice(self.entry_ids)))
+            else:
+                entries.append(make_entry(rng, self.taste_tags, self.created))
+                new_ids.append(entries[-1]["id"])
+        response = await client.post("/api/entries", json=entries)
+        if response.status_code == 200:
+            self.entry_ids.extend(new_ids)
+        return response.status_code == 200, cursor
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(workload: Workload, elapsed: float) -> dict[str, Any]:
+    operations = {}
+    total = 0
+    for name, result in workload.results.items():
+        if not result.latencies:
+            continue
+        latencies = sorted(result.latencies)
+        total += len(latencies)
+        operations[name] = {
+            "count": len(latencies),
+            "errors": result.errors,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "queries_per_op": round(result.queries / len(latencies), 2),
+        }
+    return {
+        "operations": operations,
+        "total_operations": total,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_ops": round(total / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def drive(app: Any, workload: Workload, clients: int, operations: int) -> float:
+    workload.remaining = operations
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        await asyncio.gather(*(workload.client(app, index) for index in range(clients)))
+        return time.perf_counter() - started
+
+
+def run_size(app: Any, entries: int, args: argparse.Namespace, mix: dict[str, int]) -> dict[str, Any]:
+    started = time.perf_counter()
+    entry_ids = seed_database(entries, args.users, args.seed)
+    print(f"Seeded {args.users} users x {entries} entries in {time.perf_counter() - started:.1f}s", flush=True)
+
+    workload = Workload(entry_ids, entries, mix, args.push_batch, args.seed)
+    elapsed = asyncio.run(drive(app, workload, args.clients, args.operations))
+    return summarize(workload, elapsed)
+
+
+def print_report(entries: int, summary: dict[str, Any]) -> None:
+    print(
+        f"\n{entries} entries/user: {summary['total_operations']} ops in {summary['elapsed_s']}s, "
+        f"{summary['throughput_ops']} ops/s"
+    )
+    print(f"{'op':>7} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+    for name, stats in summary["operations"].items():
+        print(
+            f"{name:>7} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>8} "
+            f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['queries_per_op']:>8}"
+        )
+
+
+def find_regressions(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    problems = []
+    for size, summary in results.items():
+        expected = baseline.get(size)
+        if expected is None:
+            continue
+        floor = expected["throughput_ops"] * (1 - tolerance)
+        if summary["throughput_ops"] < floor:
+            problems.append(f"{size}: throughput {summary['throughput_ops']} ops/s < {floor:.1f}")
+        for name, stats in summary["operations"].items():
+            reference = expected["operations"].get(name)
+            if reference is None:
+                continue
+            if stats["errors"]:
+                problems.append(f"{size} {name}: {stats['errors']} errors")
+            ceiling = reference["p95_ms"] * (1 + tolerance)
+            if stats["p95_ms"] > ceiling:
+                problems.append(f"{size} {name}: p95 {stats['p95_ms']} ms > {ceiling:.2f} ms")
+            query_ceiling = reference["queries_per_op"] * (1 + QUERY_TOLERANCE) + 0.5
+            if stats["queries_per_op"] > query_ceiling:
+                problems.append(f"{size} {name}: {stats['queries_per_op']} queries/op > {query_ceiling:.2f}")
+    return problems
+
+
+def parse_mix(raw: Optional[str]) -> dict[str, int]:
+    if not raw:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Entries per user.")
+    parser.add_argument("--users", type=int, default=3, help="Synthetic users, including the dev user.")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients.")
+    parser.add_argument("--operations", type=int, default=2_000, help="Operations per size.")
+    parser.add_argument("--push-batch", type=int, default=5, help="Largest number of entries per push.")
+    parser.add_argument("--mix", help="Operation weights, e.g. pull=40,push=20,delete=10,view=30.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--check", action="store_true", help="Fail when results regress past the baseline.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed latency/throughput regression.")
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON.")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The database location is read when the backend is imported.
+        os.environ["COFFEELOG_DB_PATH"] = str(Path(tmp) / "loadtest.db")
+        os.environ["DEV_LOGIN_ENABLED"] = "1"
+        # Every client writes as the same user; measure capacity, not the per-user write limit.
+        os.environ.setdefault("COFFEELOG_WRITE_RATE", "0")
+        os.environ.setdefault("SESSION_SECRET", secrets.token_urlsafe(32))
+
+        from backend.db import create_db_and_tables
+        from backend.main import app
+
+        create_db_and_tables()
+        install_query_counter()
+
+        results = {}
+        for entries in args.entries:
+            summary = run_size(app, entries, args, mix)
+            results[str(entries)] = summary
+            print_report(entries, summary)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+    if args.update_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"\nUpdated baseline {args.baseline}")
+
+    if args.check:
+        if not args.baseline.exists():
+            raise SystemExit(f"No baseline at {args.baseline}; run with --update-baseline first.")
+        problems = find_regressions(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if problems:
+            print("\nRegressions:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Compare entry list serialization paths by time and peak memory.
+
+- ``orm``: ORM rows, ``EntryOut.model_validate``, response model validation
+  and stdlib JSON encoding (the previous ``GET /api/entries`` path).
+- ``orjson``: plain column tuples encoded to bytes with orjson in one go.
+- ``stream``: the same encoding over a server-side cursor, one partition at
+  a time, as ``GET /api/entries`` streams it.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.serialization --entries 100 10000 100000 --repeat 3
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.models import Base, EntryRecord
+from backend.serialization import STREAM_PARTITION_SIZE, encode_entries, entry_columns
+from backend.schemas import EntryOut
+
+USER_KEY = "bench-user"
+
+response_adapter = TypeAdapter(list[EntryOut])
+
+
+def seed(session: Session, count: int) -> None:
+    rows = [
+        {
+            "id": f"entry-{index:07d}",
+            "user_key": USER_KEY,
+            "created_at": "2024-01-01T08:00:00",
+            "brew_date": f"2024-01-01T08:{index % 60:02d}",
+            "coffee_name": f"Bench coffee {index}",
+            "roastery": "Bench Roasters",
+            "origin": "Ethiopia",
+            "brew_method": "V60",
+            "water_temp": 93.0,
+            "dose": 15.0,
+            "yield_amount": 250.0,
+            "aroma": ["jasmine", "bergamot"],
+            "flavor": ["peach", "black tea"],
+            "aftertaste": ["sweet"],
+            "defects": [],
+            "photo_hashes": [],
+            "acidity": 4,
+            "overall": 8,
+            "notes": "Clean cup with a long, sweet finish.",
+            "revision": index + 1,
+        }
+        for index in range(count)
+    ]
+    session.execute(insert(EntryRecord), rows)
+    session.commit()
+
+
+def orm_path(session: Session) -> int:
+    rows = session.execute(select(EntryRecord).where(EntryRecord.user_key == USER_KEY)).scalars().all()
+    entries = [EntryOut.model_validate(row, from_attributes=True) for row in rows]
+    validated = response_adapter.validate_python(entries, from_attributes=True)
+    return len(json.dumps(jsonable_encoder(validated, by_alias=True)).encode())
+
+
+def orjson_path(session: Session) -> int:
+    rows = session.execute(select(*entry_columns()).where(EntryRecord.user_key == USER_KEY)).all()
+    return len(b"[" + encode_entries(rows) + b"]")
+
+
+def stream_path(session: Session) -> int:
+    statement = select(*entry_columns()).where(EntryRecord.user_key == USER_KEY)
+    result = session.execute(statement.execution_options(yield_per=STREAM_PARTITION_SIZE))
+    sent = 2
+    for partition in result.partitions():
+        sent += len(encode_entries(partition)) + 1
+    return sent
+
+
+PATHS: dict[str, Callable[[Session], int]] = {
+    "orm": orm_path,
+    "orjson": orjson_path,
+    "stream": stream_path,
+}
+
+
+def measure(factory: sessionmaker, path: Callable[[Session], int], repeat: int) -> tuple[float, float, int]:
+    times = []
+    for _ in range(repeat):
+        with factory() as session:
+            started = time.perf_counter()
+            size = path(session)
+            times.append(time.perf_counter() - started)
+
+    with factory() as session:
+        tracemalloc.start()
+        path(session)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return statistics.median(times), peak, size
+
+
+def run(counts: list[int], repeat: int) -> None:
+    print(f"{'entries':>8} {'path':>7} {'ms':>10} {'peak MiB':>9} {'body KiB':>9}")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            Base.metadata.create_all(engine)
+            factory = sessionmaker(bind=engine, autoflush=False)
+            with factory() as session:
+                seed(session, count)
+
+            for name, path in PATHS.items():
+                elapsed, peak, size = measure(factory, path, repeat)
+                print(f"{count:>8} {name:>7} {elapsed * 1000:>10.1f} {peak / 2**20:>9.1f} {size / 1024:>9.0f}")
+            engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.entries, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
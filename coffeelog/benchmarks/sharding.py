@@ -0,0 +1,108 @@
+"""Compare write throughput of one database file with per-user shards.
+
+Each user is served by its own worker process that pushes single-entry
+upserts back to back, as several app workers would. ``single`` points every
+process at one file, so they queue on its write lock; ``sharded`` gives each
+user a file of its own. Within one process the writes are bound by Python
+CPU time rather than by SQLite, so the difference only shows across processes.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.sharding --users 1 4 8 --writes 200
+"""
+
+import argparse
+import multiprocessing
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from backend.db import configure_sqlite_engine
+from backend.entries import bulk_upsert
+from backend.schemas import EntryIn
+from backend.storage import create_shard_schema, shard_path
+
+
+def make_entry(index: int) -> EntryIn:
+    return EntryIn(
+        id=str(uuid.uuid4()),
+        created_at="2024-01-01T08:00:00",
+        brew_date="2024-01-01T08:00",
+        coffee_name=f"Bench coffee {index}",
+        roastery="Bench Roasters",
+        origin="Ethiopia",
+        aroma=["jasmine"],
+        overall=8,
+    )
+
+
+def open_writer(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    engine = configure_sqlite_engine(create_engine(f"sqlite:///{path}"), writer=True)
+    create_shard_schema(engine)
+    return engine
+
+
+def push(path: Path, user_key: str, writes: int, start, failures) -> None:
+    engine = open_writer(path)
+    entries = [make_entry(index) for index in range(writes)]
+    start.wait()
+    for entry in entries:
+        try:
+            with Session(engine) as session:
+                bulk_upsert(session, user_key, [entry])
+                session.commit()
+        except OperationalError:
+            # "database is locked" once the busy timeout runs out.
+            with failures.get_lock():
+                failures.value += 1
+    engine.dispose()
+
+
+def run(directory: Path, mode: str, users: int, writes: int) -> tuple[float, int]:
+    user_keys = [f"user-{user}" for user in range(users)]
+    if mode == "single":
+        open_writer(directory / "single.db").dispose()
+        paths = [directory / "single.db"] * users
+    else:
+        paths = [shard_path(directory, user_key) for user_key in user_keys]
+
+    start = multiprocessing.Event()
+    failures = multiprocessing.Value("i", 0)
+    workers = [
+        multiprocessing.Process(target=push, args=(path, user_key, writes, start, failures))
+        for path, user_key in zip(paths, user_keys)
+    ]
+    for worker in workers:
+        worker.start()
+    # Let the workers import and open their files before the clock starts.
+    time.sleep(2)
+    started = time.perf_counter()
+    start.set()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, failures.value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--writes", type=int, default=200, help="Upserts per user.")
+    args = parser.parse_args()
+
+    print(f"{'users':>6} {'mode':>8} {'writes/s':>10} {'locked':>7}")
+    for users in args.users:
+        for mode in ("single", "sharded"):
+            with tempfile.TemporaryDirectory() as tmp:
+                elapsed, failed = run(Path(tmp), mode, users, args.writes)
+            committed = users * args.writes - failed
+            print(f"{users:>6} {mode:>8} {committed / elapsed:>10.0f} {failed:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure how long a new worker process takes to import the app and start up.
+
+Each sample is a fresh interpreter that imports ``backend.main`` and runs the
+startup hook against a throwaway database, either a new file (``fresh``) or
+one that is already at the current schema version (``current``, the usual
+case when a worker is spawned). Also reports whether the Google OAuth stack
+was imported, which should only happen on the first Google sign-in.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --budget-ms 1500   # exit 1 when over budget
+"""
+
+import argparse
+import json
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Modules that dev login and an already signed-in session do not need.
+LAZY_MODULES = ("httpx", "google.auth", "google.oauth2")
+
+CHILD = f"""
+import asyncio, json, sys, time
+
+started = time.perf_counter()
+from backend.main import on_startup, writer
+imported = time.perf_counter()
+
+
+async def start():
+    on_startup()
+
+
+asyncio.run(start())
+ready = time.perf_counter()
+writer.stop()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "eager": [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def sample(db_path: Path) -> dict:
+    env = {
+        **os.environ,
+        "COFFEELOG_DB_PATH": str(db_path),
+        "SESSION_SECRET": os.environ.get("SESSION_SECRET") or secrets.token_urlsafe(32),
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=BASE_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat: int) -> dict[str, list[dict]]:
+    results: dict[str, list[dict]] = {"fresh": [], "current": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for index in range(repeat):
+            results["fresh"].append(sample(Path(tmp) / f"fresh-{index}.db"))
+        current = Path(tmp) / "current.db"
+        sample(current)
+        for _ in range(repeat):
+            results["current"].append(sample(current))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="Fail when import + startup on a current database exceeds this.")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    print(f"{'database':>9} {'import ms':>10} {'startup ms':>11} {'total ms':>9}")
+    for name, samples in results.items():
+        import_ms = statistics.median(sample["import_ms"] for sample in samples)
+        startup_ms = statistics.median(sample["startup_ms"] for sample in samples)
+        print(f"{name:>9} {import_ms:>10.1f} {startup_ms:>11.1f} {import_ms + startup_ms:>9.1f}")
+
+    eager = sorted({name for samples in results.values() for sample in samples for name in sample["eager"]})
+    print(f"OAuth modules imported at start: {', '.join(eager) or 'none'}")
+
+    failed = bool(eager)
+    if args.budget_ms is not None:
+        total = statistics.median(sample["import_ms"] + sample["startup_ms"] for sample in results["current"])
+        if total > args.budget_ms:
+            print(f"Start-up of {total:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Compare the bulk upsert path with the previous per-entry ORM loop.
+
+Run from the ``coffeelog`` directory:
+
+    python -m benchmarks.upsert --batch 10 100 500 --repeat 5
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.db import ensure_schema
+from backend.entries import bulk_upsert
+from backend.models import EntryRecord
+from backend.schemas import EntryIn
+
+USER_KEY = "bench-user"
+
+
+def make_entries(count: int) -> list[EntryIn]:
+    return [
+        EntryIn(
+            id=str(uuid.uuid4()),
+            created_at="2024-01-01T08:00:00",
+            brew_date="2024-01-01T08:00",
+            coffee_name=f"Bench coffee {index}",
+            roastery="Bench Roasters",
+            origin="Ethiopia",
+            brew_method="V60",
+            dose=15.0,
+            yield_amount=250.0,
+            aroma=["jasmine", "bergamot"],
+            flavor=["peach"],
+            overall=8,
+        )
+        for index in range(count)
+    ]
+
+
+def legacy_upsert(session: Session, user_key: str, entries: list[EntryIn]) -> list[EntryRecord]:
+    saved: list[EntryRecord] = []
+    for entry in entries:
+        data = entry.model_dump(by_alias=True)
+        if "yield" in data:
+            data["yield_amount"] = data.pop("yield")
+        data["user_key"] = user_key
+
+        existing = session.get(EntryRecord, entry.id)
+        if existing and existing.user_key != user_key:
+            raise RuntimeError("Entry belongs to another user")
+
+        if existing:
+            for key, value in data.items():
+                setattr(existing, key, value)
+            saved.append(existing)
+        else:
+            new_row = EntryRecord(**data)
+            session.add(new_row)
+            saved.append(new_row)
+
+    session.commit()
+    for row in saved:
+        session.refresh(row)
+    return saved
+
+
+def bulk(session: Session, user_key: str, entries: list[EntryIn]) -> list:
+    saved = bulk_upsert(session, user_key, entries)
+    session.commit()
+    return saved
+
+
+def run(batch_sizes: list[int], repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        # bulk_upsert also maintains the search index, stats and tags.
+        ensure_schema(engine)
+        factory = sessionmaker(bind=engine, autoflush=False)
+
+        statements = 0
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_statement(*_args):
+            nonlocal statements
+            statements += 1
+
+        print(f"{'batch':>6} {'path':>7} {'insert ms':>10} {'update ms':>10} {'update stmts':>13}")
+        for size in batch_sizes:
+            for name, upsert in (("legacy", legacy_upsert), ("bulk", bulk)):
+                insert_times, update_times = [], []
+                for _ in range(repeat):
+                    entries = make_entries(size)
+                    with factory() as session:
+                        started = time.perf_counter()
+                        upsert(session, USER_KEY, entries)
+                        insert_times.append(time.perf_counter() - started)
+                    statements = 0
+                    with factory() as session:
+                        started = time.perf_counter()
+                        upsert(session, USER_KEY, entries)
+                        update_times.append(time.perf_counter() - started)
+                    executed = statements
+                print(
+                    f"{size:>6} {name:>7} "
+                    f"{statistics.median(insert_times) * 1000:>10.2f} "
+                    f"{statistics.median(update_times) * 1000:>10.2f} "
+                    f"{executed:>13}"
+                )
+        engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.batch, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
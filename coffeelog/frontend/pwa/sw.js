@@ -1,5 +1,9 @@
 const APP_VERSION = new URL(self.location.href).searchParams.get("v") || "0.1";
 const CACHE_NAME = `coffeelog-shell-v${APP_VERSION}`;
+const API_CACHE_NAME = `coffeelog-api-v${APP_VERSION}`;
+// Single entries kept for revalidation and offline viewing; the oldest go first.
+const MAX_CACHED_ENTRIES = 100;
+const ENTRY_PATH = /^\/api\/entry\/[^/]+$/;
 const VERSION_QUERY = `?v=${encodeURIComponent(APP_VERSION)}`;
 const APP_SHELL = [
   "/",
@@ -39,7 +43,11 @@ self.addEventListener("activate", (event) => {
   event.waitUntil(
     caches
       .keys()
-      .then((keys) => Promise.all(keys.filter((key) => key !== CACHE_NAME).map((key) => caches.delete(key))))
+      .then((keys) =>
+        Promise.all(
+          keys.filter((key) => key !== CACHE_NAME && key !== API_CACHE_NAME).map((key) => caches.delete(key))
+        )
+      )
       .then(() => self.clients.claim())
   );
 });
@@ -50,6 +58,36 @@ self.addEventListener("message", (event) => {
   }
 });
 
+// Drop cached API responses matching `stale`, then entries beyond the bound.
+async function trimApiCache(cache, stale) {
+  const keys = await cache.keys();
+  await Promise.all(keys.filter((key) => stale(new URL(key.url))).map((key) => cache.delete(key)));
+  const entries = (await cache.keys()).filter((key) => ENTRY_PATH.test(new URL(key.url).pathname));
+  await Promise.all(entries.slice(0, -MAX_CACHED_ENTRIES).map((key) => cache.delete(key)));
+}
+
+// Revalidate a cached API response with its ETag; a 304 reuses the cached body.
+async function revalidateApi(request, stale) {
+  const cache = await caches.open(API_CACHE_NAME);
+  const cached = await cache.match(request);
+  const etag = cached?.headers.get("ETag");
+  const headers = new Headers(request.headers);
+  if (etag) headers.set("If-None-Match", etag);
+
+  // The service worker cache holds the validators, so bypass the HTTP cache.
+  const response = await fetch(new Request(request, { headers, cache: "no-store" }));
+  if (response.status === 304 && cached) return cached;
+  if (response.status === 200 && response.headers.has("ETag")) {
+    // Re-adding moves the entry to the end of the keys, so trimming drops the least recently fetched.
+    await cache.delete(request);
+    await cache.put(request, response.clone());
+    await trimApiCache(cache, (url) => url.href !== request.url && stale(url));
+  } else if (response.status === 404 || response.status === 410) {
+    await cache.delete(request);
+  }
+  return response;
+}
+
 self.addEventListener("fetch", (event) => {
   const request = event.request;
   const url = new URL(request.url);
@@ -70,26 +108,28 @@ self.addEventListener("fetch", (event) => {
   }
 
   if (url.pathname.startsWith("/api/")) {
-    event.respondWith(
-      fetch(request)
-        .then((response) => {
-          const copy = response.clone();
-          caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
-          return response;
-        })
-        .catch(async () => {
-          const cached = await caches.match(request);
-          if (cached) return cached;
-          return new Response(JSON.stringify([]), {
-            status: 200,
-            headers: { "Content-Type": "application/json" },
-          });
-        })
-    );
+    // Single entries and the delta pull carry ETags, so a repeat fetch costs a 304.
+    // Only the latest pull is kept: its URL changes with the sync cursor, and an
+    // older one is never asked for again. Photos, pages and the change feed
+    // never go through the cache.
+    const isEntry = ENTRY_PATH.test(url.pathname);
+    const isPull = url.pathname === "/api/entries" && [...url.searchParams.keys()].join() === "since";
+    if (isEntry || isPull) {
+      const stale = isPull ? (other) => other.pathname === "/api/entries" : () => false;
+      event.respondWith(
+        revalidateApi(request, stale).catch(
+          async () => (await caches.open(API_CACHE_NAME).then((cache) => cache.match(request))) || Response.error()
+        )
+      );
+    }
     return;
   }
 
   if (isNavigation) {
+    if (url.pathname === "/login") {
+      // Whoever signs in next must not be served the previous user's entries.
+      event.waitUntil(caches.delete(API_CACHE_NAME));
+    }
     event.respondWith(
       fetch(request)
         .then((response) => {
@@ -3,6 +3,8 @@ import { applyTranslations, getLanguage, setLanguage, t } from "/static/js/i18n.
 
 const APP_VERSION = document.documentElement.dataset.appVersion || "0.1";
 const APP_VERSION_KEY = "coffeelog_app_version";
+// Cleared on /login, so a different account never resumes from it.
+const SYNC_CURSOR_KEY = "coffeelog_sync_cursor";
 const PROCESS_OPTIONS = ["Washed", "Natural", "Honey", "Anaerobic"];
 const BREW_METHOD_OPTIONS = ["Espresso", "V60", "Aeropress", "Chemex", "French Press", "Cupping"];
 const BREW_METHOD_ICONS = {
@@ -24,6 +26,30 @@ const COUNTRIES_ENDPOINT_BASE = "/static/data/countries";
 let deferredInstallPrompt = null;
 let countriesCache = null;
 
+// Entry fields the create form edits; an edit of a synced entry sends only those that changed.
+const PATCH_FIELDS = [
+  "brew_date",
+  "coffee_name",
+  "roastery",
+  "origin",
+  "process",
+  "brew_method",
+  "water_temp",
+  "dose",
+  "brew_time",
+  "aroma",
+  "flavor",
+  "aftertaste",
+  "defects",
+  "acidity",
+  "sweetness",
+  "bitterness",
+  "body",
+  "balance",
+  "overall",
+  "notes",
+];
+
 function normalizeEntry(entry) {
   return entry;
 }
@@ -1339,8 +1365,60 @@ async function processSelectedPhotos(files) {
   return output;
 }
 
+// Writes the server turns away with 429 are retried after its Retry-After, a few times at most.
+const MAX_WRITE_RETRIES = 3;
+
+async function fetchWrite(url, options) {
+  for (let attempt = 0; ; attempt += 1) {
+    const res = await fetch(url, options);
+    if (res.status !== 429 || attempt >= MAX_WRITE_RETRIES) return res;
+    const seconds = Math.min(Number(res.headers.get("Retry-After")) || 1, 30);
+    await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+  }
+}
+
+async function sha256Hex(blob) {
+  if (!crypto.subtle) return null;
+  const digest = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, "0")).join("");
+}
+
+async function uploadEntryPhotos(entry) {
+  const photos = Array.isArray(entry.photos) ? entry.photos : [];
+  // Entries pulled from the server have no local data URLs; keep their references.
+  if (photos.length === 0) return Array.isArray(entry.photo_hashes) ? entry.photo_hashes : [];
+
+  const known = new Set(entry.photo_hashes || []);
+  const hashes = [];
+  for (const dataUrl of photos) {
+    const blob = await (await fetch(dataUrl)).blob();
+    const localHash = await sha256Hex(blob);
+    if (localHash && known.has(localHash)) {
+      hashes.push(localHash);
+      continue;
+    }
+
+    const body = new FormData();
+    body.append("file", blob, "photo");
+    const res = await fetchWrite("/api/photos", { method: "POST", body });
+    if (!res.ok) {
+      throw new Error(`Photo upload failed (${res.status})`);
+    }
+    const uploaded = await res.json();
+    hashes.push(uploaded.sha256);
+  }
+  return hashes;
+}
+
+function entryPhotoSources(entry) {
+  const photos = Array.isArray(entry.photos) ? entry.photos : [];
+  if (photos.length > 0) return photos;
+  const hashes = Array.isArray(entry.photo_hashes) ? entry.photo_hashes : [];
+  return hashes.map((hash) => `/api/photos/${encodeURIComponent(hash)}?size=display`);
+}
+
 async function mergeWithLocalEntry(entry) {
-  const localEntry = await getEntry(entry.id);
+  const { patch, ...localEntry } = (await getEntry(entry.id)) || {};
   return {
     ...localEntry,
     ...normalizeEntry(entry),
@@ -1348,6 +1426,79 @@ async function mergeWithLocalEntry(entry) {
   };
 }
 
+// Pushes larger than this are gzip-compressed when the browser can do it natively.
+const COMPRESS_REQUEST_BYTES = 16 * 1024;
+
+async function jsonRequestBody(value) {
+  const json = JSON.stringify(value);
+  if (json.length < COMPRESS_REQUEST_BYTES || typeof CompressionStream === "undefined") {
+    return { body: json, headers: { "Content-Type": "application/json" } };
+  }
+  const stream = new Blob([json]).stream().pipeThrough(new CompressionStream("gzip"));
+  return {
+    body: await new Response(stream).blob(),
+    headers: { "Content-Type": "application/json", "Content-Encoding": "gzip" },
+  };
+}
+
+// Fields of an edited entry still to be sent as a patch, or null when the server needs the whole entry.
+function pendingPatchFields(previous, next, photosChanged) {
+  if (!previous || (!previous.synced && !Array.isArray(previous.patch))) return null;
+  const fields = new Set(previous.patch || []);
+  for (const key of PATCH_FIELDS) {
+    if (JSON.stringify(previous[key] ?? null) !== JSON.stringify(next[key] ?? null)) fields.add(key);
+  }
+  if (photosChanged) fields.add("photo_hashes");
+  return [...fields];
+}
+
+// The server's limit on operations per POST /api/entries/batch.
+const MAX_BATCH_OPERATIONS = 1000;
+
+function batchOperation(entry) {
+  if (entry.deleted) return { op: "delete", id: entry.id };
+  return {
+    op: "patch",
+    id: entry.id,
+    patch: Object.fromEntries(entry.patch.map((key) => [key, entry[key] ?? null])),
+  };
+}
+
+// Sends queued deletes and pending field patches in as few batch requests as the server allows.
+// Returns the patched entries the server no longer has, which must be pushed whole.
+async function pushPendingChanges(entries, userKey) {
+  const missing = [];
+  for (let start = 0; start < entries.length; start += MAX_BATCH_OPERATIONS) {
+    const chunk = entries.slice(start, start + MAX_BATCH_OPERATIONS);
+    const { body, headers } = await jsonRequestBody({ operations: chunk.map(batchOperation) });
+    const res = await fetchWrite("/api/entries/batch", {
+      method: "POST",
+      headers: { ...headers, "X-User-Key": userKey },
+      body,
+    });
+    if (!res.ok) {
+      throw new Error(`Push failed (${res.status})`);
+    }
+
+    const { results } = await res.json();
+    const saved = [];
+    chunk.forEach((entry, index) => {
+      const { status, revision } = results[index];
+      // A 404 delete never reached the server or was already deleted; either way it is gone.
+      if (entry.deleted) return;
+      if (status === 404) {
+        missing.push(entry);
+      } else {
+        const { patch, ...rest } = entry;
+        saved.push({ ...rest, revision, synced: true });
+      }
+    });
+    await putEntries(saved);
+    await Promise.all(chunk.filter((entry) => entry.deleted).map((entry) => deleteEntry(entry.id)));
+  }
+  return missing;
+}
+
 async function syncEntries(messageEl) {
   if (!navigator.onLine) {
     showMessage(messageEl, t("sync.offline_saved", "Offline - saved locally."), "warn");
@@ -1358,14 +1509,21 @@ async function syncEntries(messageEl) {
   const unsynced = await getUnsyncedEntries();
 
   try {
-    if (unsynced.length > 0) {
-      const pushRes = await fetch("/api/entries", {
+    const pending = unsynced.filter((entry) => entry.deleted || Array.isArray(entry.patch));
+    const full = unsynced.filter((entry) => !entry.deleted && !Array.isArray(entry.patch));
+    for (const entry of unsynced) {
+      if (!entry.deleted) entry.photo_hashes = await uploadEntryPhotos(entry);
+    }
+    if (pending.length > 0) {
+      full.push(...(await pushPendingChanges(pending, userKey)));
+    }
+
+    if (full.length > 0) {
+      const { body, headers } = await jsonRequestBody(full.map(({ synced, photos, patch, ...entry }) => entry));
+      const pushRes = await fetchWrite("/api/entries", {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-User-Key": userKey,
-        },
-        body: JSON.stringify(unsynced.map(({ synced, photos, ...entry }) => entry)),
+        headers: { ...headers, "X-User-Key": userKey },
+        body,
       });
 
       if (!pushRes.ok) {
@@ -1377,7 +1535,8 @@ async function syncEntries(messageEl) {
       await putEntries(pushedMerged);
     }
 
-    const pullRes = await fetch("/api/entries", {
+    const since = Number(localStorage.getItem(SYNC_CURSOR_KEY)) || 0;
+    const pullRes = await fetch(`/api/entries?since=${since}`, {
       headers: { "X-User-Key": userKey },
     });
 
@@ -1385,9 +1544,11 @@ async function syncEntries(messageEl) {
       throw new Error(`Pull failed (${pullRes.status})`);
     }
 
-    const remote = await pullRes.json();
-    const remoteMerged = await Promise.all(remote.map((entry) => mergeWithLocalEntry(entry)));
+    const changes = await pullRes.json();
+    const remoteMerged = await Promise.all(changes.entries.map((entry) => mergeWithLocalEntry(entry)));
     await putEntries(remoteMerged);
+    await Promise.all(changes.deleted.map((id) => deleteEntry(id)));
+    localStorage.setItem(SYNC_CURSOR_KEY, String(changes.cursor));
 
     showMessage(messageEl, t("sync.complete", "Sync complete."), "ok");
 
@@ -1561,8 +1722,11 @@ async function handleCreateSubmit(event) {
     defects: [],
     notes: form.notes.value.trim(),
     photos: finalPhotos,
+    photo_hashes: photos.length > 0 ? [] : existingEntry?.photo_hashes || [],
     synced: false,
   };
+  const patchFields = pendingPatchFields(existingEntry, entry, photos.length > 0);
+  if (patchFields) entry.patch = patchFields;
 
   await putEntry(entry);
 
@@ -1639,8 +1803,8 @@ async function initCreatePage() {
 
   if (!editEntry) {
     form.brew_date.value = toLocalDateTimeInputValue();
-  } else if (Array.isArray(editEntry.photos) && editEntry.photos.length > 0) {
-    renderPhotoPreview(editEntry.photos.slice(0, MAX_PHOTOS));
+  } else if (entryPhotoSources(editEntry).length > 0) {
+    renderPhotoPreview(entryPhotoSources(editEntry).slice(0, MAX_PHOTOS));
   }
   setupCreateStepper(form);
   if (photoPickerOpenBtn && form.photos) {
@@ -1889,16 +2053,18 @@ async function initViewPage() {
       deleteBtn.disabled = true;
       try {
         if (navigator.onLine) {
-          const res = await fetch(`/api/entry/${encodeURIComponent(entry.id)}`, {
+          const res = await fetchWrite(`/api/entry/${encodeURIComponent(entry.id)}`, {
             method: "DELETE",
             headers: { "X-User-Key": ensureUserKey() },
           });
           if (!res.ok && res.status !== 404) {
             throw new Error(`Delete failed (${res.status})`);
           }
+          await deleteEntry(entry.id);
+        } else {
+          // Offline: keep a tombstone, sent with the other pending changes on the next sync.
+          await putEntry({ id: entry.id, deleted: true, synced: false });
         }
-
-        await deleteEntry(entry.id);
         window.location.href = "/";
       } catch (_error) {
         deleteBtn.disabled = false;
@@ -1956,7 +2122,7 @@ async function initViewPage() {
 
   if (photoBlock && photoSlider) {
     photoSlider.innerHTML = "";
-    const photos = Array.isArray(entry.photos) ? entry.photos.slice(0, MAX_PHOTOS) : [];
+    const photos = entryPhotoSources(entry).slice(0, MAX_PHOTOS);
     if (photos.length === 0) {
       photoBlock.hidden = true;
     } else {
@@ -2100,8 +2266,31 @@ async function initSettingsPage() {
   });
 }
 
+// Pull as soon as another device commits a change instead of waiting for a manual sync.
+function initChangeStream() {
+  if (!("EventSource" in window)) return;
+  const messageEl = document.getElementById("sync-message");
+  const since = Number(localStorage.getItem(SYNC_CURSOR_KEY)) || 0;
+  const source = new EventSource(`/api/changes/stream?since=${since}`);
+  let pending = null;
+
+  const scheduleSync = (event) => {
+    const cursor = Number(localStorage.getItem(SYNC_CURSOR_KEY)) || 0;
+    // Our own pushes come back as notices too; they are already pulled.
+    if (Number(event.lastEventId) <= cursor || pending) return;
+    pending = setTimeout(async () => {
+      pending = null;
+      await syncEntries(messageEl);
+    }, 500);
+  };
+
+  ["upsert", "delete", "resync"].forEach((type) => source.addEventListener(type, scheduleSync));
+  window.addEventListener("pagehide", () => source.close());
+}
+
 async function initListPage() {
   await renderEntryList();
+  initChangeStream();
 }
 
 document.addEventListener("DOMContentLoaded", async () => {
@@ -2114,7 +2303,10 @@ document.addEventListener("DOMContentLoaded", async () => {
   initOnlineStatus();
   initSyncButtons();
 
-  if (location.pathname === "/") {
+  if (location.pathname === "/login") {
+    // Logging out or switching accounts lands here; the cursor belongs to the previous user.
+    localStorage.removeItem(SYNC_CURSOR_KEY);
+  } else if (location.pathname === "/") {
     await initListPage();
   } else if (location.pathname === "/create") {
     await initCreatePage();
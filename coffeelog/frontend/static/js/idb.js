@@ -46,24 +46,31 @@ async function withStore(mode, action) {
   });
 }
 
-export async function getEntry(id) {
+// Entries deleted offline stay in the store as tombstones ({ id, deleted: true })
+// until the delete reaches the server; only getUnsyncedEntries returns them.
+function readAllEntries() {
   return withStore("readonly", (store) => {
     return new Promise((resolve, reject) => {
-      const req = store.get(id);
-      req.onsuccess = () => resolve(req.result || null);
+      const req = store.getAll();
+      req.onsuccess = () => resolve(req.result || []);
       req.onerror = () => reject(req.error);
     });
   });
 }
 
-export async function getAllEntries() {
-  const entries = await withStore("readonly", (store) => {
+export async function getEntry(id) {
+  const entry = await withStore("readonly", (store) => {
     return new Promise((resolve, reject) => {
-      const req = store.getAll();
-      req.onsuccess = () => resolve(req.result || []);
+      const req = store.get(id);
+      req.onsuccess = () => resolve(req.result || null);
       req.onerror = () => reject(req.error);
     });
   });
+  return entry?.deleted ? null : entry;
+}
+
+export async function getAllEntries() {
+  const entries = (await readAllEntries()).filter((entry) => !entry.deleted);
 
   return entries.sort((a, b) => {
     const dateA = `${a.brew_date || ""}|${a.created_at || ""}`;
@@ -91,6 +98,6 @@ export async function deleteEntry(id) {
 }
 
 export async function getUnsyncedEntries() {
-  const entries = await getAllEntries();
+  const entries = await readAllEntries();
   return entries.filter((entry) => !entry.synced);
 }
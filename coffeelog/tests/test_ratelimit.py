@@ -0,0 +1,45 @@
+import threading
+import time
+
+from backend.ratelimit import TokenBucketLimiter
+
+
+class YieldingRate(float):
+    """A rate that lets other threads run while a bucket is being refilled."""
+
+    def __rmul__(self, other):
+        time.sleep(0)
+        return float(other) * float(self)
+
+
+def test_concurrent_acquires_never_exceed_the_burst():
+    # A clock that never advances, so no tokens are refilled during the run.
+    limiter = TokenBucketLimiter(rate=YieldingRate(1), burst=50, clock=lambda: 1000.0)
+    threads, attempts = 8, 200
+    start = threading.Barrier(threads)
+    admitted = []
+
+    def hammer():
+        start.wait()
+        admitted.append(sum(limiter.acquire("user") == 0 for _ in range(attempts)))
+
+    workers = [threading.Thread(target=hammer) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sum(admitted) == 50
+    assert limiter.admitted == 50
+    assert limiter.rejected == threads * attempts - 50
+
+
+def test_sweep_keeps_buckets_taken_meanwhile():
+    now = [0.0]
+    limiter = TokenBucketLimiter(rate=1, burst=2, clock=lambda: now[0])
+    assert limiter.acquire("a") == 0
+    now[0] = 10.0
+    # The sweep drops the refilled bucket of "a" but not the one "b" just drained.
+    assert limiter.acquire("b", cost=2) == 0
+    assert limiter.acquire("b") > 0
+    assert limiter.active_keys() == 1
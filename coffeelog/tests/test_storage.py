@@ -0,0 +1,66 @@
+import asyncio
+
+from backend.storage import Shard, ShardPool
+
+
+def slow_close(monkeypatch):
+    """Make closing a shard take a while, so evictions overlap as under load."""
+    close = Shard.close
+
+    async def delayed(shard):
+        await asyncio.sleep(0.05)
+        await close(shard)
+
+    monkeypatch.setattr(Shard, "close", delayed)
+
+
+def test_concurrent_evictions_over_the_limit(tmp_path, monkeypatch):
+    slow_close(monkeypatch)
+
+    async def scenario():
+        pool = ShardPool(tmp_path, max_open=8)
+        try:
+            for key in ("a", "b", "c"):
+                pool._release(await pool._acquire(key))
+            pool.max_open = 1
+            # Both acquires evict from overlapping snapshots of the pool.
+            results = await asyncio.gather(pool._acquire("d"), pool._acquire("e"), return_exceptions=True)
+            assert [result for result in results if isinstance(result, BaseException)] == []
+            for shard in results:
+                pool._release(shard)
+            assert [shard.active for shard in pool._shards.values()] == [0] * len(pool._shards)
+            assert not {"a", "b", "c"} & set(pool._shards)
+
+            # Released shards can be evicted again.
+            pool._release(await pool._acquire("f"))
+            assert list(pool._shards) == ["f"]
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_eviction_keeps_a_shard_reopened_under_the_same_key(tmp_path, monkeypatch):
+    slow_close(monkeypatch)
+
+    async def scenario():
+        pool = ShardPool(tmp_path, max_open=8)
+        try:
+            for key in ("a", "b"):
+                pool._release(await pool._acquire(key))
+            old_b = pool._shards["b"]
+            # Lists [a, b], then waits while "a" closes.
+            first = asyncio.ensure_future(pool._evict(lambda _shard: True))
+            await asyncio.sleep(0)
+            # Meanwhile another eviction closes "b" and a request opens it again.
+            second = asyncio.ensure_future(pool._evict(lambda shard: shard is old_b))
+            await asyncio.sleep(0)
+            new_b = await pool._acquire("b")
+            pool._release(new_b)
+            await asyncio.gather(first, second)
+            assert new_b is not old_b
+            assert pool._shards.get("b") is new_b
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())